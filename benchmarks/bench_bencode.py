@@ -0,0 +1,138 @@
+"""
+Compares the bencode decoder of the crawler with better_bencode on the three
+kinds of values it decodes: KRPC datagrams, the header of the ut_metadata
+messages framed in the peer wire buffer and info dicts, decoded whole and
+skipping their pieces.
+
+better_bencode falls back to pure Python when its C extension is not built, the
+implementation in use is printed first.
+
+    $ python -m benchmarks.bench_bencode
+"""
+import os
+import time
+from io import BytesIO
+from typing import Callable, List
+
+import better_bencode
+
+from stilio.crawler.bittorrent import decoder
+from stilio.crawler.bittorrent.bencoding import encode
+from stilio.crawler.bittorrent.metadata import MAX_PIECE_HEADER_LENGTH, PIECE_SIZE
+
+
+def krpc_samples() -> List[bytes]:
+    return [
+        encode(
+            {
+                b"y": b"r",
+                b"t": b"aa",
+                b"v": b"LT\x01\x02",
+                b"r": {b"id": os.urandom(20), b"nodes": os.urandom(26 * 8)},
+            }
+        ),
+        encode(
+            {
+                b"y": b"q",
+                b"q": b"get_peers",
+                b"t": os.urandom(2),
+                b"a": {b"id": os.urandom(20), b"info_hash": os.urandom(20)},
+            }
+        ),
+        encode(
+            {
+                b"y": b"q",
+                b"q": b"announce_peer",
+                b"t": os.urandom(2),
+                b"a": {
+                    b"id": os.urandom(20),
+                    b"info_hash": os.urandom(20),
+                    b"port": 51413,
+                    b"implied_port": 1,
+                    b"token": os.urandom(8),
+                },
+            }
+        ),
+    ]
+
+
+def piece_messages() -> List[bytearray]:
+    """ut_metadata data messages as they sit in the receive buffer, the header
+    is decoded from the first bytes of the message
+    """
+    return [
+        bytearray(
+            encode({b"msg_type": 1, b"piece": piece, b"total_size": 10 * PIECE_SIZE})
+            + os.urandom(PIECE_SIZE)
+        )
+        for piece in range(10)
+    ]
+
+
+def info_dict(files: int, pieces: int) -> bytes:
+    return encode(
+        {
+            b"name": b"Some torrent",
+            b"piece length": 1 << 18,
+            b"files": [
+                {b"length": 1 << 20, b"path": [b"directory", b"file %d.mkv" % i]}
+                for i in range(files)
+            ],
+            b"pieces": os.urandom(20 * pieces),
+        }
+    )
+
+
+def bench(name: str, samples: list, function: Callable, seconds: float = 1) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for sample in samples:
+            function(sample)
+        count += len(samples)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>36}: {count / elapsed:>12,.0f} values/s")
+    return count / elapsed
+
+
+def better_bencode_prefix(data: bytes):
+    stream = BytesIO(data)
+    return better_bencode.load(stream), stream.tell()
+
+
+def main() -> None:
+    print(f"better_bencode: {better_bencode.loads.__module__}")
+
+    krpc = krpc_samples()
+    bench("KRPC, better_bencode", krpc, better_bencode.loads)
+    bench("KRPC, decoder", krpc, decoder.decode)
+
+    # What the metadata worker did before: copy the header, stream it
+    messages = piece_messages()
+    bench(
+        "ut_metadata header, better_bencode",
+        messages,
+        lambda message: better_bencode_prefix(
+            bytes(memoryview(message)[:MAX_PIECE_HEADER_LENGTH])
+        ),
+    )
+    bench(
+        "ut_metadata header, decoder",
+        messages,
+        lambda message: decoder.decode_prefix(message, end=MAX_PIECE_HEADER_LENGTH),
+    )
+
+    for files, pieces in ((1, 2_000), (100, 8_000), (10_000, 40_000)):
+        info = [info_dict(files, pieces)]
+        label = f"{files} files {len(info[0]) // 1024} KiB"
+        bench(f"{label}, better_bencode", info, better_bencode.loads)
+        bench(f"{label}, decoder", info, decoder.decode)
+        bench(
+            f"{label}, skipping pieces",
+            info,
+            lambda data: decoder.decode(data, skip_keys={b"pieces"}),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Times building the file listing of synthetic torrents with 1k, 100k and 1M files,
+both with every file in one directory and spread over nested directories, and
+building the whole torrent row including the JSON encoding of the listing.
+
+    $ python -m benchmarks.bench_file_tree
+"""
+import time
+from typing import Callable, List
+
+from stilio.persistence.utils import build_file_tree, get_torrent_row
+
+SIZES = (1_000, 100_000, 1_000_000)
+
+
+def flat_metadata(files: int) -> dict:
+    return {
+        b"name": b"flat",
+        b"files": [
+            {b"path": [b"dir", f"file{i:07}.bin".encode()], b"length": i}
+            for i in range(files)
+        ],
+    }
+
+
+def nested_metadata(files: int) -> dict:
+    return {
+        b"name": b"nested",
+        b"files": [
+            {
+                b"path": [
+                    f"season{i // 10_000}".encode(),
+                    f"disc{i // 100 % 100}".encode(),
+                    f"file{i:07}.bin".encode(),
+                ],
+                b"length": i,
+            }
+            for i in range(files)
+        ],
+    }
+
+
+def timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench(name: str, make_metadata: Callable[[int], dict]) -> None:
+    for size in SIZES:
+        metadata = make_metadata(size)
+        paths: List[List[str]] = [
+            [item.decode() for item in file[b"path"]] for file in metadata[b"files"]
+        ]
+        tree = timed(lambda: build_file_tree(paths))
+        row = timed(lambda: get_torrent_row(b"\x00" * 20, metadata))
+        print(
+            f"{name:>6} {size:>9,} files: tree {tree * 1000:>9.1f} ms, "
+            f"row {row * 1000:>9.1f} ms, {size / row:>11,.0f} files/s"
+        )
+
+
+if __name__ == "__main__":
+    bench("flat", flat_metadata)
+    bench("nested", nested_metadata)
@@ -0,0 +1,77 @@
+"""
+Compares the KRPC fast path parser with the generic bencode decoder on a traffic
+mix similar to the one the crawler receives.
+
+    $ python -m benchmarks.bench_krpc
+"""
+import os
+import time
+from typing import Callable, List
+
+from stilio.crawler.bittorrent.bencoding import decode, encode
+from stilio.crawler.dht import krpc
+
+
+def make_datagrams() -> List[bytes]:
+    find_node_response = encode(
+        {
+            b"y": b"r",
+            b"t": b"aa",
+            b"v": b"LT\x01\x02",
+            b"ip": os.urandom(6),
+            b"r": {b"id": os.urandom(20), b"nodes": os.urandom(26 * 8)},
+        }
+    )
+    get_peers_query = encode(
+        {
+            b"y": b"q",
+            b"q": b"get_peers",
+            b"t": os.urandom(2),
+            b"a": {b"id": os.urandom(20), b"info_hash": os.urandom(20)},
+        }
+    )
+    announce_peer_query = encode(
+        {
+            b"y": b"q",
+            b"q": b"announce_peer",
+            b"t": os.urandom(2),
+            b"a": {
+                b"id": os.urandom(20),
+                b"info_hash": os.urandom(20),
+                b"port": 51413,
+                b"implied_port": 1,
+                b"token": os.urandom(2),
+            },
+        }
+    )
+    ping_query = encode(
+        {b"y": b"q", b"q": b"ping", b"t": os.urandom(2), b"a": {b"id": os.urandom(20)}}
+    )
+    return (
+        [find_node_response] * 60
+        + [get_peers_query] * 30
+        + [announce_peer_query] * 5
+        + [ping_query] * 5
+    )
+
+
+def generic(data: bytes):
+    message = decode(data)
+    if isinstance(message.get(b"r"), dict):
+        return message[b"r"].get(b"nodes")
+    return message.get(b"q"), message.get(b"a")
+
+
+def bench(name: str, function: Callable, datagrams: List[bytes], rounds: int) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for datagram in datagrams:
+            function(datagram)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {rounds * len(datagrams) / elapsed:>12,.0f} datagrams/s")
+
+
+if __name__ == "__main__":
+    datagrams = make_datagrams()
+    bench("generic", generic, datagrams, rounds=500)
+    bench("fast path", krpc.parse, datagrams, rounds=500)
@@ -0,0 +1,160 @@
+"""
+Replays a fixed KRPC and peer wire workload under every event loop implementation
+available, so the faster one can be picked for the crawler hosts.
+
+The KRPC workload sends get_peers queries over loopback to an RPC that parses
+them and answers with its templates, keeping a window of queries in flight. The
+peer wire workload fetches metadata from a local peer with MetadataWorker.
+
+    $ python -m benchmarks.bench_loops
+"""
+import asyncio
+import hashlib
+import os
+import time
+from typing import Tuple
+
+from stilio.crawler import loops
+from stilio.crawler.bittorrent.bencoding import decode, encode
+from stilio.crawler.bittorrent.metadata import MetadataWorker
+from stilio.crawler.dht.krpc import KRPCMessage
+from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.rpc import RPC
+
+QUERIES = 50_000
+WINDOW = 64
+FETCHES = 500
+CONCURRENT_FETCHES = 50
+METADATA_SIZE = 64 * 1024
+
+
+class QueryClient(asyncio.DatagramProtocol):
+    def __init__(self, address: Tuple[str, int], queries: int):
+        self.address = address
+        self.remaining = queries
+        self.received = 0
+        self.done = asyncio.get_event_loop().create_future()
+        self.query = encode(
+            {
+                b"y": b"q",
+                b"q": b"get_peers",
+                b"t": b"aa",
+                b"a": {b"id": os.urandom(20), b"info_hash": os.urandom(20)},
+            }
+        )
+
+    def _send(self) -> None:
+        if self.remaining:
+            self.remaining -= 1
+            self.transport.sendto(self.query, self.address)
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        for _ in range(WINDOW):
+            self._send()
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.received += 1
+        if self.remaining:
+            self._send()
+        elif self.received >= QUERIES - WINDOW:
+            # Some datagrams may be lost on loopback under load
+            if not self.done.done():
+                self.done.set_result(None)
+
+
+async def krpc_workload() -> float:
+    loop = asyncio.get_event_loop()
+    rpc = RPC(Node.create_random("127.0.0.1", 0))
+
+    def on_response(rpc: RPC, message: KRPCMessage, address: Tuple[str, int]) -> None:
+        assert message.t is not None and message.info_hash is not None
+        rpc.respond_get_peers(
+            tid=message.t,
+            info_hash=message.info_hash,
+            nid=rpc.node.nid,
+            address=address,
+        )
+
+    rpc.on_response = on_response
+    await rpc.start()
+    address = rpc.udp_node.transport.get_extra_info("sockname")
+
+    start = time.perf_counter()
+    transport, client = await loop.create_datagram_endpoint(
+        lambda: QueryClient(address, QUERIES), local_addr=("127.0.0.1", 0)
+    )
+    await asyncio.wait_for(client.done, timeout=60)
+    elapsed = time.perf_counter() - start
+
+    transport.close()
+    rpc.udp_node.transport.close()
+    return client.received / elapsed
+
+
+async def serve_metadata(info: bytes, reader, writer) -> None:
+    try:
+        handshake = await reader.readexactly(68)
+        writer.write(handshake[:25] + b"\x10" + handshake[26:48] + b"p" * 20)
+
+        def write_message(message: bytes) -> None:
+            writer.write(len(message).to_bytes(4, "big") + message)
+
+        write_message(
+            bytes([20, 0])
+            + encode({b"m": {b"ut_metadata": 3}, b"metadata_size": len(info)})
+        )
+        while True:
+            length = int.from_bytes(await reader.readexactly(4), "big")
+            message = await reader.readexactly(length)
+            if message[:2] == bytes([20, 3]):
+                piece = decode(message[2:])[b"piece"]
+                write_message(
+                    bytes([20, 1])
+                    + encode({b"msg_type": 1, b"piece": piece})
+                    + info[piece * 16384 : (piece + 1) * 16384]
+                )
+    except (asyncio.IncompleteReadError, ConnectionError):
+        writer.close()
+
+
+async def peer_wire_workload() -> float:
+    info = encode({b"name": os.urandom(METADATA_SIZE // 2).hex().encode()})
+    info_hash = hashlib.sha1(info).digest()
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_metadata(info, reader, writer), "127.0.0.1", 0
+    )
+    address = server.sockets[0].getsockname()
+    semaphore = asyncio.Semaphore(CONCURRENT_FETCHES)
+
+    async def fetch() -> None:
+        async with semaphore:
+            metadata = await MetadataWorker(info_hash, address).work()
+            assert metadata == info
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(FETCHES)))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    return FETCHES / elapsed
+
+
+def bench(name: str) -> None:
+    loop = loops.new_event_loop(name)
+    asyncio.set_event_loop(loop)
+    try:
+        queries = loop.run_until_complete(krpc_workload())
+        fetches = loop.run_until_complete(peer_wire_workload())
+    finally:
+        loop.close()
+    print(
+        f"{name:>8}: {queries:>10,.0f} KRPC round trips/s, "
+        f"{fetches:>8,.0f} metadata fetches/s"
+    )
+
+
+if __name__ == "__main__":
+    for name in loops.available():
+        bench(name)
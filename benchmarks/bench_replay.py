@@ -0,0 +1,214 @@
+"""
+Replays a capture of received datagrams through the receive path of a
+CrawlingService, from UDPNode.datagram_received to the handlers, as fast as
+possible. Sockets, metadata fetches and the database are stubbed out, so the
+numbers only depend on the parser, the dispatcher and the handlers.
+
+Captures are recorded by crawlers started with CRAWLER_CAPTURE_DIR set, without
+one a synthetic capture with a traffic mix similar to the live DHT is replayed.
+
+    $ python -m benchmarks.bench_replay [capture] [--repeat N]
+
+The first pass measures the throughput, the second one wraps every stage with a
+timer to break the time down, so its total is higher.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from stilio.config import (
+    CRAWLER_SEEN_INFO_HASHES_CACHE_SIZE,
+    CRAWLER_SEEN_INFO_HASHES_CAPACITY,
+    CRAWLER_SEEN_INFO_HASHES_ERROR_RATE,
+)
+from stilio.crawler.bittorrent.bencoding import encode
+from stilio.crawler.dedup import InfoHashFilter
+from stilio.crawler.dht import krpc
+from stilio.crawler.dht.capture import DatagramRecorder, read_capture
+from stilio.crawler.dht.constants import SAMPLE_INFOHASHES_TID_PREFIX
+from stilio.crawler.dht.crawling import CrawlingService
+
+Address = Tuple[str, int]
+
+SYNTHETIC_DATAGRAMS = 200_000
+# Datagrams between two emulated ticks, which empty the routing table
+TICK_DATAGRAMS = 20_000
+HANDLERS = (
+    "on_find_node",
+    "on_get_peers",
+    "on_announce_peer",
+    "on_sample_infohashes",
+    "on_get_peers_response",
+)
+
+
+class NullTransport:
+    def __init__(self) -> None:
+        self.sent = 0
+
+    def sendto(self, data: bytes, address: Address) -> None:
+        self.sent += 1
+
+    def is_closing(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+def public_ip() -> bytes:
+    return bytes([random.randint(1, 99), *os.urandom(3)])
+
+
+def synthetic_datagram(info_hashes: List[bytes]) -> bytes:
+    kind = random.random()
+    tid = os.urandom(2)
+    if kind < 0.60:
+        nodes = b"".join(
+            os.urandom(20) + public_ip() + random.randint(1024, 65535).to_bytes(2, "big")
+            for _ in range(8)
+        )
+        message = {b"y": b"r", b"t": tid, b"r": {b"id": os.urandom(20), b"nodes": nodes}}
+    elif kind < 0.85:
+        message = {
+            b"y": b"q",
+            b"q": b"get_peers",
+            b"t": tid,
+            b"a": {b"id": os.urandom(20), b"info_hash": random.choice(info_hashes)},
+        }
+    elif kind < 0.93:
+        message = {
+            b"y": b"q",
+            b"q": b"announce_peer",
+            b"t": tid,
+            b"a": {
+                b"id": os.urandom(20),
+                b"info_hash": random.choice(info_hashes),
+                b"port": 51413,
+                b"implied_port": 1,
+                b"token": os.urandom(2),
+            },
+        }
+    elif kind < 0.98:
+        message = {b"y": b"q", b"q": b"ping", b"t": tid, b"a": {b"id": os.urandom(20)}}
+    else:
+        message = {
+            b"y": b"r",
+            b"t": SAMPLE_INFOHASHES_TID_PREFIX + tid,
+            b"r": {
+                b"id": os.urandom(20),
+                b"interval": 300,
+                b"num": 100,
+                b"samples": b"".join(random.sample(info_hashes, 20)),
+            },
+        }
+    return encode(message)
+
+
+def write_synthetic_capture(path: str, count: int) -> None:
+    info_hashes = [os.urandom(20) for _ in range(5_000)]
+    recorder = DatagramRecorder(path)
+    for _ in range(count):
+        ip = ".".join(str(byte) for byte in public_ip())
+        recorder.record(synthetic_datagram(info_hashes), (ip, random.randint(1024, 65535)))
+    recorder.close()
+
+
+def make_crawler() -> CrawlingService:
+    crawler = CrawlingService(metrics_port=None)
+    for rpc in crawler.rpcs:
+        rpc.udp_node.connection_made(NullTransport())  # type: ignore
+    # Nothing is stored and no metadata is fetched
+    crawler.seen_info_hashes = InfoHashFilter(
+        lookup=lambda info_hash: False,
+        capacity=CRAWLER_SEEN_INFO_HASHES_CAPACITY,
+        error_rate=CRAWLER_SEEN_INFO_HASHES_ERROR_RATE,
+        cache_size=CRAWLER_SEEN_INFO_HASHES_CACHE_SIZE,
+    )
+    crawler.metadata_fetcher.fetch = lambda *args, **kwargs: None  # type: ignore
+    return crawler
+
+
+def replay(crawler: CrawlingService, records: List[Tuple[bytes, Address]]) -> float:
+    udp_nodes = [rpc.udp_node for rpc in crawler.rpcs]
+    start = time.perf_counter()
+    for i, (data, address) in enumerate(records):
+        udp_nodes[i % len(udp_nodes)].datagram_received(data, address)
+        if i % TICK_DATAGRAMS == 0:
+            crawler.routing_table.nodes.clear()
+    return time.perf_counter() - start
+
+
+def timed(stats: Dict[str, float], name: str, function: Callable) -> Callable:
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats[name] += time.perf_counter() - start
+
+    return wrapper
+
+
+def replay_stages(
+    crawler: CrawlingService, records: List[Tuple[bytes, Address]]
+) -> Dict[str, float]:
+    stats: Dict[str, float] = defaultdict(float)
+    parse = krpc.parse
+    krpc.parse = timed(stats, "parse", parse)
+    for rpc in crawler.rpcs:
+        assert rpc.on_response is not None
+        rpc.on_response = timed(stats, "dispatch", rpc.on_response)
+    for name in HANDLERS:
+        setattr(crawler, name, timed(stats, name, getattr(crawler, name)))
+    try:
+        total = replay(crawler, records)
+    finally:
+        krpc.parse = parse
+
+    # Every stage includes the ones it calls
+    stats["dispatch"] -= sum(stats[name] for name in HANDLERS)
+    stats["udp and rpc"] = total - stats["parse"] - stats["dispatch"] - sum(
+        stats[name] for name in HANDLERS
+    )
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", nargs="?", help="capture file to replay")
+    parser.add_argument("--repeat", type=int, default=3, help="number of replays")
+    args = parser.parse_args()
+    # Debug logs of every message would dominate the measures
+    logging.disable(logging.INFO)
+
+    path = args.capture
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.capture")
+        write_synthetic_capture(path, SYNTHETIC_DATAGRAMS)
+    records = [(bytes(data), address) for _, data, address in read_capture(path)]
+    print(f"Replaying {len(records):,} datagrams from {path}")
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    for _ in range(args.repeat):
+        elapsed = replay(make_crawler(), records)
+        print(f"{len(records) / elapsed:>12,.0f} datagrams/s")
+
+    stats = replay_stages(make_crawler(), records)
+    total = sum(stats.values())
+    for name, seconds in sorted(stats.items(), key=lambda item: -item[1]):
+        print(
+            f"{name:>22}: {seconds * 1000:>9.1f} ms, "
+            f"{seconds / len(records) * 1e6:>6.2f} us/datagram, "
+            f"{seconds / total:>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
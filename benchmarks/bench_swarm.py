@@ -0,0 +1,477 @@
+"""
+Load tests a crawler end to end against a simulated swarm on the loopback
+interface, no network involved.
+
+The swarm runs in its own process. Thousands of DHT nodes, each one on its own
+127.x.y.z address, answer every query with 8 other nodes of the swarm, and once
+they have been queried by the crawler they send it announce_peer and get_peers
+queries at a fixed rate for a set of synthetic torrents. The first nodes are
+also BitTorrent peers that serve the metadata of every torrent over ut_metadata,
+they are the ones announcing.
+
+The crawler is a regular CrawlingService bootstrapped from the swarm, with its
+MetadataFetcher and ingest stage. Torrents are stored in the configured database
+with --database, otherwise storing is stubbed out.
+
+    $ python -m benchmarks.bench_swarm [--duration S] [--nodes N] [--peers N]
+        [--torrents N] [--announces N] [--get-peers N] [--database]
+
+The swarm can also be run alone, for crawlers started with
+CRAWLER_BOOTSTRAP_NODES set to the address it prints and
+CRAWLER_ALLOW_RESERVED_ADDRESSES=1.
+
+    $ python -m benchmarks.bench_swarm --swarm-only
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Set, Tuple
+
+from stilio.crawler.bittorrent.bencoding import BencoderError, decode, encode
+
+Address = Tuple[str, int]
+
+PIECE_SIZE = 16384
+# Nodes returned in every response, as many as real nodes do
+NODES_PER_RESPONSE = 8
+# Seconds between two batches of queries sent to the crawler
+SEND_INTERVAL = 0.01
+REPORT_INTERVAL = 5
+
+
+def node_ip(index: int) -> str:
+    """Loopback address of a swarm node, the whole 127.0.0.0/8 goes to lo"""
+    index += 2
+    return f"127.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+
+
+def synthetic_torrent(index: int, size: int) -> bytes:
+    """Bencoded info dictionary of about size bytes, the same for every index so
+    it does not have to be kept in memory
+    """
+    rng = random.Random(index)
+    files = [
+        {b"length": rng.randint(1, 1 << 30), b"path": [b"dir", b"file-%d" % i]}
+        for i in range(rng.randint(1, 10))
+    ]
+    info = {
+        b"name": f"Synthetic torrent {index}".encode(),
+        b"piece length": 1 << 18,
+        b"files": files,
+    }
+    pieces = max(0, size - len(encode(info)) - 20) // 20 * 20
+    info[b"pieces"] = rng.getrandbits(pieces * 8).to_bytes(pieces, "big")
+    return encode(info)
+
+
+class SimulatedNode(asyncio.DatagramProtocol):
+    """DHT node of the swarm, answers every query with nodes of the swarm"""
+
+    def __init__(self, swarm: "Swarm", ip: str):
+        self.swarm = swarm
+        self.ip = ip
+        self.nid = os.urandom(20)
+        self.port = 0
+        self.compact = b""
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+        # BitTorrent port, if the node is also a peer
+        self.peer_port: Optional[int] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.port = transport.get_extra_info("sockname")[1]
+        self.compact = (
+            self.nid
+            + bytes(map(int, self.ip.split(".")))
+            + (self.port.to_bytes(2, "big"))
+        )
+
+    def error_received(self, exc: Exception) -> None:
+        pass
+
+    def send(self, message: dict, address: Address) -> None:
+        if self.transport:
+            self.transport.sendto(encode(message), address)
+
+    def datagram_received(self, data: bytes, address: Address) -> None:
+        try:
+            message = decode(data)
+            if message[b"y"] != b"q":
+                return
+            tid = message[b"t"]
+        except (BencoderError, KeyError, TypeError):
+            return
+
+        self.swarm.on_query(address)
+        self.send(
+            {
+                b"y": b"r",
+                b"t": tid,
+                b"r": {
+                    b"id": self.nid,
+                    b"nodes": self.swarm.compact_nodes(),
+                    b"token": b"tk",
+                },
+            },
+            address,
+        )
+
+
+class Swarm:
+    """Simulated DHT nodes and BitTorrent peers of a set of synthetic torrents"""
+
+    def __init__(
+        self,
+        nodes: int,
+        peers: int,
+        torrents: int,
+        metadata_size: int,
+        announces_per_second: float,
+        get_peers_per_second: float,
+    ):
+        self.node_count = nodes
+        self.peer_count = min(peers, nodes)
+        self.metadata_size = metadata_size
+        self.announces_per_second = announces_per_second
+        self.get_peers_per_second = get_peers_per_second
+
+        # Info hash -> index of the synthetic torrent
+        self.torrents: Dict[bytes, int] = {
+            hashlib.sha1(synthetic_torrent(i, metadata_size)).digest(): i
+            for i in range(torrents)
+        }
+        self.info_hashes = list(self.torrents)
+
+        self.nodes: List[SimulatedNode] = []
+        self.peers: List[SimulatedNode] = []
+        self.servers: List[asyncio.AbstractServer] = []
+        # Addresses of the crawler nodes that queried the swarm
+        self.crawlers: List[Address] = []
+        self._crawlers: Set[Address] = set()
+        self._sender: Optional[asyncio.Future] = None
+
+        # Stats
+        self.queries = 0
+        self.announces = 0
+        self.get_peers = 0
+        self.metadata_served = 0
+
+    @property
+    def router(self) -> Address:
+        return self.nodes[0].ip, self.nodes[0].port
+
+    async def start(self) -> None:
+        loop = asyncio.get_event_loop()
+        for i in range(self.node_count):
+            node = SimulatedNode(self, node_ip(i))
+            await loop.create_datagram_endpoint(lambda: node, local_addr=(node.ip, 0))
+            self.nodes.append(node)
+
+        for node in self.nodes[: self.peer_count]:
+            server = await asyncio.start_server(self.serve_metadata, node.ip, 0)
+            node.peer_port = server.sockets[0].getsockname()[1]
+            self.peers.append(node)
+            self.servers.append(server)
+
+        self._sender = asyncio.ensure_future(self._send_periodically())
+
+    async def stop(self) -> None:
+        if self._sender:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+        for server in self.servers:
+            server.close()
+        for node in self.nodes:
+            if node.transport:
+                node.transport.close()
+
+    def compact_nodes(self) -> bytes:
+        return b"".join(
+            node.compact for node in random.sample(self.nodes, NODES_PER_RESPONSE)
+        )
+
+    def on_query(self, address: Address) -> None:
+        self.queries += 1
+        if address not in self._crawlers:
+            self._crawlers.add(address)
+            self.crawlers.append(address)
+
+    def announce_peer(self) -> None:
+        peer = random.choice(self.peers)
+        peer.send(
+            {
+                b"y": b"q",
+                b"q": b"announce_peer",
+                b"t": os.urandom(2),
+                b"a": {
+                    b"id": peer.nid,
+                    b"info_hash": random.choice(self.info_hashes),
+                    b"port": peer.peer_port,
+                    b"token": b"tk",
+                },
+            },
+            random.choice(self.crawlers),
+        )
+        self.announces += 1
+
+    def send_get_peers(self) -> None:
+        node = random.choice(self.nodes)
+        node.send(
+            {
+                b"y": b"q",
+                b"q": b"get_peers",
+                b"t": os.urandom(2),
+                b"a": {b"id": node.nid, b"info_hash": random.choice(self.info_hashes)},
+            },
+            random.choice(self.crawlers),
+        )
+        self.get_peers += 1
+
+    async def _send_periodically(self) -> None:
+        """Sends the queries in small batches, carrying the fractions over"""
+        loop = asyncio.get_event_loop()
+        announces = get_peers = 0.0
+        last = loop.time()
+        while True:
+            await asyncio.sleep(SEND_INTERVAL)
+            now = loop.time()
+            if not self.crawlers:
+                last = now
+                continue
+            announces += self.announces_per_second * (now - last)
+            get_peers += self.get_peers_per_second * (now - last)
+            last = now
+            for _ in range(int(announces)):
+                self.announce_peer()
+            for _ in range(int(get_peers)):
+                self.send_get_peers()
+            announces -= int(announces)
+            get_peers -= int(get_peers)
+
+    async def serve_metadata(self, reader, writer) -> None:
+        def write_message(message: bytes) -> None:
+            writer.write(len(message).to_bytes(4, "big") + message)
+
+        try:
+            handshake = await reader.readexactly(68)
+            index = self.torrents.get(handshake[28:48])
+            if index is None:
+                return
+            info = synthetic_torrent(index, self.metadata_size)
+            writer.write(handshake[:25] + b"\x10" + handshake[26:48] + b"p" * 20)
+            write_message(
+                bytes([20, 0])
+                + encode({b"m": {b"ut_metadata": 3}, b"metadata_size": len(info)})
+            )
+            sent = set()
+            while True:
+                length = int.from_bytes(await reader.readexactly(4), "big")
+                message = await reader.readexactly(length)
+                if message[:2] != bytes([20, 3]):
+                    continue
+                piece = decode(message[2:])[b"piece"]
+                write_message(
+                    bytes([20, 1])
+                    + encode({b"msg_type": 1, b"piece": piece})
+                    + info[piece * PIECE_SIZE : (piece + 1) * PIECE_SIZE]
+                )
+                sent.add(piece)
+                if len(sent) * PIECE_SIZE >= len(info):
+                    self.metadata_served += 1
+                    sent.clear()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queries answered": self.queries,
+            "announces sent": self.announces,
+            "get_peers sent": self.get_peers,
+            "metadata served": self.metadata_served,
+        }
+
+
+def run_swarm(args: argparse.Namespace, connection: Optional[Connection]) -> None:
+    """Runs the swarm until the connection receives anything, or forever"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    swarm = Swarm(
+        args.nodes,
+        args.peers,
+        args.torrents,
+        args.metadata_size,
+        args.announces,
+        args.get_peers,
+    )
+    loop.run_until_complete(swarm.start())
+    host, port = swarm.router
+
+    if connection is None:
+        print(
+            f"Swarm of {len(swarm.nodes):,} nodes and {len(swarm.peers):,} peers "
+            f"running, bootstrap from it with:\n"
+            f"    CRAWLER_BOOTSTRAP_NODES={host}:{port} "
+            f"CRAWLER_ALLOW_RESERVED_ADDRESSES=1",
+            flush=True,
+        )
+        loop.run_forever()
+        return
+
+    connection.send(swarm.router)
+    loop.run_until_complete(loop.run_in_executor(None, connection.recv))
+    loop.run_until_complete(swarm.stop())
+    connection.send(swarm.stats())
+    loop.close()
+
+
+class Counts:
+    def __init__(self) -> None:
+        self.info_hashes: Set[bytes] = set()
+        self.fetched = 0
+        self.fetched_info_hashes: Set[bytes] = set()
+        self.stored = 0
+
+    def snapshot(self) -> Tuple[int, int, int]:
+        return len(self.info_hashes), self.fetched, self.stored
+
+
+def store_nothing(rows: List[dict]) -> List[str]:
+    """Stands in for the database, every row counts as inserted"""
+    return [row["info_hash"] for row in rows]
+
+
+def run_crawler(args: argparse.Namespace, router: Address) -> Tuple[float, Counts]:
+    from stilio.crawler.dht.crawling import CrawlingService
+    from stilio.persistence import database
+    from stilio.persistence import utils as db_utils
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    if args.database:
+        database.init()
+
+    crawler = CrawlingService(
+        port=args.port,
+        metrics_port=None,
+        bootstrap_nodes=[router],
+        allow_reserved_addresses=True,
+    )
+    if not args.database:
+        crawler.seen_info_hashes._lookup = lambda info_hash: False
+        crawler._seed_seen_info_hashes = lambda: None  # type: ignore
+        db_utils.store_torrent_rows = store_nothing
+        db_utils.update_peer_counts = lambda rows: len(rows)
+
+    counts = Counts()
+    fetch_metadata = crawler._fetch_metadata
+    on_metadata_result = crawler.metadata_fetcher.on_metadata_result
+    assert on_metadata_result is not None
+    on_stored = crawler.pipeline.on_stored
+
+    def counted_fetch_metadata(info_hash: bytes, address: Address) -> None:
+        counts.info_hashes.add(info_hash)
+        fetch_metadata(info_hash, address)
+
+    def counted_metadata_result(info_hash: bytes, metadata: bytes) -> None:
+        counts.fetched += 1
+        counts.fetched_info_hashes.add(info_hash)
+        on_metadata_result(info_hash, metadata)
+
+    def counted_stored(rows: List[dict]) -> None:
+        counts.stored += len(rows)
+        if on_stored:
+            on_stored(rows)
+
+    crawler._fetch_metadata = counted_fetch_metadata  # type: ignore
+    crawler.metadata_fetcher.on_metadata_result = counted_metadata_result
+    crawler.pipeline.on_stored = counted_stored
+
+    start = time.perf_counter()
+    last_time, last_counts = start, (0, 0, 0)
+
+    def report() -> None:
+        nonlocal last_time, last_counts
+        now = time.perf_counter()
+        current = counts.snapshot()
+        elapsed = now - last_time
+        rates = [(new - old) / elapsed for new, old in zip(current, last_counts)]
+        print(
+            f"{now - start:>5.0f} s: {rates[0]:>8,.0f} info hashes/s, "
+            f"{rates[1]:>6,.0f} metadata fetched/s, {rates[2]:>6,.0f} stored/s, "
+            f"{crawler.routing_table.max_size:,} max neighbors"
+        )
+        last_time, last_counts = now, current
+        crawler.loop.call_later(REPORT_INTERVAL, report)
+
+    crawler.loop.call_later(REPORT_INTERVAL, report)
+    crawler.loop.call_later(args.duration, crawler.stop)
+    crawler.run()
+    return time.perf_counter() - start, counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--nodes", type=int, default=2_000, help="DHT nodes")
+    parser.add_argument("--peers", type=int, default=200, help="BitTorrent peers")
+    parser.add_argument("--torrents", type=int, default=20_000)
+    parser.add_argument(
+        "--metadata-size", type=int, default=8_192, help="bytes per torrent"
+    )
+    parser.add_argument(
+        "--announces", type=float, default=1_000, help="announce_peer per second"
+    )
+    parser.add_argument(
+        "--get-peers", type=float, default=2_000, help="get_peers per second"
+    )
+    parser.add_argument("--port", type=int, default=16881, help="crawler port")
+    parser.add_argument(
+        "--database", action="store_true", help="store the torrents in the database"
+    )
+    parser.add_argument("--swarm-only", action="store_true")
+    args = parser.parse_args()
+    # Debug logs of every message would dominate the measures
+    logging.disable(logging.INFO)
+
+    if args.swarm_only:
+        run_swarm(args, None)
+        return
+
+    connection, child_connection = multiprocessing.Pipe()
+    swarm = multiprocessing.get_context("spawn").Process(
+        target=run_swarm, args=(args, child_connection), daemon=True
+    )
+    swarm.start()
+    router = connection.recv()
+    print(f"Swarm of {args.nodes:,} nodes and {args.peers:,} peers at {router}")
+
+    elapsed, counts = run_crawler(args, router)
+
+    connection.send(None)
+    stats = connection.recv()
+    swarm.join()
+
+    discovered, fetched, stored = counts.snapshot()
+    print(
+        f"{discovered:,} info hashes discovered, {discovered / elapsed:,.0f}/s\n"
+        f"{fetched:,} metadata fetched, {fetched / elapsed:,.0f}/s, "
+        f"{fetched - len(counts.fetched_info_hashes):,} of them again\n"
+        f"{stored:,} torrents stored, {stored / elapsed:,.0f}/s"
+    )
+    for name, value in stats.items():
+        print(f"Swarm {name}: {value:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,10 +14,87 @@ DATABASE_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 CRAWLER_DEBUG_LEVEL = logging.DEBUG
 CRAWLER_ADDRESS = "0.0.0.0"
 CRAWLER_PORT = 6881
+# Node ids hosted by every crawler process, node i listens on CRAWLER_PORT + i
+CRAWLER_VIRTUAL_NODES = 1
+CRAWLER_WORKERS = 1
+# "auto" uses uvloop when it is installed, "asyncio" or "uvloop" force one of them
+CRAWLER_EVENT_LOOP = os.getenv("CRAWLER_EVENT_LOOP", "auto")
+# Workers share CRAWLER_PORT when True, otherwise worker i uses CRAWLER_PORT + i
+CRAWLER_REUSE_PORT = True
+# "host:port,host:port" in the environment replaces the public routers, e.g. with
+# a simulated swarm
 CRAWLER_BOOTSTRAP_NODES = [
+    (host, int(port))
+    for host, _, port in (
+        address.strip().rpartition(":")
+        for address in os.getenv("CRAWLER_BOOTSTRAP_NODES", "").split(",")
+        if address.strip()
+    )
+] or [
     ("router.bittorrent.com", 6881),
     ("dht.transmissionbt.com", 6881),
     ("router.utorrent.com", 6881),
 ]
+# Nodes and peers with private, loopback or otherwise reserved addresses are
+# skipped unless set to "1", only meant for simulated swarms
+CRAWLER_ALLOW_RESERVED_ADDRESSES = os.getenv("CRAWLER_ALLOW_RESERVED_ADDRESSES") == "1"
 CRAWLER_METADATA_MAX_SIMULTANEOUS_WORKERS_PER_INFO_HASH = 3
+# Metadata workers at once in every crawler process, capped by the fds limit
+CRAWLER_METADATA_MAX_CONNECTIONS = 1_000
+CRAWLER_METADATA_MAX_PEERS_PER_INFO_HASH = 16
+# Distinct announcers remembered per info hash, further ones are only counted
+CRAWLER_METADATA_MAX_ANNOUNCERS_PER_INFO_HASH = 256
+CRAWLER_METADATA_MAX_CANDIDATES = 50_000
+CRAWLER_METADATA_CANDIDATE_TTL = 600  # In seconds
+# Peers and info hashes that fail are skipped for an exponentially growing delay
+CRAWLER_METADATA_BACKOFF_BASE_DELAY = 60  # In seconds
+CRAWLER_METADATA_BACKOFF_MAX_DELAY = 3600  # In seconds
+CRAWLER_METADATA_BACKOFF_MAX_SIZE = 200_000
+# Distinct peers that must fail an info hash before it is backed off
+CRAWLER_METADATA_BACKOFF_MIN_PEERS = 3
 CRAWLER_METADATA_FETCH_TIMEOUT = 100  # In seconds
+CRAWLER_SEEN_INFO_HASHES_CAPACITY = 1_000_000
+CRAWLER_SEEN_INFO_HASHES_ERROR_RATE = 0.001
+CRAWLER_SEEN_INFO_HASHES_CACHE_SIZE = 100_000
+CRAWLER_PERSISTENCE_BATCH_SIZE = 500
+CRAWLER_PERSISTENCE_FLUSH_INTERVAL = 1  # In seconds
+CRAWLER_PERSISTENCE_MAX_QUEUE_SIZE = 10_000
+# A batch failing for other reasons than its rows, e.g. the database being down,
+# is retried after 1, 2, 4... seconds before giving up on it
+CRAWLER_PERSISTENCE_MAX_RETRIES = 5
+CRAWLER_PERSISTENCE_RETRY_DELAY = 1  # In seconds
+CRAWLER_CLAIMS_SLOTS = 1 << 20
+# Seconds an info hash stored by a worker is skipped by the other workers
+CRAWLER_CLAIMS_DONE_TTL = 86_400
+# Seconds workers have to store what they fetched once asked to stop
+CRAWLER_STOP_TIMEOUT = 60
+# Directory of the warm restart snapshots, one per crawler process, None disables
+CRAWLER_SNAPSHOT_DIR = os.getenv("CRAWLER_SNAPSHOT_DIR")
+CRAWLER_SNAPSHOT_INTERVAL = 60  # In seconds
+# Directory the received datagrams are recorded to, one file per crawler process,
+# for offline replays, None disables
+CRAWLER_CAPTURE_DIR = os.getenv("CRAWLER_CAPTURE_DIR")
+CRAWLER_CAPTURE_MAX_BYTES = 1 << 30
+# Seeders and leechers estimated from the announce_peer and get_peers traffic
+CRAWLER_POPULARITY = True
+CRAWLER_POPULARITY_WINDOW = 1800  # In seconds
+CRAWLER_POPULARITY_FLUSH_INTERVAL = 60  # In seconds
+CRAWLER_POPULARITY_MAX_INFO_HASHES = 100_000
+# Metadata is decoded in a process pool, 0 decodes it in the event loop
+CRAWLER_INGEST_WORKERS = 2
+CRAWLER_INGEST_MAX_IN_FLIGHT = 64
+CRAWLER_INGEST_MAX_QUEUE_SIZE = 1_000
+CRAWLER_INGEST_INLINE_SIZE = 16_384  # In bytes, smaller metadata skips the pool
+# Outbound UDP budget, unlimited if None
+CRAWLER_UDP_MAX_PACKETS_PER_SECOND = None
+CRAWLER_UDP_MAX_BYTES_PER_SECOND = None
+CRAWLER_UDP_SEND_QUEUE_SIZE = 10_000
+CRAWLER_UDP_DROP_POLICY = "oldest"  # "oldest" or "newest"
+# Active discovery of info hashes through BEP 51 sample_infohashes queries
+CRAWLER_DISCOVERY = True
+CRAWLER_DISCOVERY_SAMPLES_PER_TICK = 100
+CRAWLER_DISCOVERY_MAX_LOOKUPS = 5_000
+CRAWLER_DISCOVERY_LOOKUP_TIMEOUT = 30  # In seconds
+# Prometheus metrics, worker i serves them on CRAWLER_METRICS_PORT + i, None disables
+CRAWLER_METRICS_ADDRESS = "127.0.0.1"
+CRAWLER_METRICS_PORT = 9881
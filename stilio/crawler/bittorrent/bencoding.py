@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from io import BytesIO
-from typing import Any
+from typing import Any, Optional, Tuple
 
 import better_bencode
 
+from stilio.crawler.bittorrent import decoder
+
 KRPCTypes = Any
 KRPCList = Any
 KRPCDict = Any
@@ -28,9 +29,13 @@ def decode(bytes_object: bytes) -> Any:
         raise BencoderError(e)
 
 
-def decode2(bytes_object: bytes) -> Any:
-    bytes_io = BytesIO(bytes_object)
+def decode2(
+    data: decoder.Buffer, start: int = 0, end: Optional[int] = None
+) -> Tuple[Any, int]:
+    """Decodes the value at data[start], e.g. a message framed in a receive
+    buffer, returns it with the offset right after it
+    """
     try:
-        return better_bencode.load(bytes_io), bytes_io.tell()
-    except Exception as e:
+        return decoder.decode_prefix(data, start, end)
+    except decoder.DecodeError as e:
         raise BencoderError(e)
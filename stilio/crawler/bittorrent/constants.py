@@ -24,6 +24,8 @@ BT_PROTOCOL_PREFIX = bytes(PSTR_LEN + PSTR + RESERVED, encoding="utf-8")
 # Extension
 ID_EXTENDED_MESSAGE = 20
 ID_EXTENDED_HANDSHAKE = 0
+# Extended message id the peers use to send us ut_metadata messages
+UT_METADATA_ID = 1
 EXTENDED_HANDSHAKE_MESSAGE = bytes(
     [ID_EXTENDED_MESSAGE, ID_EXTENDED_HANDSHAKE]
-) + encode({b"m": {b"ut_metadata": 1}})
+) + encode({b"m": {b"ut_metadata": UT_METADATA_ID}})
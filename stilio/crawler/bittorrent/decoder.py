@@ -0,0 +1,211 @@
+"""
+Bencode decoder for untrusted input.
+
+Values are decoded from bytes, bytearrays or memoryviews, e.g. a message framed
+in a receive buffer, and the offset right after the value is returned with it,
+so the payload that follows can be found without wrapping the buffer in a
+stream. Only the bytes between start and end are copied, and only when the
+buffer is not already a bytes object holding just the value.
+
+Every decode is bounded: the encoded value cannot be longer than max_length
+bytes, nested deeper than max_depth or have more than max_elements values, so a
+crafted message cannot make the crawler allocate or loop without limit.
+
+Values of the keys in skip_keys are not decoded, they are returned as a
+memoryview of their encoded form that can be decoded later if ever needed, e.g.
+the pieces of an info dict that take most of its size and are never stored.
+"""
+from __future__ import annotations
+
+from typing import Any, Container, List, Optional, Tuple, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_DICT = ord("d")
+_LIST = ord("l")
+_INT = ord("i")
+_END = ord("e")
+_COLON = ord(":")
+
+MAX_LENGTH = 10_000_000
+MAX_DEPTH = 32
+MAX_ELEMENTS = 1 << 20
+# Longer lengths and integers are rejected before being converted
+MAX_DIGITS = 20
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _skip(data: bytes, i: int, max_depth: int) -> Tuple[int, int]:
+    """Returns the offset right after the value starting at i and the number of
+    values in it, checking it without building it. Raises IndexError if it is
+    truncated.
+    """
+    find = data.find
+    depth = 0
+    elements = 0
+    while True:
+        c = data[i]
+        if 48 <= c <= 57:
+            colon = find(b":", i, i + MAX_DIGITS + 1)
+            length = data[i:colon]
+            if colon < 0 or not length.isdigit():
+                raise DecodeError(f"Invalid string length at {i}")
+            i = colon + 1 + int(length)
+            if i > len(data):
+                raise DecodeError(f"String out of bounds at {i}")
+        elif c == _INT:
+            stop = find(b"e", i, i + MAX_DIGITS + 2)
+            if stop < 0 and i + MAX_DIGITS + 2 > len(data):
+                raise IndexError
+            digits = data[i + 1 : stop]
+            if stop < 0 or not (
+                digits.isdigit() or digits[:1] == b"-" and digits[1:].isdigit()
+            ):
+                raise DecodeError(f"Invalid integer at {i}")
+            i = stop + 1
+        elif c == _LIST or c == _DICT:
+            depth += 1
+            if depth > max_depth:
+                raise DecodeError(f"Too deeply nested at {i}")
+            i += 1
+            elements += 1
+            continue
+        elif c == _END and depth:
+            depth -= 1
+            i += 1
+        else:
+            raise DecodeError(f"Invalid value at {i}")
+
+        elements += 1
+        if not depth:
+            return i, elements
+
+
+def decode_prefix(
+    data: Buffer,
+    start: int = 0,
+    end: Optional[int] = None,
+    max_length: int = MAX_LENGTH,
+    max_depth: int = MAX_DEPTH,
+    max_elements: int = MAX_ELEMENTS,
+    skip_keys: Container[bytes] = (),
+) -> Tuple[Any, int]:
+    """Decodes the value starting at data[start], returns it with the offset
+    right after it, anything after the value is left alone.
+
+    Values are decoded in a single loop with an explicit stack of the lists and
+    dicts being filled, so no function is called per value.
+
+    Args:
+
+        data: buffer the value is decoded from
+        start: offset of the value
+        end: offset the value must end before, the end of data if None
+        max_length: maximum length of the encoded value
+        max_depth: maximum number of nested lists and dicts
+        max_elements: maximum number of values, keys included
+        skip_keys: keys whose values are returned as memoryviews of their
+            encoded form instead of being decoded
+
+    Raises DecodeError if the value is invalid, truncated or over the limits.
+    """
+    if end is None or end > len(data):
+        end = len(data)
+    end = min(end, start + max_length)
+    if type(data) is not bytes or start or end != len(data):
+        data = bytes(memoryview(data)[start:end])
+
+    find = data.find
+    size = len(data)
+    elements = max_elements
+    # List or dict being filled, the key of its current value if it is a dict
+    # and the same for the ones containing it
+    container: Any = None
+    is_list = False
+    key: Optional[bytes] = None
+    stack: List[Tuple[Any, bool, Optional[bytes]]] = []
+    value: Any
+    i = 0
+    try:
+        while True:
+            c = data[i]
+            if 48 <= c <= 57:
+                if data[i + 1] == _COLON:
+                    i += 2
+                    stop = i + c - 48
+                elif data[i + 2] == _COLON and 48 <= data[i + 1] <= 57:
+                    i += 3
+                    stop = i + (c - 48) * 10 + data[i - 2] - 48
+                else:
+                    colon = find(b":", i, i + MAX_DIGITS + 1)
+                    length = data[i:colon]
+                    if colon < 0 or not length.isdigit():
+                        raise DecodeError(f"Invalid string length at {start + i}")
+                    i = colon + 1
+                    stop = i + int(length)
+                if stop > size:
+                    raise DecodeError(f"String out of bounds at {start + i}")
+                value = data[i:stop]
+                i = stop
+            elif c == _INT:
+                stop = find(b"e", i, i + MAX_DIGITS + 2)
+                if stop < 0:
+                    if i + MAX_DIGITS + 2 > size:
+                        raise IndexError
+                    raise DecodeError(f"Invalid integer at {start + i}")
+                digits = data[i + 1 : stop]
+                if not (
+                    digits.isdigit() or digits[:1] == b"-" and digits[1:].isdigit()
+                ):
+                    raise DecodeError(f"Invalid integer at {start + i}")
+                value = int(digits)
+                i = stop + 1
+            elif c == _LIST or c == _DICT:
+                if len(stack) >= max_depth:
+                    raise DecodeError(f"Too deeply nested at {start + i}")
+                stack.append((container, is_list, key))
+                is_list = c == _LIST
+                container = [] if is_list else {}
+                key = None
+                i += 1
+                continue
+            elif c == _END and stack and key is None:
+                value = container
+                container, is_list, key = stack.pop()
+                i += 1
+            else:
+                raise DecodeError(f"Invalid value at {start + i}")
+
+            elements -= 1
+            if elements < 0:
+                raise DecodeError("Too many elements")
+
+            if is_list:
+                container.append(value)
+            elif key is not None:
+                container[key] = value
+                key = None
+            elif container is None:
+                return value, start + i
+            elif type(value) is not bytes:
+                raise DecodeError(f"Dict key is not a string before {start + i}")
+            elif value in skip_keys:
+                stop, skipped = _skip(data, i, max_depth - len(stack))
+                elements -= skipped
+                container[value] = memoryview(data)[i:stop]
+                i = stop
+            else:
+                key = value
+    except IndexError:
+        raise DecodeError("Value is truncated") from None
+
+
+def decode(data: Buffer, **limits: Any) -> Any:
+    """Decodes a buffer holding a single value, see decode_prefix for the limits"""
+    value, end = decode_prefix(data, **limits)
+    if end != len(data):
+        raise DecodeError(f"Trailing data after the value at {end}")
+    return value
@@ -9,3 +9,13 @@ class InvalidHandshake(MetadataFetcherException):
 
 class InvalidMetadata(MetadataFetcherException):
     pass
+
+
+class InvalidMessage(MetadataFetcherException):
+    pass
+
+
+class MetadataConflict(InvalidMetadata):
+    """Peers disagree on the metadata of an info hash, there is no way to tell
+    which of them is wrong
+    """
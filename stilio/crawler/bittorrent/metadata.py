@@ -1,13 +1,25 @@
 import asyncio
 import hashlib
+import heapq
+import itertools
 import logging
 import math
-from asyncio import StreamReader, StreamWriter
-from typing import Callable, Dict, Optional, Tuple
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
 
+from stilio import metrics
 from stilio.config import (
     CRAWLER_DEBUG_LEVEL,
+    CRAWLER_METADATA_BACKOFF_BASE_DELAY,
+    CRAWLER_METADATA_BACKOFF_MAX_DELAY,
+    CRAWLER_METADATA_BACKOFF_MAX_SIZE,
+    CRAWLER_METADATA_BACKOFF_MIN_PEERS,
+    CRAWLER_METADATA_CANDIDATE_TTL,
     CRAWLER_METADATA_FETCH_TIMEOUT,
+    CRAWLER_METADATA_MAX_ANNOUNCERS_PER_INFO_HASH,
+    CRAWLER_METADATA_MAX_CANDIDATES,
+    CRAWLER_METADATA_MAX_CONNECTIONS,
+    CRAWLER_METADATA_MAX_PEERS_PER_INFO_HASH,
     CRAWLER_METADATA_MAX_SIMULTANEOUS_WORKERS_PER_INFO_HASH,
 )
 from stilio.crawler.bittorrent import utils as bt_utils
@@ -16,39 +28,234 @@ from stilio.crawler.bittorrent.constants import (
     BT_PROTOCOL_PREFIX,
     EXTENDED_HANDSHAKE_MESSAGE,
     ID_EXTENDED_MESSAGE,
+    UT_METADATA_ID,
+)
+from stilio.crawler.bittorrent.exceptions import (
+    InvalidHandshake,
+    InvalidMessage,
+    InvalidMetadata,
+    MetadataConflict,
 )
-from stilio.crawler.bittorrent.exceptions import InvalidHandshake, InvalidMetadata
 from stilio.crawler.bittorrent.utils import get_random_peer_id
+from stilio.crawler.dedup import NegativeCache
 
 logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
 logger = logging.getLogger(__name__)
 
 PeerAddress = Tuple[str, int]
 
+PIECE_SIZE = 2 ** 14
+HANDSHAKE_LENGTH = 68
+# Longest message kept in the read buffer, metadata pieces are not kept there
+MAX_MESSAGE_LENGTH = 1 << 20
+# Longest bencoded header expected before the payload of a metadata piece
+MAX_PIECE_HEADER_LENGTH = 256
+# Pieces requested at once from every peer
+PIPELINED_PIECES = 4
+
+ACTIVE_WORKERS = metrics.Gauge(
+    "stilio_metadata_active_workers", "Metadata workers connected or connecting"
+)
+FETCHES = metrics.Counter(
+    "stilio_metadata_fetches", "Metadata fetches by result", ["result"]
+)
+FETCHES_SUCCESS = FETCHES.labels("success")
+FETCHES_EMPTY = FETCHES.labels("empty")
+FETCHES_TIMEOUT = FETCHES.labels("timeout")
+FETCHES_REFUSED = FETCHES.labels("refused")
+FETCHES_ERROR = FETCHES.labels("error")
+FETCHES_CONFLICT = FETCHES.labels("conflict")
+FETCH_LATENCY = metrics.Histogram(
+    "stilio_metadata_fetch_seconds", "Time spent fetching metadata from a peer"
+)
+CANDIDATES = metrics.Gauge(
+    "stilio_metadata_candidates", "Info hashes waiting to be fetched or in progress"
+)
+CANDIDATES_DROPPED = metrics.Counter(
+    "stilio_metadata_candidates_dropped", "Info hashes dropped by a full queue"
+)
+CANDIDATES_EXPIRED = metrics.Counter(
+    "stilio_metadata_candidates_expired", "Info hashes that waited for too long"
+)
+BACKOFF_SKIPS = metrics.Counter(
+    "stilio_metadata_backoff_skips", "Fetches skipped after recent failures", ["key"]
+)
+BACKOFF_SKIPS_PEER = BACKOFF_SKIPS.labels("peer")
+BACKOFF_SKIPS_INFO_HASH = BACKOFF_SKIPS.labels("info_hash")
+
+
+class MetadataAssembler:
+    """Assembles the metadata of an info hash from the pieces received by all the
+    workers fetching it.
+
+    Workers claim the pieces nobody requested yet and receive them into the shared
+    buffer, so every piece is downloaded once and the metadata is hashed once.
+    When every piece has been claimed, workers without pending requests also
+    request the pieces still missing, so a slow peer cannot hold back the rest.
+
+    The buffer is only kept while workers are attached to it. When peers disagree
+    on the metadata size, or the metadata does not match the info hash, the
+    allocation is dropped and the workers attached are aborted, so the next peers
+    start over instead of inheriting a wrong size.
+    """
+
+    def __init__(self, info_hash: bytes, max_metadata_size: int = 10_000_000):
+        self.info_hash = info_hash
+        self.max_metadata_size = max_metadata_size
+
+        self.size = 0
+        self.pieces = 0
+        self.buffer = bytearray()
+        self.view = memoryview(self.buffer)
+
+        # Workers using the buffer
+        self._workers: Set["MetadataWorker"] = set()
+        # Unclaimed pieces, the lowest one last
+        self._unclaimed: List[int] = []
+        # Piece -> workers that requested it
+        self._claims: Dict[int, Set[object]] = {}
+        self._received: Set[int] = set()
+
+    def allocate(self, size: int, worker: Optional["MetadataWorker"] = None) -> None:
+        """Allocates the buffer the first time a peer tells the metadata size, the
+        following peers must agree on it. Raises MetadataConflict otherwise, after
+        dropping the allocation.
+        """
+        if self.size and size != self.size:
+            conflict = MetadataConflict(f"Metadata size {size} != {self.size}")
+            self.drop(conflict)
+            raise conflict
+
+        if worker is not None:
+            self._workers.add(worker)
+        if self.size:
+            return
+
+        try:
+            self.buffer = bytearray(size)
+        except MemoryError:
+            logging.exception("Error trying to allocate the metadata in memory.")
+            raise
+        self.view = memoryview(self.buffer)
+        self.size = size
+        self.pieces = math.ceil(size / PIECE_SIZE)
+        self._reset()
+
+    def drop(self, exception: Optional[BaseException] = None) -> None:
+        """Frees the buffer, aborting the workers attached with the exception"""
+        workers = list(self._workers)
+        self._workers.clear()
+        self.size = 0
+        self.pieces = 0
+        self.buffer = bytearray()
+        self.view = memoryview(self.buffer)
+        self._reset()
+        if exception is not None:
+            for worker in workers:
+                worker.abort(exception)
+
+    def _reset(self) -> None:
+        self._unclaimed = list(reversed(range(self.pieces)))
+        self._claims.clear()
+        self._received.clear()
+
+    def piece_end(self, piece: int) -> int:
+        return min((piece + 1) * PIECE_SIZE, self.size)
+
+    def claim(self, worker: object) -> Optional[int]:
+        """Returns a piece for the worker to request, if any"""
+        while self._unclaimed:
+            piece = self._unclaimed.pop()
+            if piece not in self._received:
+                self._claims.setdefault(piece, set()).add(worker)
+                return piece
+
+        # Every piece is claimed, request a missing one from this peer as well
+        for piece, workers in self._claims.items():
+            if worker not in workers:
+                workers.add(worker)
+                return piece
+        return None
+
+    def release(self, worker: object) -> None:
+        """Gives back the pieces requested by a worker that stopped, the buffer is
+        freed once no worker is attached
+        """
+        for piece, workers in list(self._claims.items()):
+            workers.discard(worker)
+            if not workers:
+                del self._claims[piece]
+                self._unclaimed.append(piece)
+
+        if worker in self._workers:
+            self._workers.discard(worker)  # type: ignore
+            if not self._workers:
+                self.drop()
+
+    def add(self, piece: int) -> Optional[bytes]:
+        """Marks the piece as received, returns the metadata once every piece has
+        been received. Raises MetadataConflict if it does not match the info hash,
+        after dropping the allocation.
+        """
+        self._claims.pop(piece, None)
+        self._received.add(piece)
+        if len(self._received) < self.pieces:
+            return None
+
+        if hashlib.sha1(self.buffer).digest() != self.info_hash:
+            conflict = MetadataConflict("Metadata does not match the info hash")
+            self.drop(conflict)
+            raise conflict
+        return bytes(self.buffer)
+
+
+class MetadataWorker(asyncio.BufferedProtocol):
+    """Fetches the metadata of an info hash from a peer.
+
+    The peer wire stream is received into a preallocated buffer where messages are
+    framed in place. Once the header of a metadata piece has been read, the rest of
+    the piece is received straight into the metadata bytearray at its offset, so
+    pieces are not copied through intermediate bytes objects.
+
+    Workers fetching the same info hash can share an assembler, each one then
+    requests only the pieces the others have not.
+    """
 
-class MetadataWorker:
     def __init__(
         self,
         info_hash: bytes,
         peer_address: PeerAddress,
         max_metadata_size: int = 10_000_000,
+        assembler: Optional[MetadataAssembler] = None,
+        buffer_size: int = 1 << 15,
     ):
         self._peer_id = get_random_peer_id()
         self._peer_address = peer_address
 
         self._info_hash = info_hash
 
-        self._reader: Optional[StreamReader] = None
-        self._writer: Optional[StreamWriter] = None
+        self._transport: Optional[asyncio.BaseTransport] = None
+        self._metadata_future: asyncio.Future = asyncio.get_event_loop().create_future()
 
+        self._peer_handshaked = False
         self._handshaked = False
         self._ut_metadata = int()
 
         self._max_metadata_size = max_metadata_size
 
-        self._metadata_size = 0
-        self._metadata_received = 0
-        self._metadata = bytearray()
+        self._assembler = assembler or MetadataAssembler(info_hash, max_metadata_size)
+        self._requested: Set[int] = set()
+
+        # Received data waiting to be framed is in self._buffer[_start:_end]
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        # Piece being received straight into the metadata, if any
+        self._piece: Optional[int] = None
+        self._piece_offset = 0
+        self._piece_end = 0
 
     def _on_extension_handshake_message(self, message: bytes) -> None:
         if self._handshaked:
@@ -72,68 +279,144 @@ class MetadataWorker:
             return
 
         if not bt_utils.is_metadata_size_valid(message_dict, self._max_metadata_size):
-            raise InvalidMetadata
+            raise InvalidMetadata(f"Invalid metadata size {metadata_size}")
 
+        self._assembler.allocate(metadata_size, self)
         self._ut_metadata = ut_metadata
-        try:
-            self._metadata = bytearray(metadata_size)
-        except MemoryError:
-            logging.exception("Error trying to allocate the metadata in memory.")
-            raise
-
-        self._metadata_size = metadata_size
         self._handshaked = True
 
-        pieces = math.ceil(self._metadata_size / (2 ** 14))
-        for piece in range(pieces):
-            self._request_piece(piece)
+        self._request_pieces()
 
-    def _on_extension_message(self, message: bytes) -> None:
-        try:
-            message_dict, i = decode2(message)
-        except BencoderError:
-            logger.debug("Message in on_extension_message could not be decoded.")
-            return
+    def _on_extension_message(self, header_start: int, message_end: int) -> bool:
+        """Handles the ut_metadata message, returns False if more data is needed.
 
+        Only the bencoded header is copied, the payload of a data message is moved
+        into the metadata and the rest of it received directly there.
+        """
+        end = min(self._end, message_end)
         try:
+            message_dict, payload_start = decode2(
+                self._view,
+                header_start,
+                min(end, header_start + MAX_PIECE_HEADER_LENGTH),
+            )
             message_type = message_dict[b"msg_type"]
             piece = message_dict[b"piece"]
-        except KeyError:
-            logging.debug(
-                f"Missing msg_type or piece in on_extension_message: {message_dict}."
-            )
-            return
-
-        if message_type == 1:
-            metadata_piece = message[i:]
-
-            self._metadata[
-                piece * 2 ** 14 : piece * 2 ** 14 + len(metadata_piece)
-            ] = metadata_piece
-            self._metadata_received += len(metadata_piece)
-
-            if self._metadata_received == self._metadata_size:
-                if hashlib.sha1(self._metadata).digest() == self._info_hash:
-                    if not self._metadata_future.done():
-                        self._metadata_future.set_result(bytes(self._metadata))
-                else:
-                    logging.debug("Invalid metadata in on_extension_message.")
-
-        elif message_type == 2:
-            logging.info("Peer rejected the connection.")
-
-    def _on_handshake(self) -> None:
-        """
-        Sends to the peer the extended handshake message.
-        """
-        self._write_message(EXTENDED_HANDSHAKE_MESSAGE)
-
-    def _on_message(self, message: bytes) -> None:
+        except (BencoderError, KeyError, TypeError):
+            if end < message_end and end - header_start < MAX_PIECE_HEADER_LENGTH:
+                return False
+            raise InvalidMessage("Invalid ut_metadata message")
+
+        if message_type != 1:
+            if end < message_end:
+                return False
+            if message_type == 2:
+                # The pieces requested from this peer are given to other peers
+                raise InvalidMessage("Peer rejected the metadata request")
+            self._start = message_end
+            return True
+
+        assembler = self._assembler
+        offset = piece * PIECE_SIZE
+        piece_end = offset + message_end - payload_start
+        if not 0 <= piece < assembler.pieces or piece_end != assembler.piece_end(piece):
+            raise InvalidMessage(f"Invalid metadata piece {piece}")
+
+        received = end - payload_start
+        assembler.view[offset : offset + received] = self._view[payload_start:end]
+        if offset + received < piece_end:
+            self._piece = piece
+            self._piece_offset = offset + received
+            self._piece_end = piece_end
+            self._start = self._end = 0
+        else:
+            self._start = message_end
+            self._on_piece_received(piece)
+        return True
+
+    def _on_message(self, message: memoryview) -> None:
         if bt_utils.is_extension_handshake_message(message):
-            self._on_extension_handshake_message(message[2:])
-
-        if bt_utils.is_extension_message(message):
-            self._on_extension_message(message[2:])
+            self._on_extension_handshake_message(bytes(message[2:]))
+
+    def _on_piece_received(self, piece: int) -> None:
+        self._requested.discard(piece)
+        metadata = self._assembler.add(piece)
+        if metadata:
+            self._set_result(metadata)
+        else:
+            self._request_pieces()
+
+    def _process(self) -> None:
+        """Frames the messages received so far"""
+        buffer = self._buffer
+        while True:
+            start = self._start
+            available = self._end - start
+
+            if not self._peer_handshaked:
+                if available < HANDSHAKE_LENGTH:
+                    break
+                handshake = bytes(self._view[start : start + HANDSHAKE_LENGTH])
+                if not bt_utils.is_handshake_valid(handshake, self._info_hash):
+                    raise InvalidHandshake(
+                        f"Invalid handshake for {self._info_hash.hex()} from peer {self._peer_address}."
+                    )
+                self._peer_handshaked = True
+                self._start += HANDSHAKE_LENGTH
+                self._write_message(EXTENDED_HANDSHAKE_MESSAGE)
+                continue
+
+            if available < 4:
+                break
+            length = int.from_bytes(buffer[start : start + 4], "big")
+            if length > MAX_MESSAGE_LENGTH:
+                raise InvalidMessage(f"Message of {length} bytes is too long")
+            body = start + 4
+
+            if (
+                self._handshaked
+                and length > 2
+                and available >= 6
+                and buffer[body] == ID_EXTENDED_MESSAGE
+                and buffer[body + 1] == UT_METADATA_ID
+            ):
+                if not self._on_extension_message(body + 2, body + length):
+                    break
+                if self._piece is not None:
+                    break
+                continue
+
+            if available < 4 + length:
+                break
+            if length:
+                self._on_message(self._view[body : body + length])
+            self._start = body + length
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _compact(self) -> None:
+        """Moves the pending data to the start of the buffer, growing it if the
+        pending data already fills it
+        """
+        size = self._end - self._start
+        if self._start:
+            self._buffer[:size] = self._buffer[self._start : self._end]
+        else:
+            buffer = bytearray(len(self._buffer) * 2)
+            buffer[:size] = self._buffer
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        self._start, self._end = 0, size
+
+    def _request_pieces(self) -> None:
+        """Keeps a few pieces requested at a time so other peers can share them"""
+        while len(self._requested) < PIPELINED_PIECES:
+            piece = self._assembler.claim(self)
+            if piece is None:
+                return
+            self._requested.add(piece)
+            self._request_piece(piece)
 
     def _request_piece(self, piece):
         message = bytes([ID_EXTENDED_MESSAGE, self._ut_metadata]) + encode(
@@ -143,138 +426,428 @@ class MetadataWorker:
 
     def _write_message(self, message: bytes):
         length = len(message).to_bytes(4, "big")
-        if self._writer:
-            self._writer.write(length + message)
-
-    async def work(self):
-        event_loop = asyncio.get_event_loop()
-        self._metadata_future = event_loop.create_future()
+        if self._transport:
+            self._transport.write(length + message)  # type: ignore
+
+    def _set_result(self, metadata: Optional[bytes]) -> None:
+        if not self._metadata_future.done():
+            self._metadata_future.set_result(metadata)
+
+    def _fail(self, exception: BaseException) -> None:
+        if not self._metadata_future.done():
+            self._metadata_future.set_exception(exception)
+        if self._transport:
+            self._transport.close()
+
+    def abort(self, exception: BaseException) -> None:
+        """Stops the worker, e.g. when the allocation it fills is dropped"""
+        self._piece = None
+        self._fail(exception)
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = transport
+        transport.write(  # type: ignore
+            BT_PROTOCOL_PREFIX + self._info_hash + self._peer_id
+        )
 
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._transport = None
+        if exc:
+            self._fail(exc)
+        else:
+            self._set_result(None)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._piece is not None:
+            return self._assembler.view[self._piece_offset : self._piece_end]
+        if self._end == len(self._buffer):
+            self._compact()
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
         try:
-            self._reader, self._writer = await asyncio.open_connection(
-                *self._peer_address, loop=event_loop
-            )
-
-            self._writer.write(BT_PROTOCOL_PREFIX + self._info_hash + self._peer_id)
+            if self._piece is None:
+                self._end += nbytes
+                self._process()
+                return
 
-            message = await self._reader.readexactly(68)
+            self._piece_offset += nbytes
+            if self._piece_offset == self._piece_end:
+                piece, self._piece = self._piece, None
+                self._on_piece_received(piece)
+                self._process()
+        except Exception as e:
+            self._fail(e)
 
-            if not bt_utils.is_handshake_valid(message, self._info_hash):
-                raise InvalidHandshake(
-                    f"Invalid handshake for {self._info_hash.hex()} from peer {self._peer_address}."
-                )
+    def eof_received(self) -> bool:
+        return False
 
-            self._on_handshake()
+    async def work(self) -> Optional[bytes]:
+        event_loop = asyncio.get_event_loop()
 
-            while not self._metadata_future.done():
-                buffer = await self._reader.readexactly(4)
-                length = int.from_bytes(buffer, "big")
-                message = await self._reader.readexactly(length)
-                self._on_message(message)
+        try:
+            await event_loop.create_connection(lambda: self, *self._peer_address)
+            metadata = await self._metadata_future
+            if metadata is None:
+                FETCHES_EMPTY.inc()
+            return metadata
         except ConnectionRefusedError:
             # If connection is refused just ignore it
-            pass
+            FETCHES_REFUSED.inc()
+        except MetadataConflict:
+            # Not necessarily the fault of this peer, let the fetcher know
+            FETCHES_CONFLICT.inc()
+            raise
         except Exception as e:
+            FETCHES_ERROR.inc()
             logger.debug(
                 f"There was an error retrieving metadata for {self._info_hash.hex()} from peer {self._peer_address}."
             )
             logger.exception(e)
         finally:
-            if not self._metadata_future.done():
-                self._metadata_future.set_result(None)
+            self._assembler.release(self)
+            if self._transport:
+                self._transport.close()
 
-            if self._writer:
-                self._writer.close()
-
-        return self._metadata_future.result()
+        return None
 
 
 async def fetch_metadata(
-    info_hash: bytes, peer_address: PeerAddress, max_metadata_size: int
+    info_hash: bytes,
+    peer_address: PeerAddress,
+    max_metadata_size: int,
+    assembler: Optional[MetadataAssembler] = None,
 ) -> Optional[bytes]:
+    ACTIVE_WORKERS.inc()
     try:
-        result = await asyncio.wait_for(
-            MetadataWorker(info_hash, peer_address, max_metadata_size).work(),
-            timeout=CRAWLER_METADATA_FETCH_TIMEOUT,
-        )
+        with FETCH_LATENCY.time():
+            worker = MetadataWorker(
+                info_hash, peer_address, max_metadata_size, assembler
+            )
+            result = await asyncio.wait_for(
+                worker.work(),
+                timeout=CRAWLER_METADATA_FETCH_TIMEOUT,
+            )
     except asyncio.TimeoutError:
+        FETCHES_TIMEOUT.inc()
         return None
     else:
+        if result:
+            FETCHES_SUCCESS.inc()
         return result
+    finally:
+        ACTIVE_WORKERS.dec()
+
+
+class FetchCandidate:
+    """Info hash waiting to be fetched with the peers that announced it"""
+
+    __slots__ = (
+        "info_hash",
+        "max_metadata_size",
+        "assembler",
+        "peers",
+        "announced_by",
+        "announces",
+        "tasks",
+        "queued_priority",
+        "queued_at",
+    )
+
+    def __init__(self, info_hash: bytes, max_metadata_size: int, queued_at: float):
+        self.info_hash = info_hash
+        self.max_metadata_size = max_metadata_size
+        self.assembler = MetadataAssembler(info_hash, max_metadata_size)
+        self.peers: Deque[PeerAddress] = deque()
+        # Distinct announcers up to a limit, the announces are counted past it
+        self.announced_by: Set[PeerAddress] = set()
+        self.announces = 0
+        self.tasks: Set[asyncio.Future] = set()
+        # Priority of its entry in the priority queue, 0 if it has none
+        self.queued_priority = 0
+        self.queued_at = queued_at
+
+    @property
+    def priority(self) -> int:
+        return self.announces
 
 
 class MetadataFetcher:
+    """Schedules the metadata workers under a global connection budget.
+
+    Every announced info hash becomes a candidate with a queue of the distinct
+    peers that announced it. Candidates wait in a priority queue ordered by the
+    number of distinct peers, the more popular the info hash the sooner it is
+    fetched. When a worker fails the next peer of the candidate takes its place.
+    Candidates that wait for longer than their ttl are forgotten.
+
+    Peers that fail and info hashes whose peers all failed are skipped for an
+    exponentially growing delay, so dead endpoints do not keep a connection busy
+    until the fetch timeout on every announce. An info hash is only backed off
+    once several distinct peers failed it, a single dead peer says little about
+    the torrent.
+
+    While paused announces are still queued but no new workers are started.
+    """
+
     def __init__(
-        self, on_metadata_result: Optional[Callable[[bytes, bytes], None]] = None
+        self,
+        on_metadata_result: Optional[Callable[[bytes, bytes], None]] = None,
+        max_connections: int = CRAWLER_METADATA_MAX_CONNECTIONS,
+        max_workers_per_info_hash: int = CRAWLER_METADATA_MAX_SIMULTANEOUS_WORKERS_PER_INFO_HASH,
+        max_peers_per_info_hash: int = CRAWLER_METADATA_MAX_PEERS_PER_INFO_HASH,
+        max_announcers_per_info_hash: int = CRAWLER_METADATA_MAX_ANNOUNCERS_PER_INFO_HASH,
+        max_candidates: int = CRAWLER_METADATA_MAX_CANDIDATES,
+        candidate_ttl: float = CRAWLER_METADATA_CANDIDATE_TTL,
+        backoff_base_delay: float = CRAWLER_METADATA_BACKOFF_BASE_DELAY,
+        backoff_max_delay: float = CRAWLER_METADATA_BACKOFF_MAX_DELAY,
+        backoff_min_peers: int = CRAWLER_METADATA_BACKOFF_MIN_PEERS,
     ):
-        self._active_workers: Dict[bytes, asyncio.Future] = dict()
+        """Args:
+
+            on_metadata_result: called with the info hash and its metadata
+            max_connections: maximum number of workers at once, lowered to fit
+                in the file descriptors limit of the process
+            max_workers_per_info_hash: maximum number of workers per info hash
+            max_peers_per_info_hash: maximum number of peers queued per info hash
+            max_announcers_per_info_hash: maximum number of distinct announcers
+                remembered per info hash, further announces count towards the
+                priority even if they repeat a peer
+            max_candidates: maximum number of info hashes waiting or in progress
+            candidate_ttl: seconds an info hash waits before being forgotten
+            backoff_base_delay: seconds a peer or info hash is skipped after failing
+            backoff_max_delay: maximum number of seconds a peer or info hash is
+                skipped
+            backoff_min_peers: distinct peers that must fail an info hash before
+                it is skipped
+        """
+        self._max_connections = min(max_connections, bt_utils.available_fds())
+        self._max_workers_per_info_hash = max_workers_per_info_hash
+        self._max_peers_per_info_hash = max_peers_per_info_hash
+        self._max_announcers_per_info_hash = max_announcers_per_info_hash
+        self._max_candidates = max_candidates
+        self._candidate_ttl = candidate_ttl
+
+        self._candidates: Dict[bytes, FetchCandidate] = {}
+        self._queue: List[Tuple[int, int, FetchCandidate]] = []
+        self._counter = itertools.count()
+        self._expire_handle: Optional[asyncio.TimerHandle] = None
+        self._active = 0
+        self._paused = False
+
+        self._failed_peers: NegativeCache[PeerAddress] = NegativeCache(
+            CRAWLER_METADATA_BACKOFF_MAX_SIZE, backoff_base_delay, backoff_max_delay
+        )
+        self._failed_info_hashes: NegativeCache[bytes] = NegativeCache(
+            CRAWLER_METADATA_BACKOFF_MAX_SIZE,
+            backoff_base_delay,
+            backoff_max_delay,
+            threshold=backoff_min_peers,
+        )
 
+        self.loop = asyncio.get_event_loop()
+
+        # Callbacks
         self.on_metadata_result = on_metadata_result
+        # Called with the info hashes given up on
+        self.on_fetch_failed: Optional[Callable[[bytes], None]] = None
 
-    def _on_parent_task_done(self, info_hash: bytes, task: asyncio.Future):
-        del self._active_workers[info_hash]
-        try:
-            metadata = task.result()
-            if not metadata:
-                return
-        except asyncio.CancelledError:
+        CANDIDATES.set_function(lambda: len(self._candidates))
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def candidates(self) -> int:
+        return len(self._candidates)
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def pause(self, paused: bool = True) -> None:
+        """Stops starting workers until called with False, the running ones go on"""
+        self._paused = paused
+        if not paused:
+            self._start_workers()
+
+    def _push(self, candidate: FetchCandidate) -> None:
+        """Queues the candidate unless it already is, an entry is only added
+        again once its priority doubled so a popular info hash does not fill the
+        queue with an entry per announce
+        """
+        priority = candidate.priority
+        if priority < 2 * candidate.queued_priority:
             return
+        candidate.queued_priority = priority
+        heapq.heappush(self._queue, (-priority, next(self._counter), candidate))
+
+    def _expire(self) -> None:
+        """Forgets the oldest candidates that are not being fetched"""
+        deadline = self.loop.time() - self._candidate_ttl
+        for info_hash, candidate in list(self._candidates.items()):
+            if candidate.queued_at > deadline:
+                break
+            if not candidate.tasks:
+                del self._candidates[info_hash]
+                CANDIDATES_EXPIRED.inc()
+                if self.on_fetch_failed:
+                    self.on_fetch_failed(info_hash)
+
+    def _on_expire_timer(self) -> None:
+        self._expire_handle = None
+        self._expire()
+        self._schedule_expire()
+
+    def _schedule_expire(self) -> None:
+        """Runs _expire when the oldest candidate is due, candidates being
+        fetched are checked again a fraction of the ttl later
+        """
+        if not self._candidates or self._expire_handle:
+            return
+        oldest = next(iter(self._candidates.values()))
+        delay = oldest.queued_at + self._candidate_ttl - self.loop.time()
+        self._expire_handle = self.loop.call_later(
+            max(delay, self._candidate_ttl / 10), self._on_expire_timer
+        )
 
-        if self.on_metadata_result:
-            self.on_metadata_result(info_hash, metadata)
+    def _start_workers(self) -> None:
+        while (
+            self._queue and self._active < self._max_connections and not self._paused
+        ):
+            priority, _, candidate = heapq.heappop(self._queue)
+            # Stale entry, the candidate is gone or has been pushed again since
+            if (
+                self._candidates.get(candidate.info_hash) is not candidate
+                or -priority != candidate.queued_priority
+            ):
+                continue
+            candidate.queued_priority = 0
+            if len(candidate.tasks) >= self._max_workers_per_info_hash:
+                continue
+
+            # Peers may have failed for another info hash since they were queued
+            peer = None
+            while candidate.peers and peer is None:
+                peer = candidate.peers.popleft()
+                if self._failed_peers.is_blocked(peer):
+                    BACKOFF_SKIPS_PEER.inc()
+                    peer = None
+            if peer is None:
+                self._on_candidate_exhausted(candidate)
+                continue
+
+            self._start_worker(candidate, peer)
+            if (
+                candidate.peers
+                and len(candidate.tasks) < self._max_workers_per_info_hash
+            ):
+                self._push(candidate)
+
+    def _start_worker(self, candidate: FetchCandidate, peer: PeerAddress) -> None:
+        task = asyncio.ensure_future(
+            fetch_metadata(
+                candidate.info_hash,
+                peer,
+                candidate.max_metadata_size,
+                candidate.assembler,
+            )
+        )
+        task.add_done_callback(lambda t: self._on_worker_done(candidate, peer, t))
+        candidate.tasks.add(task)
+        self._active += 1
 
-    def _on_child_task_done(
-        self, parent_task: asyncio.Future, child_task: asyncio.Future
-    ):
-        parent_task.child_count -= 1  # type: ignore
+    def _on_candidate_exhausted(self, candidate: FetchCandidate) -> None:
+        """Every peer of the candidate failed, forget it until the next announce"""
+        if candidate.peers or candidate.tasks:
+            return
+        if self._candidates.get(candidate.info_hash) is candidate:
+            del self._candidates[candidate.info_hash]
+            if self.on_fetch_failed:
+                self.on_fetch_failed(candidate.info_hash)
+
+    def _on_worker_done(
+        self, candidate: FetchCandidate, peer: PeerAddress, task: asyncio.Future
+    ) -> None:
+        self._active -= 1
+        candidate.tasks.discard(task)
+
+        metadata = None
+        conflict = False
         try:
-            metadata = child_task.result()
-            if metadata and not parent_task.done():
-                parent_task.set_result(metadata)
+            metadata = task.result()
         except asyncio.CancelledError:
-            pass
+            # Cancelled because another worker got the metadata
+            self._start_workers()
+            return
+        except MetadataConflict as e:
+            # Some peer sent a wrong size or wrong pieces, no way to tell which
+            logger.debug(f"Metadata of {candidate.info_hash.hex()} dropped: {e}")
+            conflict = True
         except Exception as e:
-            logging.debug("Child task resulted in exception")
+            logging.debug("Metadata worker resulted in exception")
             logger.exception(e)
 
-        if parent_task.child_count <= 0 and not parent_task.done():  # type: ignore
-            parent_task.set_result(None)
+        info_hash = candidate.info_hash
+        if metadata:
+            self._failed_peers.success(peer)
+            self._failed_info_hashes.success(info_hash)
+        elif not conflict:
+            self._failed_peers.failure(peer)
+            self._failed_info_hashes.failure(info_hash)
+
+        if self._candidates.get(info_hash) is candidate:
+            if metadata:
+                del self._candidates[info_hash]
+                for other in candidate.tasks:
+                    other.cancel()
+                if self.on_metadata_result:
+                    self.on_metadata_result(info_hash, metadata)
+            elif candidate.peers:
+                # Replace the failed worker with the next peer
+                self._push(candidate)
+            else:
+                self._on_candidate_exhausted(candidate)
+
+        self._start_workers()
 
     def fetch(
         self,
         info_hash: bytes,
         peer_address: PeerAddress,
         max_metadata_size: int = 10_000_000,
-    ):
-        event_loop = asyncio.get_event_loop()
-
-        if info_hash not in self._active_workers:
-            parent_future = event_loop.create_future()
-            parent_future.child_count = 0  # type: ignore
-            parent_future.add_done_callback(
-                lambda f: self._on_parent_task_done(info_hash, f)
-            )
-            self._active_workers[info_hash] = parent_future
-
-        parent_future = self._active_workers[info_hash]
-
-        if parent_future.done():
-            return
-
-        if (
-            parent_future.child_count  # type: ignore
-            >= CRAWLER_METADATA_MAX_SIMULTANEOUS_WORKERS_PER_INFO_HASH
-        ):
-            return
-
-        task = asyncio.ensure_future(
-            fetch_metadata(
-                info_hash=info_hash,
-                peer_address=peer_address,
-                max_metadata_size=max_metadata_size,
-            )
-        )
-        task.add_done_callback(lambda t: self._on_child_task_done(parent_future, t))
-
-        parent_future.child_count += 1  # type: ignore
-        parent_future.add_done_callback(lambda f: task.cancel())
+    ) -> bool:
+        """Queues the peer to fetch the metadata from, returns False if the info
+        hash is not being fetched
+        """
+        candidate = self._candidates.get(info_hash)
+        if self._failed_peers.is_blocked(peer_address):
+            BACKOFF_SKIPS_PEER.inc()
+            return candidate is not None
+
+        if candidate is None:
+            if self._failed_info_hashes.is_blocked(info_hash):
+                BACKOFF_SKIPS_INFO_HASH.inc()
+                return False
+            if len(self._candidates) >= self._max_candidates:
+                self._expire()
+                if len(self._candidates) >= self._max_candidates:
+                    CANDIDATES_DROPPED.inc()
+                    return False
+            candidate = FetchCandidate(info_hash, max_metadata_size, self.loop.time())
+            self._candidates[info_hash] = candidate
+            self._schedule_expire()
+
+        if peer_address in candidate.announced_by:
+            return True
+        candidate.announces += 1
+        if len(candidate.announced_by) < self._max_announcers_per_info_hash:
+            candidate.announced_by.add(peer_address)
+            if len(candidate.peers) < self._max_peers_per_info_hash:
+                candidate.peers.append(peer_address)
+
+        if len(candidate.tasks) < self._max_workers_per_info_hash:
+            self._push(candidate)
+            self._start_workers()
+        return True
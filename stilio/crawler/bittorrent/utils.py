@@ -1,3 +1,4 @@
+import resource
 from random import random
 
 from stilio.crawler.bittorrent.constants import BT_PROTOCOL_PREFIX, PEER_ID_PREFIX
@@ -60,3 +61,14 @@ def supports_metadata_exchange(message: bytes) -> bool:
     exchange protocol extension.
     """
     return message[25] == 16
+
+
+def available_fds(reserved: int = 256) -> int:
+    """
+    Returns how many file descriptors can be used for peer connections, keeping
+    some of them for the sockets and files of the rest of the crawler.
+    """
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        return 1 << 20
+    return max(1, soft_limit - reserved)
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import math
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class BloomFilter:
+    """Fixed size bloom filter.
+
+    Keys are expected to be uniformly distributed (e.g. info hashes or node ids),
+    so their own bytes are used as the hash instead of hashing them again.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        bits: Optional[Union[bytearray, memoryview]] = None,
+        count: int = 0,
+    ):
+        """Args:
+
+            capacity: number of keys before the error rate is exceeded
+            error_rate: false positive rate once the filter is full
+            bits: bits of a previous filter with the same capacity and error rate,
+                e.g. a writable memoryview of a snapshot
+            count: number of keys in the previous filter
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.num_bits = max(
+            8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        size = math.ceil(self.num_bits / 8)
+        if bits is not None and len(bits) != size:
+            raise ValueError(f"Expected {size} bytes of bits, got {len(bits)}")
+        self.bits = bits if bits is not None else bytearray(size)
+        self.count = count
+
+    def _positions(self, key: bytes) -> Iterable[int]:
+        h1 = int.from_bytes(key[:8], "big")
+        h2 = int.from_bytes(key[8:16], "big") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: bytes) -> bool:
+        """Adds the key to the filter, returns False if it was (probably) present."""
+        bits = self.bits
+        added = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """Bloom filter that grows by stacking bigger filters with tighter error rates,
+    keeping the overall false positive rate under the initial error rate.
+    """
+
+    def __init__(
+        self,
+        initial_capacity: int,
+        error_rate: float,
+        growth: int = 2,
+        tightening: float = 0.9,
+    ):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+
+        self.filters: List[BloomFilter] = []
+        self._add_filter()
+
+    def _add_filter(self) -> BloomFilter:
+        n = len(self.filters)
+        bloom_filter = BloomFilter(
+            capacity=self.initial_capacity * self.growth ** n,
+            error_rate=self.error_rate * (1 - self.tightening) * self.tightening ** n,
+        )
+        self.filters.append(bloom_filter)
+        return bloom_filter
+
+    def restore(self, filters: List[BloomFilter]) -> None:
+        """Replaces the filters with the ones of a previous instance"""
+        if filters:
+            self.filters = filters
+
+    def __contains__(self, key: bytes) -> bool:
+        return any(key in bloom_filter for bloom_filter in reversed(self.filters))
+
+    def __len__(self) -> int:
+        return sum(bloom_filter.count for bloom_filter in self.filters)
+
+    def add(self, key: bytes) -> bool:
+        if key in self:
+            return False
+
+        bloom_filter = self.filters[-1]
+        if bloom_filter.is_full:
+            bloom_filter = self._add_filter()
+        return bloom_filter.add(key)
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return None
+        return self._items[key]
+
+    def put(self, key: K, value: V) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class NegativeCache(Generic[K]):
+    """Remembers the keys that failed and blocks them for an exponentially growing
+    delay on every consecutive failure, starting from the threshold-th one.
+
+    A key is forgotten, resetting its backoff, once it has not failed for
+    max_delay seconds after its last block expired, and the least recently failed
+    keys are evicted when the cache is full.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        base_delay: float,
+        max_delay: float,
+        threshold: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Args:
+
+            max_size: maximum number of keys remembered
+            base_delay: seconds a key is blocked after its threshold-th failure
+            max_delay: maximum number of seconds a key is blocked
+            threshold: consecutive failures before a key is blocked
+            clock: returns the current time in seconds
+        """
+        self.max_size = max_size
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._threshold = threshold
+        self._clock = clock
+        # Key -> (consecutive failures, blocked until)
+        self._items: OrderedDict[K, Tuple[int, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def is_blocked(self, key: K) -> bool:
+        entry = self._items.get(key)
+        if entry is None:
+            return False
+
+        now = self._clock()
+        if now < entry[1]:
+            return True
+        if now >= entry[1] + self._max_delay:
+            del self._items[key]
+        return False
+
+    def failure(self, key: K) -> float:
+        """Blocks the key, returns the number of seconds it is blocked for"""
+        now = self._clock()
+        failures = 1
+        entry = self._items.get(key)
+        if entry is not None and now < entry[1] + self._max_delay:
+            failures = entry[0] + 1
+        delay = 0.0
+        if failures >= self._threshold:
+            exponent = failures - self._threshold
+            delay = min(self._base_delay * 2 ** exponent, self._max_delay)
+
+        self._items[key] = (failures, now + delay)
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return delay
+
+    def success(self, key: K) -> None:
+        self._items.pop(key, None)
+
+
+class InfoHashFilter:
+    """Tells if an info hash is already stored without querying the database
+    unless the bloom filter reports a possible positive.
+
+    Args:
+        lookup: function used to confirm possible positives, e.g. Torrent.exists
+        capacity: initial capacity of the bloom filter
+        error_rate: false positive rate of the bloom filter
+        cache_size: number of recently confirmed info hashes to remember
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[bytes], bool],
+        capacity: int,
+        error_rate: float,
+        cache_size: int,
+    ):
+        self._lookup = lookup
+        self._bloom_filter = ScalableBloomFilter(capacity, error_rate)
+        self._recent: LRUCache[bytes, bool] = LRUCache(cache_size)
+
+        self.lookups = 0
+
+    def __len__(self) -> int:
+        return len(self._bloom_filter)
+
+    @property
+    def bloom_filter(self) -> ScalableBloomFilter:
+        return self._bloom_filter
+
+    def add(self, info_hash: bytes) -> None:
+        self._bloom_filter.add(info_hash)
+        self._recent.put(info_hash, True)
+
+    def seed(self, info_hashes: Iterable[bytes]) -> int:
+        """Adds every info hash to the bloom filter, returns how many were added."""
+        count = 0
+        for info_hash in info_hashes:
+            self._bloom_filter.add(info_hash)
+            count += 1
+        return count
+
+    def might_exist(self, info_hash: bytes) -> bool:
+        """Checks the bloom filter only, so false positives are not ruled out"""
+        return info_hash in self._bloom_filter
+
+    def exists(self, info_hash: bytes) -> bool:
+        if info_hash not in self._bloom_filter:
+            return False
+
+        cached = self._recent.get(info_hash)
+        if cached is not None:
+            return cached
+
+        self.lookups += 1
+        exists = self._lookup(info_hash)
+        self._recent.put(info_hash, exists)
+        return exists
+
+
+class SharedInfoHashClaims:
+    """Lossy table of info hashes being fetched or already stored, shared by forked
+    crawler processes through an anonymous shared memory map, so only one of them
+    fetches each one.
+
+    Every info hash maps to a single slot holding its fingerprint, the process that
+    claimed it and when the claim expires. Claims of stored info hashes are marked
+    as done and kept for done_ttl seconds, claims of failed fetches are released.
+    Colliding info hashes overwrite each other, so at worst an info hash is fetched
+    twice.
+    """
+
+    _slot = struct.Struct("<QII")
+    # Owner of the claims marked as done, no process has it
+    _DONE = 0
+
+    def __init__(self, slots: int, ttl: int, done_ttl: int):
+        """Args:
+
+            slots: number of info hashes tracked at once
+            ttl: seconds before the claim of a fetch that never ended expires
+            done_ttl: seconds a stored info hash is skipped by the other processes
+        """
+        self._slots = slots
+        self._ttl = ttl
+        self._done_ttl = done_ttl
+        self._buffer = mmap.mmap(-1, slots * self._slot.size)
+
+    def _locate(self, info_hash: bytes) -> Tuple[int, int]:
+        """Returns the offset of the slot of the info hash and its fingerprint"""
+        offset = int.from_bytes(info_hash[16:20], "big") % self._slots
+        return offset * self._slot.size, int.from_bytes(info_hash[:8], "big")
+
+    def claim(self, info_hash: bytes) -> bool:
+        """Claims the info hash for this process, returns False if it is done or if
+        another process owns a claim that has not expired yet.
+        """
+        offset, fingerprint = self._locate(info_hash)
+        pid = os.getpid()
+        now = int(time.monotonic())
+
+        slot_fingerprint, slot_pid, expires_at = self._slot.unpack_from(
+            self._buffer, offset
+        )
+        if slot_fingerprint == fingerprint and slot_pid != pid and expires_at > now:
+            return False
+
+        self._slot.pack_into(self._buffer, offset, fingerprint, pid, now + self._ttl)
+        return True
+
+    def is_done(self, info_hash: bytes) -> bool:
+        offset, fingerprint = self._locate(info_hash)
+        slot_fingerprint, slot_pid, expires_at = self._slot.unpack_from(
+            self._buffer, offset
+        )
+        return (
+            slot_fingerprint == fingerprint
+            and slot_pid == self._DONE
+            and expires_at > int(time.monotonic())
+        )
+
+    def done(self, info_hash: bytes) -> None:
+        """Marks the info hash as stored, no process claims it until done_ttl"""
+        offset, fingerprint = self._locate(info_hash)
+        self._slot.pack_into(
+            self._buffer,
+            offset,
+            fingerprint,
+            self._DONE,
+            int(time.monotonic()) + self._done_ttl,
+        )
+
+    def release(self, info_hash: bytes) -> None:
+        """Gives up the claim of this process, so another one can fetch it now"""
+        offset, fingerprint = self._locate(info_hash)
+        slot_fingerprint, slot_pid, _ = self._slot.unpack_from(self._buffer, offset)
+        if slot_fingerprint == fingerprint and slot_pid == os.getpid():
+            self._slot.pack_into(self._buffer, offset, 0, 0, 0)
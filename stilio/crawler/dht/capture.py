@@ -0,0 +1,120 @@
+"""
+Captures of the datagrams received by the crawler, so the receive path can be
+replayed and benchmarked offline.
+
+A capture is a short header followed by length prefixed records:
+
+    header | (received at, ip, port, length, datagram)...
+"""
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import socket
+import struct
+import time
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from stilio.config import (
+    CRAWLER_CAPTURE_DIR,
+    CRAWLER_CAPTURE_MAX_BYTES,
+    CRAWLER_DEBUG_LEVEL,
+)
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STLCAP"
+VERSION = 1
+
+HEADER = struct.Struct("<6sB")
+# Unix time the datagram was received at, source ip and port, datagram length
+RECORD = struct.Struct("<dIHH")
+
+Address = Tuple[str, int]
+
+
+def capture_path(worker: int) -> Optional[str]:
+    """Path of the capture of a crawler process, None if captures are disabled"""
+    if not CRAWLER_CAPTURE_DIR:
+        return None
+    return os.path.join(CRAWLER_CAPTURE_DIR, f"crawler-{worker}.capture")
+
+
+class DatagramRecorder:
+    """Appends the datagrams received to a capture file until it reaches max_bytes"""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = CRAWLER_CAPTURE_MAX_BYTES,
+        buffer_size: int = 1 << 20,
+    ):
+        """Args:
+
+            path: capture file, created or appended to
+            max_bytes: size of the file after which recording stops
+            buffer_size: bytes buffered before they are written
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file: Optional[BinaryIO] = open(path, "ab", buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._max_bytes = max_bytes
+        self._size = self._file.tell()
+
+        # Stats
+        self.recorded = 0
+
+    @property
+    def recording(self) -> bool:
+        return self._file is not None
+
+    def record(self, data: bytes, address: Address) -> None:
+        if self._file is None:
+            return
+        try:
+            ip = int.from_bytes(socket.inet_aton(address[0]), "big")
+        except OSError:
+            return
+
+        self._file.write(RECORD.pack(time.time(), ip, address[1], len(data)))
+        self._file.write(data)
+        self._size += RECORD.size + len(data)
+        self.recorded += 1
+
+        if self._size >= self._max_bytes:
+            logger.warning(f"Capture reached {self._max_bytes} bytes, stopping it")
+            self.close()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, bytes, Address]]:
+    """Yields the time, datagram and source address of every record of a capture,
+    a record cut short by a crash ends the capture
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            return
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with buffer:
+        magic, version = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a capture")
+
+        offset = HEADER.size
+        end = len(buffer)
+        while offset + RECORD.size <= end:
+            received_at, ip, port, length = RECORD.unpack_from(buffer, offset)
+            offset += RECORD.size
+            if offset + length > end:
+                break
+            data = buffer[offset : offset + length]
+            offset += length
+            yield received_at, data, (socket.inet_ntoa(ip.to_bytes(4, "big")), port)
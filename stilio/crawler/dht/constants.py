@@ -1,4 +1,9 @@
 TOKEN_LENGTH = 2
 
+# Transaction id prefixes of the queries sent by the discovery engine, responses
+# are routed back to it by prefix
+SAMPLE_INFOHASHES_TID_PREFIX = b"si"
+GET_PEERS_TID_PREFIX = b"gp"
+
 
 protected_networks = [""]
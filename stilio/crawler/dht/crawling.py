@@ -1,64 +1,276 @@
 from __future__ import annotations
 
 import asyncio
+import datetime as dt
 import logging
-from typing import List, Tuple
+import signal
+import time
+from typing import List, Optional, Sequence, Set, Tuple
 
+from stilio import metrics
 from stilio.config import (
     CRAWLER_ADDRESS,
+    CRAWLER_ALLOW_RESERVED_ADDRESSES,
     CRAWLER_BOOTSTRAP_NODES,
     CRAWLER_DEBUG_LEVEL,
+    CRAWLER_DISCOVERY,
+    CRAWLER_DISCOVERY_LOOKUP_TIMEOUT,
+    CRAWLER_DISCOVERY_MAX_LOOKUPS,
+    CRAWLER_DISCOVERY_SAMPLES_PER_TICK,
+    CRAWLER_METRICS_ADDRESS,
+    CRAWLER_METRICS_PORT,
+    CRAWLER_POPULARITY,
     CRAWLER_PORT,
+    CRAWLER_SEEN_INFO_HASHES_CACHE_SIZE,
+    CRAWLER_SEEN_INFO_HASHES_CAPACITY,
+    CRAWLER_SEEN_INFO_HASHES_ERROR_RATE,
+    CRAWLER_SNAPSHOT_INTERVAL,
+    CRAWLER_UDP_DROP_POLICY,
+    CRAWLER_UDP_MAX_BYTES_PER_SECOND,
+    CRAWLER_UDP_MAX_PACKETS_PER_SECOND,
+    CRAWLER_UDP_SEND_QUEUE_SIZE,
+    CRAWLER_VIRTUAL_NODES,
 )
-from stilio.crawler.bittorrent.bencoding import BencoderError, decode
 from stilio.crawler.bittorrent.metadata import MetadataFetcher
+from stilio.crawler.dedup import InfoHashFilter, SharedInfoHashClaims
 from stilio.crawler.dht import utils as dht_utils
+from stilio.crawler.dht.capture import DatagramRecorder
+from stilio.crawler.dht.discovery import DiscoveryEngine
 from stilio.crawler.dht.dispatcher import DHTDispatcher
 from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.pacing import OutboundPacer
 from stilio.crawler.dht.routing import RoutingTable
 from stilio.crawler.dht.rpc import RPC
-from stilio.persistence import utils as db_utils
-from stilio.persistence.exceptions import PersistenceError
+from stilio.crawler.dht.scheduling import QueryScheduler
+from stilio.crawler.popularity import PopularityAggregator
+from stilio.crawler.snapshot import CrawlerSnapshot
+from stilio.persistence.ingest import IngestStage
+from stilio.persistence.pipeline import TorrentPipeline
 from stilio.persistence.torrents.models import Torrent
 
 logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
 logger = logging.getLogger(__name__)
 
+ACTIVE_TASKS = metrics.Gauge("stilio_crawler_active_tasks", "Tasks in the event loop")
+NEIGHBORS = metrics.Gauge(
+    "stilio_crawler_max_neighbors", "Maximum number of neighbors per tick"
+)
+
+# Torrents stored shortly before a seed may not have been committed yet
+SEED_OVERLAP = 300  # In seconds
+
 
 class CrawlingService(DHTDispatcher):
-    def __init__(self, max_neighbors: int = 500, tick_interval: int = 1):
+    def __init__(
+        self,
+        max_neighbors: int = 500,
+        tick_interval: int = 1,
+        port: int = CRAWLER_PORT,
+        reuse_port: bool = False,
+        claims: Optional[SharedInfoHashClaims] = None,
+        virtual_nodes: int = CRAWLER_VIRTUAL_NODES,
+        metrics_port: Optional[int] = CRAWLER_METRICS_PORT,
+        snapshot_path: Optional[str] = None,
+        peers_scale: int = 1,
+        capture_path: Optional[str] = None,
+        bootstrap_nodes: Sequence[Tuple[str, int]] = CRAWLER_BOOTSTRAP_NODES,
+        allow_reserved_addresses: bool = CRAWLER_ALLOW_RESERVED_ADDRESSES,
+    ):
         """Args:
 
             max_neighbors: maximum number of neighbors in the crawling service 
             tick_interval: number of seconds between every attempt to get new neighbors 
+            port: UDP port of the first node, the rest use the following ports
+            reuse_port: allow other processes to bind the same ports
+            claims: info hashes claimed by other crawling services, if any
+            virtual_nodes: number of node ids hosted by the crawling service
+            metrics_port: port serving the metrics, disabled if None
+            snapshot_path: file the state is restored from and periodically saved
+                to, disabled if None
+            peers_scale: number of crawling services sharing the node ids and so
+                the announces, used to scale the peers each one counts
+            capture_path: file the datagrams received are recorded to, disabled
+                if None
+            bootstrap_nodes: addresses queried when the routing table is empty
+            allow_reserved_addresses: accept nodes and peers with private or
+                loopback addresses, for simulated swarms
         """
-        self.node = Node.create_random(CRAWLER_ADDRESS, CRAWLER_PORT)
+        self._snapshot_path = snapshot_path
+        snapshot = CrawlerSnapshot.load(snapshot_path) if snapshot_path else None
+
+        # Keep the node ids other nodes already know us by
+        if snapshot and len(snapshot.nids) == virtual_nodes:
+            self.nodes: List[Node] = [
+                Node(nid, CRAWLER_ADDRESS, port + i)
+                for i, nid in enumerate(snapshot.nids)
+            ]
+        else:
+            self.nodes = [
+                Node.create_random(CRAWLER_ADDRESS, port + i)
+                for i in range(virtual_nodes)
+            ]
+        self._nids = {node.nid for node in self.nodes}
+        self._bootstrap_nodes = bootstrap_nodes
+
+        self.pacer: Optional[OutboundPacer] = None
+        if CRAWLER_UDP_MAX_PACKETS_PER_SECOND or CRAWLER_UDP_MAX_BYTES_PER_SECOND:
+            self.pacer = OutboundPacer(
+                packets_per_second=CRAWLER_UDP_MAX_PACKETS_PER_SECOND,
+                bytes_per_second=CRAWLER_UDP_MAX_BYTES_PER_SECOND,
+                max_queue_size=CRAWLER_UDP_SEND_QUEUE_SIZE,
+                drop_policy=CRAWLER_UDP_DROP_POLICY,
+            )
+        self._pacer_dropped = 0
+
+        self.rpcs: List[RPC] = [
+            RPC(node, reuse_port, self.pacer) for node in self.nodes
+        ]
+        for rpc in self.rpcs:
+            rpc.on_bandwidth_exhausted = self.on_bandwidth_exhausted
 
-        self.rpc: RPC = RPC()
-        self.rpc.on_bandwidth_exhausted = self.on_bandwidth_exhausted
+        self.recorder: Optional[DatagramRecorder] = None
+        if capture_path:
+            self.recorder = DatagramRecorder(capture_path)
+            for rpc in self.rpcs:
+                rpc.udp_node.recorder = self.recorder
 
         self.routing_table: RoutingTable = RoutingTable(max_neighbors)
+        self._metrics_port = metrics_port
 
         self.loop = asyncio.get_event_loop()
 
         self._tick_interval = tick_interval
+        self._scheduler = QueryScheduler()
 
         self.metadata_fetcher = MetadataFetcher(
             on_metadata_result=self.on_metadata_result
         )
+        self.metadata_fetcher.on_fetch_failed = self._on_fetch_failed
+
+        self.seen_info_hashes = InfoHashFilter(
+            lookup=Torrent.exists,
+            capacity=CRAWLER_SEEN_INFO_HASHES_CAPACITY,
+            error_rate=CRAWLER_SEEN_INFO_HASHES_ERROR_RATE,
+            cache_size=CRAWLER_SEEN_INFO_HASHES_CACHE_SIZE,
+        )
+        self.claims = claims
+        # Fetched but not stored yet, only added to the seen ones once stored
+        self._storing: Set[bytes] = set()
+
+        # Nodes contacted in the last tick, kept for the snapshots
+        self._neighbors: List[Node] = []
+        self._tick_task: Optional[asyncio.Future] = None
+        self._seeded_at: Optional[float] = None
+        self._next_snapshot_at = self.loop.time() + CRAWLER_SNAPSHOT_INTERVAL
+        if snapshot:
+            self._restore(snapshot)
+
+        self.pipeline = TorrentPipeline(
+            on_stored=self.on_torrents_stored, on_failed=self.on_torrents_failed
+        )
+        self.ingest = IngestStage(on_row=self.pipeline.put)
+        self.ingest.on_backpressure = self.metadata_fetcher.pause
+        self.ingest.on_failed = self._on_store_failed
+
+        self.popularity: Optional[PopularityAggregator] = None
+        if CRAWLER_POPULARITY:
+            self.popularity = PopularityAggregator(scale=peers_scale)
+
+        self.discovery: Optional[DiscoveryEngine] = None
+        if CRAWLER_DISCOVERY:
+            self.discovery = DiscoveryEngine(
+                self.rpcs,
+                self._scheduler,
+                is_wanted=self._is_unseen,
+                on_peer=self._fetch_metadata,
+                samples_per_tick=CRAWLER_DISCOVERY_SAMPLES_PER_TICK,
+                max_lookups=CRAWLER_DISCOVERY_MAX_LOOKUPS,
+                lookup_timeout=CRAWLER_DISCOVERY_LOOKUP_TIMEOUT,
+            )
 
-        super().__init__(self.rpc)
+        super().__init__(self.rpcs, allow_reserved_addresses)
 
     async def _bootstrap(self) -> None:
         """Bootstrap the crawler with some default nodes
         """
-        for address in CRAWLER_BOOTSTRAP_NODES:
-            self.rpc.find_node(self.node.nid, address=address)
+        for rpc in self.rpcs:
+            for address in self._bootstrap_nodes:
+                rpc.find_node(rpc.node.nid, address=address)
+
+    def _seed_seen_info_hashes(self) -> None:
+        """Load the info hashes already stored so announces for them skip the db,
+        after a warm restart only the ones stored since the snapshot was seeded
+        """
+        seeded_at = time.time()
+        added_after = None
+        if self._seeded_at is not None:
+            added_after = dt.datetime.fromtimestamp(self._seeded_at - SEED_OVERLAP)
+        count = self.seen_info_hashes.seed(Torrent.info_hashes(added_after))
+        self._seeded_at = seeded_at
+        logger.info(f"Loaded {count} stored info hashes")
+
+    def _restore(self, snapshot: CrawlerSnapshot) -> None:
+        self.routing_table.max_size = snapshot.max_neighbors
+        self.routing_table.extend(
+            [node for node in snapshot.nodes if node.nid not in self._nids]
+        )
+        self.seen_info_hashes.bloom_filter.restore(snapshot.filters)
+        self._seeded_at = snapshot.seeded_at
+        logger.info(
+            f"Restored {len(self.routing_table.nodes)} nodes and "
+            f"{len(self.seen_info_hashes)} seen info hashes from a snapshot taken "
+            f"{time.time() - snapshot.saved_at:.0f} seconds ago"
+        )
+
+    def _save_snapshot(self) -> None:
+        if not self._snapshot_path or self._seeded_at is None:
+            return
+        snapshot = CrawlerSnapshot(
+            seeded_at=self._seeded_at,
+            max_neighbors=self.routing_table.max_size,
+            nids=[node.nid for node in self.nodes],
+            nodes=self._neighbors or self.routing_table.nodes,
+            filters=self.seen_info_hashes.bloom_filter.filters,
+        )
+        try:
+            snapshot.save(self._snapshot_path)
+        except OSError as e:
+            logger.warning(f"Error saving the snapshot to {self._snapshot_path}: {e}")
 
     def _make_neighbors(self) -> None:
-        for node in self.routing_table.nodes:
-            neighbor_nid = dht_utils.generate_neighbor_nid(self.node.nid, node.nid)
-            self.rpc.find_node(neighbor_nid, address=(node.address, node.port))
+        """Every node of the routing table is contacted by one of the local nodes,
+        so the neighbors are spread across all of them. Queries are spread evenly
+        over the tick instead of being sent in a single burst.
+        """
+        rpc_count = len(self.rpcs)
+        queries = []
+        for i, node in enumerate(self.routing_table.nodes):
+            rpc = self.rpcs[i % rpc_count]
+            neighbor_nid = dht_utils.generate_neighbor_nid(rpc.node.nid, node.nid)
+            queries.append((rpc, neighbor_nid, (node.address, node.port)))
+
+        self._scheduler.spread(self._find_node, queries, self._tick_interval)
+
+    @staticmethod
+    def _find_node(rpc: RPC, nid: bytes, address: Tuple[str, int]) -> None:
+        rpc.find_node(nid, address=address)
+
+    def _adjust_max_neighbors(self) -> None:
+        """Without a pacer the number of neighbors grows until the kernel reports
+        congestion. With a pacer it grows while the send queue is almost empty and
+        shrinks slightly when the queue drops datagrams, settling at the budget.
+        """
+        if not self.pacer:
+            self.routing_table.max_size = self.routing_table.max_size * 101 // 100
+            return
+
+        dropped = self.pacer.dropped - self._pacer_dropped
+        self._pacer_dropped = self.pacer.dropped
+
+        if dropped:
+            self.routing_table.max_size = self.routing_table.max_size * 98 // 100
+        elif self.pacer.queue_fill < 0.1:
+            self.routing_table.max_size = self.routing_table.max_size * 101 // 100
 
     async def _tick_periodically(self) -> None:
         while self._running:
@@ -68,26 +280,66 @@ class CrawlingService(DHTDispatcher):
                 await self._bootstrap()
 
             self._make_neighbors()
-            self.routing_table.nodes.clear()
+            if self.discovery:
+                self.discovery.sample(self.routing_table.nodes, self._tick_interval)
+            self._neighbors = self.routing_table.nodes
+            self.routing_table.nodes = []
 
-            self.routing_table.max_size = self.routing_table.max_size * 101 // 100
+            self._adjust_max_neighbors()
+
+            if self.loop.time() >= self._next_snapshot_at:
+                self._next_snapshot_at = self.loop.time() + CRAWLER_SNAPSHOT_INTERVAL
+                self._save_snapshot()
 
             logging.debug(f"Max number of neighbors is {self.routing_table.max_size}")
-            logger.info(f"Active tasks: {len(asyncio.Task.all_tasks())}")
+            NEIGHBORS.set(self.routing_table.max_size)
+            ACTIVE_TASKS.set(len(asyncio.all_tasks(self.loop)))
 
     def on_announce_peer(
-        self, tid: bytes, nid: bytes, info_hash: bytes, address: Tuple[str, int]
+        self,
+        rpc: RPC,
+        tid: bytes,
+        nid: bytes,
+        info_hash: bytes,
+        address: Tuple[str, int],
     ) -> None:
         """Peer found, respond with a fake node id"""
-        self.rpc.respond_announce_peer(
+        rpc.respond_announce_peer(
             tid=tid,
-            nid=dht_utils.generate_neighbor_nid(self.node.nid, nid),
+            nid=dht_utils.generate_neighbor_nid(rpc.node.nid, nid),
             address=address,
         )
         logger.debug(f"On announce peer, infohash {info_hash.hex()}")
 
-        if not Torrent.exists(info_hash):
-            self.metadata_fetcher.fetch(info_hash, address)
+        if self.popularity and self.seen_info_hashes.might_exist(info_hash):
+            self.popularity.on_announce(info_hash, address[0])
+        self._fetch_metadata(info_hash, address)
+
+    def _is_unseen(self, info_hash: bytes) -> bool:
+        if info_hash in self._storing:
+            return False
+        return not self.seen_info_hashes.exists(info_hash)
+
+    def _fetch_metadata(self, info_hash: bytes, address: Tuple[str, int]) -> None:
+        """Fetches the metadata from the peer unless the info hash is already
+        stored, being stored or being fetched by another crawling service
+        """
+        if not self._is_unseen(info_hash):
+            return
+        if self.claims:
+            if self.claims.is_done(info_hash):
+                # Stored by another crawling service
+                self.seen_info_hashes.add(info_hash)
+                return
+            if not self.claims.claim(info_hash):
+                return
+
+        if not self.metadata_fetcher.fetch(info_hash, address) and self.claims:
+            self.claims.release(info_hash)
+
+    def _on_fetch_failed(self, info_hash: bytes) -> None:
+        if self.claims:
+            self.claims.release(info_hash)
 
     def on_bandwidth_exhausted(self):
         """Bandwidth is being exhausted, reduce the number of nodes or warn the user
@@ -102,42 +354,125 @@ class CrawlingService(DHTDispatcher):
             self.routing_table.max_size = self.routing_table.max_size * 9 // 10
 
     def on_find_node(self, nodes: List[Node]) -> None:
-        """Found a node, if the table is not full and the node is not in the routing
-        table already, add it
+        """Found a batch of valid nodes, add as many as fit in the routing table
+        skipping our own nodes
         """
         if not self.routing_table.is_full:
-            nodes = [node for node in nodes if self.node != node and node.is_valid]
-            for node in nodes:
-                self.routing_table.add(node)
+            self.routing_table.extend(
+                [node for node in nodes if node.nid not in self._nids]
+            )
 
     def on_get_peers(
-        self, info_hash: bytes, tid: bytes, address: Tuple[str, int]
+        self, rpc: RPC, info_hash: bytes, tid: bytes, address: Tuple[str, int]
     ) -> None:
-        self.rpc.respond_get_peers(
-            tid=tid, info_hash=info_hash, nid=self.node.nid, address=address
+        rpc.respond_get_peers(
+            tid=tid, info_hash=info_hash, nid=rpc.node.nid, address=address
         )
         logger.debug(f"On get peers, infohash {info_hash.hex()}")
 
+        if self.popularity and self.seen_info_hashes.might_exist(info_hash):
+            self.popularity.on_get_peers(info_hash, address[0])
+
+    def on_sample_infohashes(
+        self,
+        rpc: RPC,
+        samples: bytes,
+        interval: Optional[int],
+        address: Tuple[str, int],
+    ) -> None:
+        if self.discovery:
+            self.discovery.on_samples(rpc, samples, interval, address)
+
+    def on_get_peers_response(
+        self,
+        rpc: RPC,
+        tid: bytes,
+        peers: List[Tuple[str, int]],
+        nodes: List[Node],
+        address: Tuple[str, int],
+    ) -> None:
+        if self.discovery:
+            self.discovery.on_get_peers_response(rpc, tid, peers, nodes, address)
+
     def on_metadata_result(self, info_hash: bytes, metadata: bytes) -> None:
-        """Received metadata (aka torrent info), decode it and store in db"""
-        try:
-            metadata_decoded = decode(metadata)
-            db_utils.store_metadata(info_hash, metadata_decoded, logger)
-        except (asyncio.CancelledError, BencoderError, PersistenceError):
-            pass
-        except Exception as e:
-            logger.debug("Error retrieving metadata")
-            logger.exception(e)
+        """Received metadata (aka torrent info) matching the info hash, queue it to
+        be decoded and stored. Announces arriving before it is stored do not
+        fetch it again, it is only seen for good once stored.
+        """
+        if not self._running:
+            return
+        self._storing.add(info_hash)
+        self.ingest.put(info_hash, metadata)
+
+    def on_torrents_stored(self, rows: List[dict]) -> None:
+        """The rows are in the database, inserted now or earlier"""
+        for row in rows:
+            info_hash = bytes.fromhex(row["info_hash"])
+            self._storing.discard(info_hash)
+            self.seen_info_hashes.add(info_hash)
+            if self.claims:
+                self.claims.done(info_hash)
+
+    def on_torrents_failed(self, rows: List[dict]) -> None:
+        for row in rows:
+            self._on_store_failed(bytes.fromhex(row["info_hash"]))
+
+    def _on_store_failed(self, info_hash: bytes) -> None:
+        """The metadata could not be stored, the next announce fetches it again"""
+        self._storing.discard(info_hash)
+        if self.claims:
+            self.claims.release(info_hash)
 
     def run(self) -> None:
         self._running = True
 
-        self.loop.run_until_complete(self.rpc.start())
-        asyncio.ensure_future(self._tick_periodically())
+        self._seed_seen_info_hashes()
+
+        for rpc in self.rpcs:
+            self.loop.run_until_complete(rpc.start())
+        if self._metrics_port is not None:
+            self.loop.run_until_complete(
+                metrics.start_http_server(CRAWLER_METRICS_ADDRESS, self._metrics_port)
+            )
+        self.pipeline.start()
+        if self.popularity:
+            self.popularity.start()
+        self._tick_task = asyncio.ensure_future(self._tick_periodically())
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stop)
 
         self.loop.run_forever()
         self.loop.close()
 
+    async def _stop_persistence(self) -> None:
+        await self.ingest.stop()
+        await self.pipeline.stop()
+        if self.popularity:
+            await self.popularity.stop()
+
+    async def _shutdown(self) -> None:
+        """Stops the loop once the metadata already fetched has been stored"""
+        try:
+            await self._stop_persistence()
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            logger.info("Crawler stopped")
+            self.loop.stop()
+
     def stop(self) -> None:
+        """Stops crawling, the loop stops once the queued torrents are stored"""
+        if not self._running:
+            return
+        logger.info("Stopping the crawler")
         self._running = False
-        self.loop.call_later(self._tick_interval, self.loop.stop)
+        self._scheduler.clear()
+        if self._tick_task:
+            self._tick_task.cancel()
+        # Metadata arriving from now on is dropped, so the queues only drain
+        self.ingest.on_backpressure = None
+        self.metadata_fetcher.pause()
+        self._save_snapshot()
+        if self.recorder:
+            self.recorder.close()
+        asyncio.ensure_future(self._shutdown())
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from stilio import metrics
+from stilio.crawler.dht import utils as dht_utils
+from stilio.crawler.dht.constants import (
+    GET_PEERS_TID_PREFIX,
+    SAMPLE_INFOHASHES_TID_PREFIX,
+)
+from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.rpc import RPC
+from stilio.crawler.dht.scheduling import QueryScheduler
+
+Address = Tuple[str, int]
+
+SAMPLES = metrics.Counter(
+    "stilio_discovery_samples", "Info hashes received in sample_infohashes responses"
+)
+LOOKUPS = metrics.Counter(
+    "stilio_discovery_lookups", "Peer lookups of sampled info hashes", ["result"]
+)
+LOOKUPS_FOUND = LOOKUPS.labels("found")
+LOOKUPS_EXPIRED = LOOKUPS.labels("expired")
+LOOKUPS_DROPPED = LOOKUPS.labels("dropped")
+PEERS = metrics.Counter("stilio_discovery_peers", "Peers found by the lookups")
+
+# BEP 51 caps the interval at 6 hours
+MAX_SAMPLE_INTERVAL = 21600
+
+
+class Lookup:
+    __slots__ = ("info_hash", "target", "queried", "remaining", "expires_at")
+
+    def __init__(self, info_hash: bytes, queries: int, expires_at: float):
+        self.info_hash = info_hash
+        self.target = int.from_bytes(info_hash, "big")
+        self.queried: Set[Address] = set()
+        self.remaining = queries
+        self.expires_at = expires_at
+
+
+class DiscoveryEngine:
+    """Actively discovers info hashes through BEP 51 sample_infohashes queries.
+
+    Every tick the nodes of the routing table that are not waiting out their
+    interval are asked for a sample of the info hashes they store. The unseen ones
+    start a get_peers lookup, first against the sampling node, which stores their
+    peers, and then walking towards the info hash through the closest nodes
+    returned. The peers found are handed to on_peer.
+
+    Responses are matched to the lookups by their transaction id and the address
+    queried, the 16 bit transaction ids wrap so a late response to an old query
+    could otherwise be taken for one to a newer query.
+    """
+
+    def __init__(
+        self,
+        rpcs: Sequence[RPC],
+        scheduler: QueryScheduler,
+        is_wanted: Callable[[bytes], bool],
+        on_peer: Callable[[bytes, Address], None],
+        samples_per_tick: int = 100,
+        max_lookups: int = 5_000,
+        queries_per_lookup: int = 8,
+        lookup_timeout: float = 30,
+        default_interval: float = 300,
+        max_tracked_nodes: int = 100_000,
+    ):
+        """Args:
+
+            rpcs: local nodes the queries are sent from
+            scheduler: scheduler used to spread the queries over the tick
+            is_wanted: returns whether a sampled info hash should be looked up
+            on_peer: called with every peer found for an info hash
+            samples_per_tick: maximum number of sample_infohashes queries per tick
+            max_lookups: maximum number of lookups in progress
+            queries_per_lookup: maximum number of get_peers queries per lookup
+            lookup_timeout: seconds before a lookup without peers is abandoned
+            default_interval: seconds between samples of a node not sending one
+            max_tracked_nodes: maximum number of node intervals remembered
+        """
+        self._rpcs = rpcs
+        self._scheduler = scheduler
+        self._is_wanted = is_wanted
+        self._on_peer = on_peer
+
+        self._samples_per_tick = samples_per_tick
+        self._max_lookups = max_lookups
+        self._queries_per_lookup = queries_per_lookup
+        self._lookup_timeout = lookup_timeout
+        self._default_interval = default_interval
+        self._max_tracked_nodes = max_tracked_nodes
+
+        self._next_sample: Dict[Address, float] = {}
+        self._lookups: Dict[bytes, Lookup] = {}
+        self._transactions: Dict[bytes, Tuple[bytes, Address]] = {}
+        self._tid = 0
+
+        self.loop = asyncio.get_event_loop()
+
+    @property
+    def lookups(self) -> int:
+        return len(self._lookups)
+
+    def _next_tid(self, prefix: bytes) -> bytes:
+        self._tid = (self._tid + 1) & 0xFFFF
+        return prefix + self._tid.to_bytes(2, "big")
+
+    def _wait(self, address: Address, until: float) -> None:
+        if (
+            len(self._next_sample) < self._max_tracked_nodes
+            or address in self._next_sample
+        ):
+            self._next_sample[address] = until
+
+    def _expire(self, now: float) -> None:
+        self._next_sample = {
+            address: until
+            for address, until in self._next_sample.items()
+            if until > now
+        }
+
+        for info_hash, lookup in list(self._lookups.items()):
+            if lookup.expires_at <= now:
+                del self._lookups[info_hash]
+                LOOKUPS_EXPIRED.inc()
+
+        self._transactions = {
+            tid: transaction
+            for tid, transaction in self._transactions.items()
+            if transaction[0] in self._lookups
+        }
+
+    def sample(self, nodes: Sequence[Node], interval: float) -> None:
+        """Queries the nodes that can be sampled again, spread over the interval"""
+        now = self.loop.time()
+        self._expire(now)
+
+        rpc_count = len(self._rpcs)
+        queries: List[Tuple[RPC, bytes, Address]] = []
+        for node in nodes:
+            if len(queries) >= self._samples_per_tick:
+                break
+            address = (node.address, node.port)
+            if self._next_sample.get(address, 0) > now:
+                continue
+            self._wait(address, now + self._default_interval)
+
+            rpc = self._rpcs[len(queries) % rpc_count]
+            nid = dht_utils.generate_neighbor_nid(rpc.node.nid, node.nid)
+            queries.append((rpc, nid, address))
+
+        self._scheduler.spread(self._sample_infohashes, queries, interval)
+
+    def _sample_infohashes(self, rpc: RPC, nid: bytes, address: Address) -> None:
+        rpc.sample_infohashes(
+            tid=self._next_tid(SAMPLE_INFOHASHES_TID_PREFIX), nid=nid, address=address
+        )
+
+    def _get_peers(self, rpc: RPC, lookup: Lookup, address: Address) -> None:
+        lookup.queried.add(address)
+        lookup.remaining -= 1
+
+        tid = self._next_tid(GET_PEERS_TID_PREFIX)
+        self._transactions[tid] = (lookup.info_hash, address)
+        rpc.get_peers(
+            tid=tid, nid=rpc.node.nid, info_hash=lookup.info_hash, address=address
+        )
+
+    def on_samples(
+        self, rpc: RPC, samples: bytes, interval: Optional[int], address: Address
+    ) -> None:
+        now = self.loop.time()
+        if interval is not None:
+            self._wait(address, now + min(max(interval, 0), MAX_SAMPLE_INTERVAL))
+
+        info_hashes = dht_utils.split_info_hashes(samples)
+        SAMPLES.inc(len(info_hashes))
+
+        for info_hash in info_hashes:
+            if info_hash in self._lookups or not self._is_wanted(info_hash):
+                continue
+            if len(self._lookups) >= self._max_lookups:
+                LOOKUPS_DROPPED.inc()
+                continue
+
+            lookup = Lookup(
+                info_hash, self._queries_per_lookup, now + self._lookup_timeout
+            )
+            self._lookups[info_hash] = lookup
+            self._get_peers(rpc, lookup, address)
+
+    def on_get_peers_response(
+        self,
+        rpc: RPC,
+        tid: bytes,
+        peers: List[Address],
+        nodes: List[Node],
+        address: Address,
+    ) -> None:
+        transaction = self._transactions.get(tid)
+        if transaction is None or transaction[1] != address:
+            return
+        del self._transactions[tid]
+        info_hash = transaction[0]
+        lookup = self._lookups.get(info_hash)
+        if lookup is None:
+            return
+
+        if peers:
+            del self._lookups[info_hash]
+            LOOKUPS_FOUND.inc()
+            PEERS.inc(len(peers))
+            for peer in peers:
+                self._on_peer(info_hash, peer)
+            return
+
+        # No peers yet, keep walking towards the info hash
+        target = lookup.target
+        nodes = sorted(nodes, key=lambda node: int.from_bytes(node.nid, "big") ^ target)
+        for node in nodes[:3]:
+            if lookup.remaining <= 0:
+                break
+            address = (node.address, node.port)
+            if address not in lookup.queried:
+                self._get_peers(rpc, lookup, address)
@@ -1,38 +1,52 @@
 from __future__ import annotations
 
 from abc import abstractmethod
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
 
-from stilio.crawler.bittorrent.bencoding import KRPCTypes
+from stilio import metrics
 from stilio.crawler.dht import utils as dht_utils
+from stilio.crawler.dht.constants import (
+    GET_PEERS_TID_PREFIX,
+    SAMPLE_INFOHASHES_TID_PREFIX,
+)
+from stilio.crawler.dht.krpc import KRPCMessage
 from stilio.crawler.dht.node import Node
 from stilio.crawler.dht.rpc import RPC
 
+MESSAGES = metrics.Counter("stilio_dht_messages", "KRPC messages received", ["type"])
+MESSAGE_TYPES = {
+    q: MESSAGES.labels(q.decode())
+    for q in (
+        b"ping",
+        b"find_node",
+        b"get_peers",
+        b"announce_peer",
+        b"sample_infohashes",
+    )
+}
+MESSAGES_RESPONSE = MESSAGES.labels("response")
+MESSAGES_OTHER = MESSAGES.labels("other")
+
 
 class DHTDispatcher:
-    def __init__(self, rpc: RPC):
+    def __init__(self, rpcs: Sequence[RPC], allow_reserved_addresses: bool = False):
         self._running = True
+        self._allow_reserved_addresses = allow_reserved_addresses
 
-        rpc.on_response = self.on_response
-
-    def _validate_on_announce_peer(self, data):
-        return (
-            b"a" in data
-            and b"id" in data[b"a"]
-            and b"t" in data
-            and b"info_hash" in data[b"a"]
-            and b"port" in data[b"a"]
-        )
+        for rpc in rpcs:
+            rpc.on_response = self.on_response
 
-    def _validate_on_find_node(self, encoded_nodes):
+    def _validate_on_find_node(self, encoded_nodes: bytes) -> bool:
         return len(encoded_nodes) % 26 == 0
 
-    def _validate_on_get_peers(self, data):
-        return b"a" in data and b"info_hash" in data[b"a"] and b"t" in data
-
     @abstractmethod
     def on_announce_peer(
-        self, tid: bytes, nid: bytes, info_hash: bytes, address: Tuple[str, int]
+        self,
+        rpc: RPC,
+        tid: bytes,
+        nid: bytes,
+        info_hash: bytes,
+        address: Tuple[str, int],
     ) -> None:
         pass
 
@@ -42,40 +56,84 @@ class DHTDispatcher:
 
     @abstractmethod
     def on_get_peers(
-        self, info_hash: bytes, tid: bytes, address: Tuple[str, int]
+        self, rpc: RPC, info_hash: bytes, tid: bytes, address: Tuple[str, int]
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def on_sample_infohashes(
+        self,
+        rpc: RPC,
+        samples: bytes,
+        interval: Optional[int],
+        address: Tuple[str, int],
     ) -> None:
         pass
 
-    def on_response(self, data: KRPCTypes, address: Tuple[str, int]) -> None:
+    @abstractmethod
+    def on_get_peers_response(
+        self,
+        rpc: RPC,
+        tid: bytes,
+        peers: List[Tuple[str, int]],
+        nodes: List[Node],
+        address: Tuple[str, int],
+    ) -> None:
+        pass
+
+    def on_response(
+        self, rpc: RPC, message: KRPCMessage, address: Tuple[str, int]
+    ) -> None:
         if not self._running:
             return
-        elif (
-            isinstance(data.get(b"r"), dict) and type(data[b"r"].get(b"nodes")) is bytes
-        ):
-            encoded_nodes = data[b"r"][b"nodes"]
-            if self._validate_on_find_node(encoded_nodes):
-                decoded_nodes = dht_utils.decode_nodes(encoded_nodes)
-                self.on_find_node(decoded_nodes)
-        elif data.get(b"q") == b"get_peers" and self._validate_on_get_peers(data):
-            info_hash = data[b"a"][b"info_hash"]
-            tid = data[b"t"]
-
-            self.on_get_peers(info_hash, tid, address)
-        elif data.get(b"q") == b"announce_peer" and self._validate_on_announce_peer(
-            data
-        ):
-            nid = data[b"a"][b"id"]
-            tid = data[b"t"]
-            info_hash = data[b"a"][b"info_hash"]
-            port = data[b"a"][b"port"]
-
-            implied_port = (
-                data[b"a"][b"implied_port"] if b"implied_port" in data[b"a"] else None
-            )
-            remote_address = (
-                (address[0], address[1]) if implied_port else (address[0], port)
-            )
 
-            self.on_announce_peer(
-                nid=nid, tid=tid, info_hash=info_hash, address=remote_address
+        if message.q is None:
+            MESSAGES_RESPONSE.inc()
+        else:
+            MESSAGE_TYPES.get(message.q, MESSAGES_OTHER).inc()
+
+        decoded_nodes: Optional[List[Node]] = None
+        if message.nodes is not None and self._validate_on_find_node(message.nodes):
+            decoded_nodes = dht_utils.decode_valid_nodes(
+                message.nodes, self._allow_reserved_addresses
             )
+
+        # Responses to the queries of the discovery engine
+        tid = message.t
+        if message.y == b"r" and tid is not None:
+            if tid.startswith(SAMPLE_INFOHASHES_TID_PREFIX):
+                if message.samples is not None and len(message.samples) % 20 == 0:
+                    self.on_sample_infohashes(
+                        rpc, message.samples, message.interval, address
+                    )
+            elif tid.startswith(GET_PEERS_TID_PREFIX):
+                peers = dht_utils.decode_valid_peers(
+                    message.values or [], self._allow_reserved_addresses
+                )
+                self.on_get_peers_response(
+                    rpc, tid, peers, decoded_nodes or [], address
+                )
+
+        if message.nodes is not None:
+            if decoded_nodes is not None:
+                self.on_find_node(decoded_nodes)
+        elif message.q == b"get_peers":
+            info_hash, tid = message.info_hash, message.t
+            if info_hash is not None and tid is not None:
+                self.on_get_peers(rpc, info_hash, tid, address)
+        elif message.q == b"announce_peer":
+            nid, info_hash, tid = message.id, message.info_hash, message.t
+            port = address[1] if message.implied_port else message.port
+            if (
+                nid is not None
+                and info_hash is not None
+                and tid is not None
+                and port is not None
+            ):
+                self.on_announce_peer(
+                    rpc=rpc,
+                    nid=nid,
+                    tid=tid,
+                    info_hash=info_hash,
+                    address=(address[0], port),
+                )
@@ -0,0 +1,248 @@
+"""
+Fast path parser for the KRPC messages the crawler cares about.
+
+Instead of decoding the whole datagram into nested dicts, the top level dict and
+the "a"/"r" dicts are walked in place and only the fields used by the dispatcher
+are sliced out, every other value is skipped without being built. Anything the
+fast path does not understand is handed to the generic bencode decoder.
+"""
+from __future__ import annotations
+
+from typing import List, Optional, Tuple, Union
+
+from stilio.crawler.bittorrent.bencoding import BencoderError, decode
+
+_DICT = ord("d")
+_LIST = ord("l")
+_INT = ord("i")
+_END = ord("e")
+_COLON = ord(":")
+
+# Fields read from the "a" and "r" dicts, with their attribute name
+_STRING_FIELDS = {
+    b"id": "id",
+    b"info_hash": "info_hash",
+    b"nodes": "nodes",
+    b"token": "token",
+    b"samples": "samples",
+}
+_INT_FIELDS = {
+    b"port": "port",
+    b"implied_port": "implied_port",
+    b"interval": "interval",
+    b"num": "num",
+}
+_TOP_LEVEL_FIELDS = {b"y", b"q", b"t", b"a", b"r"}
+
+
+class KRPCError(ValueError):
+    pass
+
+
+class KRPCMessage:
+    __slots__ = (
+        "y",
+        "q",
+        "t",
+        "id",
+        "info_hash",
+        "port",
+        "implied_port",
+        "nodes",
+        "token",
+        "samples",
+        "interval",
+        "num",
+        "values",
+    )
+
+    def __init__(self) -> None:
+        self.y: Optional[bytes] = None
+        self.q: Optional[bytes] = None
+        self.t: Optional[bytes] = None
+        self.id: Optional[bytes] = None
+        self.info_hash: Optional[bytes] = None
+        self.port: Optional[int] = None
+        self.implied_port: Optional[int] = None
+        self.nodes: Optional[bytes] = None
+        self.token: Optional[bytes] = None
+        self.samples: Optional[bytes] = None
+        self.interval: Optional[int] = None
+        self.num: Optional[int] = None
+        self.values: Optional[List[bytes]] = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return f"KRPCMessage({fields})"
+
+    def _set(self, key: bytes, value: Union[bytes, int, list]) -> None:
+        if key in _STRING_FIELDS and type(value) is bytes:
+            setattr(self, _STRING_FIELDS[key], value)
+        elif key in _INT_FIELDS and type(value) is int:
+            setattr(self, _INT_FIELDS[key], value)
+        elif key == b"values" and type(value) is list:
+            self.values = [item for item in value if type(item) is bytes]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> KRPCMessage:
+        """Builds the message from a generically decoded datagram"""
+        message = cls()
+        for key in (b"y", b"q", b"t"):
+            if type(data.get(key)) is bytes:
+                setattr(message, key.decode(), data[key])
+        for key in (b"a", b"r"):
+            if isinstance(data.get(key), dict):
+                for field, value in data[key].items():
+                    message._set(field, value)
+        return message
+
+
+def _string_bounds(data: bytes, i: int) -> Tuple[int, int]:
+    colon = data.index(b":", i)
+    length = data[i:colon]
+    if not length.isdigit():
+        raise KRPCError(f"Invalid string length at {i}")
+    start = colon + 1
+    end = start + int(length)
+    if end > len(data):
+        raise KRPCError(f"String out of bounds at {i}")
+    return start, end
+
+
+def _skip(data: bytes, i: int) -> int:
+    """Returns the offset right after the value starting at i"""
+    depth = 0
+    while True:
+        c = data[i]
+        if c == _DICT or c == _LIST:
+            depth += 1
+            i += 1
+            continue
+        if c == _END:
+            if not depth:
+                raise KRPCError(f"Unexpected end at {i}")
+            depth -= 1
+            i += 1
+        elif c == _INT:
+            i = data.index(b"e", i) + 1
+        else:
+            i = _string_bounds(data, i)[1]
+
+        if not depth:
+            return i
+
+
+def parse_fast(data: bytes) -> KRPCMessage:
+    """Parses the datagram without building any dict, raises KRPCError (or an
+    IndexError/ValueError) if the datagram is not what the fast path expects.
+
+    Keys and values are read inline in a single loop over the top level dict and
+    the "a"/"r" dicts, calling out only to skip values that are not needed.
+    """
+    if data[0] != _DICT:
+        raise KRPCError("Message is not a dict")
+
+    find = data.find
+    message = KRPCMessage()
+    nested = False
+    i = 1
+    while True:
+        c = data[i]
+        if c == _END:
+            if not nested:
+                break
+            nested = False
+            i += 1
+            continue
+
+        # Key, most of them have a single digit length
+        if not 48 <= c <= 57:
+            raise KRPCError(f"Invalid key at {i}")
+        if data[i + 1] == _COLON:
+            start = i + 2
+            i = start + c - 48
+        else:
+            start, i = _string_bounds(data, i)
+        key = data[start:i]
+
+        # Value
+        c = data[i]
+        if 48 <= c <= 57:
+            if data[i + 1] == _COLON:
+                start = i + 2
+                i = start + c - 48
+            elif data[i + 2] == _COLON and 48 <= data[i + 1] <= 57:
+                start = i + 3
+                i = start + (c - 48) * 10 + data[i + 1] - 48
+            else:
+                start, i = _string_bounds(data, i)
+            if i > len(data):
+                raise KRPCError(f"String out of bounds at {start}")
+            if nested:
+                attribute = _STRING_FIELDS.get(key)
+                if attribute:
+                    setattr(message, attribute, data[start:i])
+            elif key == b"y":
+                message.y = data[start:i]
+            elif key == b"q":
+                message.q = data[start:i]
+            elif key == b"t":
+                message.t = data[start:i]
+            elif key == b"a" or key == b"r":
+                raise KRPCError(f"Unexpected {key!r} value")
+        elif c == _INT:
+            end = find(b"e", i)
+            digits = data[i + 1 : end]
+            if not digits.lstrip(b"-").isdigit():
+                raise KRPCError(f"Invalid integer at {i}")
+            value = int(digits)
+            i = end + 1
+            if nested:
+                attribute = _INT_FIELDS.get(key)
+                if attribute:
+                    setattr(message, attribute, value)
+            elif key in _TOP_LEVEL_FIELDS:
+                raise KRPCError(f"Unexpected {key!r} value")
+        elif c == _DICT and not nested and (key == b"a" or key == b"r"):
+            nested = True
+            i += 1
+        elif c == _LIST and nested and key == b"values":
+            # Compact peers of a get_peers response, a list of strings
+            values = []
+            i += 1
+            while data[i] != _END:
+                start, i = _string_bounds(data, i)
+                values.append(data[start:i])
+            i += 1
+            message.values = values
+        elif not nested and key in _TOP_LEVEL_FIELDS:
+            raise KRPCError(f"Unexpected {key!r} value")
+        else:
+            i = _skip(data, i)
+
+    if i + 1 != len(data):
+        raise KRPCError("Trailing data after message")
+    return message
+
+
+def parse(data: Union[bytes, memoryview]) -> Optional[KRPCMessage]:
+    """Parses a datagram, returns None if it cannot be decoded"""
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+
+    try:
+        return parse_fast(data)
+    except (IndexError, ValueError):
+        pass
+
+    try:
+        decoded = decode(data)
+    except BencoderError:
+        return None
+    if not isinstance(decoded, dict):
+        return None
+    return KRPCMessage.from_dict(decoded)
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import os
-from ipaddress import ip_address
 
 
 class Node:
+    __slots__ = ("nid", "address", "port")
+
     def __init__(self, nid: bytes, address: str, port: int):
         self.nid = nid
         self.address = address
@@ -14,18 +15,6 @@ class Node:
     def hex_id(self) -> str:
         return self.nid.hex()
 
-    @property
-    def is_address_public(self) -> bool:
-        return not ip_address(self.address).is_private
-
-    @property
-    def is_valid(self) -> bool:
-        return self.is_address_public and self.is_valid_port
-
-    @property
-    def is_valid_port(self) -> bool:
-        return 0 < self.port < 65536
-
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Node):
             return (
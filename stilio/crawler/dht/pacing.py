@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from asyncio.transports import DatagramTransport
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from stilio import metrics
+
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+
+QUEUE_FILL = metrics.Gauge(
+    "stilio_udp_send_queue_fill", "Fraction of the outbound queue in use"
+)
+BUCKET_FILL = metrics.Gauge(
+    "stilio_udp_bucket_fill", "Fraction of the outbound budget available", ["bucket"]
+)
+DROPPED = metrics.Counter("stilio_udp_dropped", "Datagrams dropped by the pacer")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Args:
+
+            rate: tokens added every second
+            capacity: maximum number of tokens, i.e. the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    @property
+    def fill(self) -> float:
+        self._refill()
+        return self.tokens / self.capacity
+
+    def has(self, amount: float) -> bool:
+        self._refill()
+        return self.tokens >= amount
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def delay(self, amount: float) -> float:
+        """Seconds until the bucket holds the given amount of tokens"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class OutboundPacer:
+    """Paces the datagrams sent by one or more UDPNodes under a packets per second
+    and a bytes per second budget.
+
+    Datagrams that exceed the budget wait in a bounded queue, once the queue is
+    full either the oldest queued datagram or the new one is dropped.
+    """
+
+    def __init__(
+        self,
+        packets_per_second: Optional[float] = None,
+        bytes_per_second: Optional[float] = None,
+        max_queue_size: int = 10_000,
+        drop_policy: str = DROP_OLDEST,
+        burst: float = 0.05,
+    ):
+        """Args:
+
+            packets_per_second: packets budget, unlimited if None
+            bytes_per_second: bytes budget, unlimited if None
+            max_queue_size: maximum number of datagrams waiting to be sent
+            drop_policy: DROP_OLDEST or DROP_NEWEST
+            burst: seconds of budget that can be sent at once
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy {drop_policy}")
+
+        self._packets = (
+            TokenBucket(packets_per_second, max(1.0, packets_per_second * burst))
+            if packets_per_second
+            else None
+        )
+        self._bytes = (
+            TokenBucket(bytes_per_second, max(1500.0, bytes_per_second * burst))
+            if bytes_per_second
+            else None
+        )
+        self._max_queue_size = max_queue_size
+        self._drop_policy = drop_policy
+        self._queue: Deque[Tuple[DatagramTransport, bytes, Tuple[str, int]]] = deque()
+        self._drain_handle: Optional[asyncio.TimerHandle] = None
+
+        self.loop = asyncio.get_event_loop()
+
+        # Stats
+        self.sent = 0
+        self.dropped = 0
+
+        QUEUE_FILL.set_function(lambda: self.queue_fill)
+        BUCKET_FILL.labels("packets").set_function(lambda: self.packets_fill)
+        BUCKET_FILL.labels("bytes").set_function(lambda: self.bytes_fill)
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._queue)
+
+    @property
+    def queue_fill(self) -> float:
+        return len(self._queue) / self._max_queue_size
+
+    @property
+    def packets_fill(self) -> float:
+        return self._packets.fill if self._packets else 1.0
+
+    @property
+    def bytes_fill(self) -> float:
+        return self._bytes.fill if self._bytes else 1.0
+
+    def _delay(self, size: int) -> float:
+        return max(
+            self._packets.delay(1) if self._packets else 0.0,
+            self._bytes.delay(size) if self._bytes else 0.0,
+        )
+
+    def _try_send(
+        self, transport: DatagramTransport, data: bytes, address: Tuple[str, int]
+    ) -> bool:
+        if self._packets and not self._packets.has(1):
+            return False
+        if self._bytes and not self._bytes.has(len(data)):
+            return False
+
+        if self._packets:
+            self._packets.consume(1)
+        if self._bytes:
+            self._bytes.consume(len(data))
+
+        transport.sendto(data, address)
+        self.sent += 1
+        return True
+
+    def _drain(self) -> None:
+        self._drain_handle = None
+
+        while self._queue:
+            transport, data, address = self._queue[0]
+            if transport.is_closing():
+                self._queue.popleft()
+                continue
+            if not self._try_send(transport, data, address):
+                break
+            self._queue.popleft()
+
+        self._schedule_drain()
+
+    def _schedule_drain(self) -> None:
+        if self._queue and not self._drain_handle:
+            self._drain_handle = self.loop.call_later(
+                self._delay(len(self._queue[0][1])), self._drain
+            )
+
+    def send(
+        self, transport: DatagramTransport, data: bytes, address: Tuple[str, int]
+    ) -> None:
+        if not self._queue and self._try_send(transport, data, address):
+            return
+
+        if len(self._queue) >= self._max_queue_size:
+            self.dropped += 1
+            DROPPED.inc()
+            if self._drop_policy == DROP_NEWEST:
+                return
+            self._queue.popleft()
+
+        self._queue.append((transport, data, address))
+        self._schedule_drain()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List
+from typing import List, Sequence
 
 from stilio.crawler.dht.node import Node
 
@@ -18,3 +18,12 @@ class RoutingTable:
         if not self.is_full:
             self.nodes.append(node)
         return not self.is_full
+
+    def extend(self, nodes: Sequence[Node]) -> int:
+        """Adds as many nodes as fit in the table, returns how many were added"""
+        free = self.max_size + 1 - len(self.nodes)
+        if free <= 0:
+            return 0
+        added = nodes[:free]
+        self.nodes.extend(added)
+        return len(added)
@@ -2,47 +2,110 @@ from __future__ import annotations
 
 from typing import Callable, Optional, Tuple
 
-from stilio.crawler.bittorrent.bencoding import BencoderError, KRPCTypes, decode, encode
+from stilio.crawler.bittorrent.bencoding import BencoderError, encode
+from stilio.crawler.dht import krpc
 from stilio.crawler.dht.constants import TOKEN_LENGTH
+from stilio.crawler.dht.krpc import KRPCMessage
 from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.pacing import OutboundPacer
+from stilio.crawler.dht.templates import MessageTemplates, RandomIdPool
 from stilio.crawler.dht.udp import UDPNode
 
 
 class RPC:
-    def __init__(self) -> None:
-        self.udp_node = UDPNode()
+    def __init__(
+        self,
+        node: Node,
+        reuse_port: bool = False,
+        pacer: Optional[OutboundPacer] = None,
+    ) -> None:
+        """Args:
+
+            node: identity of the RPC, its address and port are used to listen
+            reuse_port: allow other processes to bind the same port
+            pacer: pacer shared by the RPCs sending through the same uplink
+        """
+        self.node = node
+
+        self.udp_node = UDPNode(node.address, node.port, reuse_port, pacer)
         self.udp_node.on_data_received = self._on_data_received
         self.udp_node.on_bandwidth_exhausted = self._on_bandwidth_exhausted
 
         # Callbacks
-        self.on_response: Optional[Callable[[KRPCTypes, Tuple[str, int]], None]] = None
+        self.on_response: Optional[
+            Callable[[RPC, KRPCMessage, Tuple[str, int]], None]
+        ] = None
         self.on_bandwidth_exhausted: Optional[Callable[[], None]] = None
 
+        self._targets = RandomIdPool()
+        self._find_node = MessageTemplates(
+            lambda nid, target: {
+                b"y": b"q",
+                b"q": b"find_node",
+                b"t": b"aa",
+                b"a": {b"id": nid, b"target": target},
+            }
+        )
+        self._sample_infohashes = MessageTemplates(
+            lambda tid, nid, target: {
+                b"y": b"q",
+                b"q": b"sample_infohashes",
+                b"t": tid,
+                b"a": {b"id": nid, b"target": target},
+            }
+        )
+        self._get_peers = MessageTemplates(
+            lambda tid, nid, info_hash: {
+                b"y": b"q",
+                b"q": b"get_peers",
+                b"t": tid,
+                b"a": {b"id": nid, b"info_hash": info_hash},
+            }
+        )
+        self._announce_peer_response = MessageTemplates(
+            lambda tid, nid: {b"y": b"r", b"t": tid, b"r": {b"id": nid}}
+        )
+        self._get_peers_response = MessageTemplates(
+            lambda tid, nid, token: {
+                b"y": b"r",
+                b"t": tid,
+                b"r": {b"id": nid, b"nodes": b"", b"token": token},
+            }
+        )
+
     def _on_data_received(self, data: bytes, address: Tuple[str, int]):
         # If port is 0 skip since it cannot be reached
         if address[1] == 0:
             return
 
-        try:
-            message = decode(data)
-        except BencoderError:
+        message = krpc.parse(data)
+        if message is None:
             return
 
         if self.on_response:
-            self.on_response(message, address)
+            self.on_response(self, message, address)
 
     def _on_bandwidth_exhausted(self):
         if self.on_bandwidth_exhausted:
             self.on_bandwidth_exhausted()
 
     def find_node(self, nid: bytes, address: Tuple[str, int]) -> None:
-        data = {
-            b"y": b"q",
-            b"q": b"find_node",
-            b"t": b"aa",
-            b"a": {b"id": nid, b"target": Node.generate_random_id()},
-        }
-        self.send_message(data, address)
+        message = self._find_node.render(nid=nid, target=self._targets.next())
+        self.udp_node.send_message(message, address)
+
+    def sample_infohashes(
+        self, tid: bytes, nid: bytes, address: Tuple[str, int]
+    ) -> None:
+        message = self._sample_infohashes.render(
+            tid=tid, nid=nid, target=self._targets.next()
+        )
+        self.udp_node.send_message(message, address)
+
+    def get_peers(
+        self, tid: bytes, nid: bytes, info_hash: bytes, address: Tuple[str, int]
+    ) -> None:
+        message = self._get_peers.render(tid=tid, nid=nid, info_hash=info_hash)
+        self.udp_node.send_message(message, address)
 
     def send_message(self, data: dict, address: Tuple[str, int]) -> None:
         try:
@@ -58,19 +121,13 @@ class RPC:
     def respond_announce_peer(
         self, tid: bytes, nid: bytes, address: Tuple[str, int]
     ) -> None:
-        data = {b"y": b"r", b"t": tid, b"r": {b"id": nid}}
-        self.send_message(data, address)
+        message = self._announce_peer_response.render(tid=tid, nid=nid)
+        self.udp_node.send_message(message, address)
 
     def respond_get_peers(
         self, tid: bytes, info_hash: bytes, nid: bytes, address: Tuple[str, int]
     ) -> None:
-        data = {
-            b"y": b"r",
-            b"t": tid,
-            b"r": {
-                b"id": info_hash[:15] + nid[:5],
-                b"nodes": b"",
-                b"token": info_hash[:TOKEN_LENGTH],
-            },
-        }
-        self.send_message(data, address)
+        message = self._get_peers_response.render(
+            tid=tid, nid=info_hash[:15] + nid[:5], token=info_hash[:TOKEN_LENGTH]
+        )
+        self.udp_node.send_message(message, address)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+ScheduledCall = Tuple[float, int, Callable[..., None], Sequence[Any]]
+
+
+class QueryScheduler:
+    """Runs calls at their deadline, ordered in a heap and drained by a single timer.
+
+    Every time the timer fires all the calls due within the next slot are run, so
+    the number of wakeups is bounded by the slot size no matter how many calls are
+    scheduled.
+    """
+
+    def __init__(self, slot: float = 0.005):
+        """Args:
+
+            slot: seconds of calls that are run at every wakeup
+        """
+        self._slot = slot
+        self._calls: List[ScheduledCall] = []
+        self._counter = itertools.count()
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+        self.loop = asyncio.get_event_loop()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _arm(self) -> None:
+        if not self._calls:
+            return
+
+        deadline = self._calls[0][0]
+        if self._handle:
+            if self._handle.when() <= deadline:
+                return
+            self._handle.cancel()
+        self._handle = self.loop.call_at(deadline, self._run)
+
+    def _run(self) -> None:
+        self._handle = None
+
+        limit = self.loop.time() + self._slot
+        while self._calls and self._calls[0][0] <= limit:
+            _, _, callback, args = heapq.heappop(self._calls)
+            callback(*args)
+
+        self._arm()
+
+    def schedule(self, deadline: float, callback: Callable[..., None], *args) -> None:
+        """Schedules a call at a loop time deadline"""
+        heapq.heappush(self._calls, (deadline, next(self._counter), callback, args))
+        self._arm()
+
+    def spread(
+        self,
+        callback: Callable[..., None],
+        calls: Sequence[Sequence[Any]],
+        interval: float,
+    ) -> None:
+        """Schedules a call for every set of arguments evenly spaced over the next
+        interval seconds
+        """
+        if not calls:
+            return
+
+        start = self.loop.time()
+        spacing = interval / len(calls)
+        for i, args in enumerate(calls):
+            heapq.heappush(
+                self._calls, (start + i * spacing, next(self._counter), callback, args)
+            )
+        self._arm()
+
+    def clear(self) -> None:
+        self._calls.clear()
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
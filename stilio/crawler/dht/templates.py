@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+from typing import Callable, Dict, Tuple
+
+from stilio.crawler.bittorrent.bencoding import encode
+
+
+class MessageTemplates:
+    """Pre-encoded skeletons of a KRPC message where only the variable fields are
+    patched, so sending a message costs a few buffer copies instead of a bencode
+    call.
+
+    The skeleton is built by encoding the message with random markers in place of
+    the variable fields and looking up where they ended up. As the bencoding of a
+    field depends on its length a skeleton is kept for every combination of field
+    lengths, e.g. the different transaction id lengths used by clients.
+    """
+
+    def __init__(self, build: Callable[..., dict], max_templates: int = 16):
+        """Args:
+
+            build: returns the message given its variable fields as keyword args
+            max_templates: maximum number of field length combinations kept
+        """
+        self._build = build
+        self._max_templates = max_templates
+        self._templates: Dict[
+            Tuple[Tuple[str, int], ...], Tuple[bytearray, Dict[str, Tuple[int, int]]]
+        ] = {}
+
+    def _make_template(
+        self, sizes: Dict[str, int]
+    ) -> Tuple[bytearray, Dict[str, Tuple[int, int]]]:
+        for _ in range(100):
+            markers = {name: os.urandom(size) for name, size in sizes.items()}
+            buffer = bytearray(encode(self._build(**markers)))
+
+            offsets = {}
+            for name, marker in markers.items():
+                start = buffer.find(marker)
+                if buffer.find(marker, start + 1) != -1:
+                    # The marker also appears somewhere else, try another one
+                    break
+                offsets[name] = (start, start + len(marker))
+            else:
+                ranges = sorted(offsets.values())
+                if all(a[1] <= b[0] for a, b in zip(ranges, ranges[1:])):
+                    return buffer, offsets
+
+        raise ValueError("Fields could not be located in the message")
+
+    def render(self, **fields: bytes) -> bytes:
+        key = tuple((name, len(value)) for name, value in fields.items())
+        template = self._templates.get(key)
+        if template is None:
+            sizes = dict(key)
+            # Empty fields cannot be located in the skeleton
+            if not all(sizes.values()) or len(self._templates) >= self._max_templates:
+                return encode(self._build(**fields))
+            template = self._make_template(sizes)
+            self._templates[key] = template
+
+        buffer, offsets = template
+        for name, value in fields.items():
+            start, end = offsets[name]
+            buffer[start:end] = value
+        return bytes(buffer)
+
+
+class RandomIdPool:
+    """Hands out random 20 bytes ids taken from a pre-generated pool"""
+
+    def __init__(self, size: int = 4096):
+        self._size = size
+        self._pool = b""
+        self._offset = 0
+
+    def next(self) -> bytes:
+        if self._offset >= len(self._pool):
+            self._pool = os.urandom(20 * self._size)
+            self._offset = 0
+        nid = self._pool[self._offset : self._offset + 20]
+        self._offset += 20
+        return nid
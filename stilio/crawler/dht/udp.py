@@ -6,14 +6,42 @@ import logging
 from asyncio.transports import DatagramTransport
 from typing import Callable, Optional, Tuple
 
-from stilio.config import CRAWLER_ADDRESS, CRAWLER_DEBUG_LEVEL, CRAWLER_PORT
+from stilio import metrics
+from stilio.config import CRAWLER_DEBUG_LEVEL
+from stilio.crawler.dht.capture import DatagramRecorder
+from stilio.crawler.dht.pacing import OutboundPacer
 
 logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
 logger = logging.getLogger(__name__)
 
+DATAGRAMS = metrics.Counter(
+    "stilio_udp_datagrams", "Datagrams received and sent", ["direction"]
+)
+DATAGRAMS_IN = DATAGRAMS.labels("in")
+DATAGRAMS_OUT = DATAGRAMS.labels("out")
+BYTES = metrics.Counter("stilio_udp_bytes", "Bytes received and sent", ["direction"])
+BYTES_IN = BYTES.labels("in")
+BYTES_OUT = BYTES.labels("out")
+ERRORS = metrics.Counter("stilio_udp_errors", "Socket errors", ["kind"])
+ERRORS_CONGESTION = ERRORS.labels("congestion")
+ERRORS_OTHER = ERRORS.labels("other")
+
 
 class UDPNode(asyncio.DatagramProtocol):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        address: str,
+        port: int,
+        reuse_port: bool = False,
+        pacer: Optional[OutboundPacer] = None,
+    ) -> None:
+        self.address = address
+        self.port = port
+        self.reuse_port = reuse_port
+        self.pacer = pacer
+
+        self.recorder: Optional[DatagramRecorder] = None
+
         self.loop = asyncio.get_event_loop()
 
         # Callbacks
@@ -30,19 +58,32 @@ class UDPNode(asyncio.DatagramProtocol):
         if isinstance(e, PermissionError) or (
             isinstance(e, OSError) and e.errno == errno.ENOBUFS
         ):
+            ERRORS_CONGESTION.inc()
             if self.on_bandwidth_exhausted:
                 self.on_bandwidth_exhausted()
         else:
+            ERRORS_OTHER.inc()
             logging.error(f"UDPNode error: {e}")
 
     def datagram_received(self, data, address: Tuple[str, int]) -> None:
+        DATAGRAMS_IN.inc()
+        BYTES_IN.inc(len(data))
+        if self.recorder:
+            self.recorder.record(data, address)
         if self.on_data_received:
             self.on_data_received(data, address)
 
     async def start(self):
         await self.loop.create_datagram_endpoint(
-            lambda: self, local_addr=(CRAWLER_ADDRESS, CRAWLER_PORT)
+            lambda: self,
+            local_addr=(self.address, self.port),
+            reuse_port=self.reuse_port or None,
         )
 
     def send_message(self, data: bytes, address: Tuple[str, int]) -> None:
-        self.transport.sendto(data, address)
+        DATAGRAMS_OUT.inc()
+        BYTES_OUT.inc(len(data))
+        if self.pacer:
+            self.pacer.send(self.transport, data, address)
+        else:
+            self.transport.sendto(data, address)
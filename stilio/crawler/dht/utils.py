@@ -1,6 +1,9 @@
 import logging
+import struct
+from bisect import bisect_right
+from ipaddress import IPv4Network
 from socket import inet_ntoa
-from typing import List
+from typing import List, Sequence, Tuple
 
 from stilio.config import CRAWLER_DEBUG_LEVEL
 from stilio.crawler.dht.node import Node
@@ -8,28 +11,80 @@ from stilio.crawler.dht.node import Node
 logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
 logger = logging.getLogger(__name__)
 
+COMPACT_NODE = struct.Struct(">20sIH")
+COMPACT_PEER = struct.Struct(">IH")
 
-def decode_nodes(encoded_nodes: bytes) -> List[Node]:
+# Private, loopback, link local, multicast and otherwise reserved IPv4 ranges
+RESERVED_NETWORKS = [
+    IPv4Network(network)
+    for network in (
+        "0.0.0.0/8",
+        "10.0.0.0/8",
+        "100.64.0.0/10",
+        "127.0.0.0/8",
+        "169.254.0.0/16",
+        "172.16.0.0/12",
+        "192.0.0.0/24",
+        "192.0.2.0/24",
+        "192.168.0.0/16",
+        "198.18.0.0/15",
+        "198.51.100.0/24",
+        "203.0.113.0/24",
+        "224.0.0.0/3",
+    )
+]
+_RESERVED_STARTS = [int(network.network_address) for network in RESERVED_NETWORKS]
+_RESERVED_ENDS = [int(network.broadcast_address) for network in RESERVED_NETWORKS]
+
+
+def is_reserved_ip(ip: int) -> bool:
+    """
+    Checks if a packed IPv4 address (as an integer) is not publicly routable.
+    """
+    i = bisect_right(_RESERVED_STARTS, ip) - 1
+    return i >= 0 and ip <= _RESERVED_ENDS[i]
+
+
+def decode_valid_nodes(
+    encoded_nodes: bytes, allow_reserved: bool = False
+) -> List[Node]:
     """
-    Converts a List[bytes] into List[Node].
+    Converts a compact node list into List[Node] in a single pass, skipping
+    nodes with reserved addresses, unless allowed, or port 0 without building
+    them.
     """
     decoded_nodes = []
-    for i in range(0, len(encoded_nodes), 26):
-        bytes_node = encoded_nodes[i : i + 26]
+    offset = 20
+    for nid, ip, port in COMPACT_NODE.iter_unpack(encoded_nodes):
+        if port and (allow_reserved or not is_reserved_ip(ip)):
+            address = inet_ntoa(encoded_nodes[offset : offset + 4])
+            decoded_nodes.append(Node(nid=nid, address=address, port=port))
+        offset += 26
+    return decoded_nodes
 
-        nid = bytes_node[:20]
 
-        try:
-            address = inet_ntoa(bytes_node[20:24])
-        except OSError:
-            logger.debug("Error parsing a node, continuing...")
+def decode_valid_peers(
+    values: Sequence[bytes], allow_reserved: bool = False
+) -> List[Tuple[str, int]]:
+    """
+    Converts the compact peers of a get_peers response into addresses, skipping
+    malformed entries, reserved addresses unless allowed and port 0.
+    """
+    peers = []
+    for value in values:
+        if len(value) != 6:
             continue
+        ip, port = COMPACT_PEER.unpack(value)
+        if port and (allow_reserved or not is_reserved_ip(ip)):
+            peers.append((inet_ntoa(value[:4]), port))
+    return peers
 
-        port = int.from_bytes(bytes_node[24:], "big")
 
-        node = Node(nid=nid, address=address, port=port)
-        decoded_nodes.append(node)
-    return decoded_nodes
+def split_info_hashes(samples: bytes) -> List[bytes]:
+    """
+    Splits the concatenated info hashes of a sample_infohashes response.
+    """
+    return [samples[i : i + 20] for i in range(0, len(samples) - 19, 20)]
 
 
 def generate_neighbor_nid(local_nid: bytes, neighbor_nid: bytes) -> bytes:
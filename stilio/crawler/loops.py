@@ -0,0 +1,78 @@
+"""
+Event loop selection for the crawler.
+
+The crawler code gets its loop through asyncio.get_event_loop(), so the loop
+implementation is chosen by installing the matching event loop policy before any
+loop is created. uvloop is an optional dependency, installed with the "fast"
+extra. "auto" uses it only when it is installed, and asking for it when it is
+not falls back to asyncio with a warning.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, List
+
+from stilio.config import CRAWLER_DEBUG_LEVEL, CRAWLER_EVENT_LOOP
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+LOOP_AUTO = "auto"
+LOOP_ASYNCIO = "asyncio"
+LOOP_UVLOOP = "uvloop"
+
+
+def _uvloop_policy() -> asyncio.AbstractEventLoopPolicy:
+    import uvloop
+
+    return uvloop.EventLoopPolicy()
+
+
+_POLICIES: Dict[str, Callable[[], asyncio.AbstractEventLoopPolicy]] = {
+    LOOP_ASYNCIO: asyncio.DefaultEventLoopPolicy,
+    LOOP_UVLOOP: _uvloop_policy,
+}
+
+
+def available() -> List[str]:
+    """Returns the loop implementations that can be used in this environment"""
+    names = [LOOP_ASYNCIO]
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        names.append(LOOP_UVLOOP)
+    return names
+
+
+def resolve(name: str = CRAWLER_EVENT_LOOP) -> str:
+    """Returns the loop implementation used for the configured name, raises
+    ValueError for unknown names
+    """
+    if name == LOOP_AUTO:
+        return available()[-1]
+    if name not in _POLICIES:
+        raise ValueError(f"Unknown event loop {name}")
+    if name not in available():
+        logger.warning(
+            f"Event loop {name} is not installed, using {LOOP_ASYNCIO} instead. "
+            f'Install it with the "fast" extra, e.g. poetry install -E fast'
+        )
+        return LOOP_ASYNCIO
+    return name
+
+
+def install(name: str = CRAWLER_EVENT_LOOP) -> str:
+    """Installs the event loop policy and sets a new loop as the current one,
+    returns the loop implementation in use
+    """
+    resolved = resolve(name)
+    asyncio.set_event_loop_policy(_POLICIES[resolved]())
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    logger.info(f"Using the {resolved} event loop")
+    return resolved
+
+
+def new_event_loop(name: str = CRAWLER_EVENT_LOOP) -> asyncio.AbstractEventLoop:
+    """Creates a loop of the configured implementation without installing it"""
+    return _POLICIES[resolve(name)]().new_event_loop()
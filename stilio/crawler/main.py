@@ -1,7 +1,47 @@
+import argparse
+
+from stilio.config import CRAWLER_EVENT_LOOP, CRAWLER_REUSE_PORT, CRAWLER_WORKERS
+from stilio.crawler import loops
+from stilio.crawler.dht.capture import capture_path
 from stilio.crawler.dht.crawling import CrawlingService
+from stilio.crawler.snapshot import snapshot_path
+from stilio.crawler.supervisor import Supervisor
 from stilio.persistence import database
 
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Stilio DHT crawler")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=CRAWLER_WORKERS,
+        help="number of crawler processes, usually one per core",
+    )
+    parser.add_argument(
+        "--no-reuse-port",
+        dest="reuse_port",
+        action="store_false",
+        default=CRAWLER_REUSE_PORT,
+        help="give every worker its own port instead of sharing one",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=[loops.LOOP_AUTO, loops.LOOP_ASYNCIO, loops.LOOP_UVLOOP],
+        default=CRAWLER_EVENT_LOOP,
+        help="event loop implementation",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    loops.install(args.loop)
     database.init()
-    crawler = CrawlingService()
-    crawler.run()
+
+    if args.workers > 1:
+        Supervisor(args.workers, args.reuse_port, args.loop).run()
+    else:
+        crawler = CrawlingService(
+            snapshot_path=snapshot_path(0), capture_path=capture_path(0)
+        )
+        crawler.run()
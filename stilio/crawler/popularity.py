@@ -0,0 +1,226 @@
+"""
+Estimates the number of seeders and leechers of the stored torrents from the DHT
+traffic the crawler already receives: the distinct peers announcing an info hash
+are counted as seeders and the distinct peers looking it up with get_peers as
+leechers.
+
+Every info hash gets a tiny HyperLogLog sketch per counter, so repeat announces
+cost a register update and memory does not grow with the number of peers.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from stilio import metrics
+from stilio.config import (
+    CRAWLER_DEBUG_LEVEL,
+    CRAWLER_POPULARITY_FLUSH_INTERVAL,
+    CRAWLER_POPULARITY_MAX_INFO_HASHES,
+    CRAWLER_POPULARITY_WINDOW,
+)
+from stilio.persistence import database
+from stilio.persistence import utils as db_utils
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+TRACKED = metrics.Gauge(
+    "stilio_popularity_info_hashes", "Info hashes with peers counted in the window"
+)
+DROPPED = metrics.Counter(
+    "stilio_popularity_dropped", "Peers not counted because the generation was full"
+)
+UPDATED = metrics.Counter(
+    "stilio_popularity_updated", "Torrents whose peer counts were updated"
+)
+
+# 64 registers per sketch, about 13% standard error
+PRECISION = 6
+REGISTERS = 1 << PRECISION
+ALPHA = 0.709
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+SEEDERS = 0
+LEECHERS = REGISTERS
+
+
+def hash_peer(ip: str) -> int:
+    """64 bits hash of an IPv4 address, peers are told apart by address only as
+    their port changes whenever they restart
+    """
+    try:
+        x = int.from_bytes(socket.inet_aton(ip), "big")
+    except OSError:
+        x = hash(ip) & 0xFFFFFFFFFFFFFFFF
+    # splitmix64 finalizer
+    x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+
+def add(sketch: bytearray, offset: int, peer_hash: int) -> None:
+    """Adds a peer to the sketch registers starting at offset"""
+    index = offset + (peer_hash & (REGISTERS - 1))
+    rest = peer_hash >> PRECISION
+    rank = 64 - PRECISION - rest.bit_length() + 1
+    if rank > sketch[index]:
+        sketch[index] = rank
+
+
+def estimate(registers: bytes) -> int:
+    """Estimates the distinct peers added to REGISTERS registers"""
+    z = sum(_INVERSE_POWERS[rank] for rank in registers)
+    raw = ALPHA * REGISTERS * REGISTERS / z
+    zeros = registers.count(0)
+    if raw <= 2.5 * REGISTERS and zeros:
+        # Linear counting, exact enough for the few peers most info hashes have
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
+
+
+def merged_counts(sketches: Sequence[bytes], scale: int = 1) -> Tuple[int, int]:
+    """Estimates the seeders and leechers of the union of the sketches"""
+    merged = bytes(2 * REGISTERS)
+    for sketch in sketches:
+        merged = bytes(map(max, merged, sketch))
+    return (
+        estimate(merged[SEEDERS : SEEDERS + REGISTERS]) * scale,
+        estimate(merged[LEECHERS : LEECHERS + REGISTERS]) * scale,
+    )
+
+
+def update_counts(sketches: List[Tuple[bytes, List[bytes]]], scale: int) -> int:
+    """Estimates the counts of every info hash and stores them, returns the number
+    of torrents updated. Runs in the flush thread to keep the loop free.
+    """
+    rows = [
+        (info_hash.hex(), *merged_counts(info_hash_sketches, scale))
+        for info_hash, info_hash_sketches in sketches
+    ]
+    return db_utils.update_peer_counts(rows)
+
+
+class PopularityAggregator:
+    """Counts the distinct peers of every info hash over a sliding window and
+    periodically writes the counts of the info hashes that got traffic in a
+    single UPDATE, from a background thread.
+
+    The window is split in generations, every generation has its own sketches
+    and the oldest one is dropped when a new one starts. Counts are the union of
+    the sketches of the live generations.
+    """
+
+    def __init__(
+        self,
+        window: float = CRAWLER_POPULARITY_WINDOW,
+        flush_interval: float = CRAWLER_POPULARITY_FLUSH_INTERVAL,
+        max_info_hashes: int = CRAWLER_POPULARITY_MAX_INFO_HASHES,
+        generations: int = 3,
+        scale: int = 1,
+    ):
+        """Args:
+
+            window: seconds the peers of an info hash are counted for
+            flush_interval: seconds between updates of the stored counts
+            max_info_hashes: maximum number of info hashes counted per generation
+            generations: number of parts the window is split in
+            scale: number of crawler processes sharing the traffic of the same
+                node ids, each one only sees its share of the peers
+        """
+        self._generation_length = window / generations
+        self._flush_interval = flush_interval
+        self._max_info_hashes = max_info_hashes
+        self._scale = scale
+
+        # Info hash -> seeders registers followed by leechers registers
+        self._generations: Deque[Dict[bytes, bytearray]] = deque(
+            [{}], maxlen=generations
+        )
+        self._dirty: Set[bytes] = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, initializer=database.reset_state
+        )
+        self._task: Optional[asyncio.Future] = None
+        self._running = False
+
+        self.loop = asyncio.get_event_loop()
+        self._next_rotation = self.loop.time() + self._generation_length
+
+        TRACKED.set_function(lambda: len(self._generations[-1]))
+
+    def _add(self, info_hash: bytes, offset: int, ip: str) -> None:
+        current = self._generations[-1]
+        sketch = current.get(info_hash)
+        if sketch is None:
+            if len(current) >= self._max_info_hashes:
+                DROPPED.inc()
+                return
+            sketch = current[info_hash] = bytearray(2 * REGISTERS)
+        add(sketch, offset, hash_peer(ip))
+        self._dirty.add(info_hash)
+
+    def on_announce(self, info_hash: bytes, ip: str) -> None:
+        self._add(info_hash, SEEDERS, ip)
+
+    def on_get_peers(self, info_hash: bytes, ip: str) -> None:
+        self._add(info_hash, LEECHERS, ip)
+
+    def _sketches(self, info_hash: bytes) -> List[bytes]:
+        return [
+            bytes(generation[info_hash])
+            for generation in self._generations
+            if info_hash in generation
+        ]
+
+    def counts(self, info_hash: bytes) -> Tuple[int, int]:
+        """Returns the estimated seeders and leechers of the info hash"""
+        return merged_counts(self._sketches(info_hash), self._scale)
+
+    def rotate(self) -> None:
+        """Starts a new generation, dropping the oldest one once the window is full"""
+        self._generations.append({})
+
+    async def flush(self) -> None:
+        """Stores the counts of the info hashes with new peers since the last flush,
+        the sketches are copied so the estimates can be computed off the loop
+        """
+        if not self._dirty:
+            return
+        sketches = [(info_hash, self._sketches(info_hash)) for info_hash in self._dirty]
+        self._dirty = set()
+        try:
+            updated = await self.loop.run_in_executor(
+                self._executor, update_counts, sketches, self._scale
+            )
+        except Exception as e:
+            logger.error(f"Error updating the peer counts of {len(sketches)} torrents")
+            logger.exception(e)
+            return
+        UPDATED.inc(updated)
+        logger.debug(f"Updated the peer counts of {updated} torrents")
+
+    async def _run(self) -> None:
+        while self._running:
+            await asyncio.sleep(self._flush_interval)
+            if self.loop.time() >= self._next_rotation:
+                self._next_rotation = self.loop.time() + self._generation_length
+                self.rotate()
+            await self.flush()
+
+    def start(self) -> None:
+        self._running = True
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        self._running = False
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+        self._executor.shutdown()
@@ -0,0 +1,182 @@
+"""
+Snapshots of the state a crawler takes minutes to rebuild: its node ids, the
+nodes it was talking to, the adaptive number of neighbors and the bloom filters
+of the seen info hashes. Loading one at startup brings a restarted crawler back
+to its discovery rate within a tick instead of bootstrapping from scratch.
+
+The file is a fixed header followed by packed sections:
+
+    header | node ids | compact nodes | (filter header | filter bits)...
+
+It is written to a temporary file and renamed over the previous snapshot, and
+mapped copy-on-write when loaded, so the bloom filters use its pages as they are.
+"""
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import socket
+import struct
+import time
+import zlib
+from typing import List, Optional
+
+from stilio.config import CRAWLER_DEBUG_LEVEL, CRAWLER_SNAPSHOT_DIR
+from stilio.crawler.dedup import BloomFilter
+from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.utils import COMPACT_NODE
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STLSNAP"
+VERSION = 1
+
+# Magic, version, checksum of the rest of the file, saved at, seeded at, max
+# neighbors, node ids, nodes and filters
+HEADER = struct.Struct("<7sBIddIIII")
+# Capacity, error rate, count and size of the bits of a bloom filter
+FILTER_HEADER = struct.Struct("<QdQQ")
+
+
+def snapshot_path(worker: int) -> Optional[str]:
+    """Path of the snapshot of a crawler process, None if snapshots are disabled"""
+    if not CRAWLER_SNAPSHOT_DIR:
+        return None
+    return os.path.join(CRAWLER_SNAPSHOT_DIR, f"crawler-{worker}.snapshot")
+
+
+class CrawlerSnapshot:
+    __slots__ = ("saved_at", "seeded_at", "max_neighbors", "nids", "nodes", "filters")
+
+    def __init__(
+        self,
+        seeded_at: float,
+        max_neighbors: int,
+        nids: List[bytes],
+        nodes: List[Node],
+        filters: List[BloomFilter],
+        saved_at: Optional[float] = None,
+    ):
+        """Args:
+
+            seeded_at: unix time of the last query of the stored info hashes, the
+                info hashes stored since are not in the filters
+            max_neighbors: maximum number of neighbors of the routing table
+            nids: node ids of the local nodes
+            nodes: nodes of the routing table
+            filters: bloom filters of the seen info hashes
+            saved_at: unix time the snapshot was taken
+        """
+        self.saved_at = saved_at if saved_at is not None else time.time()
+        self.seeded_at = seeded_at
+        self.max_neighbors = max_neighbors
+        self.nids = nids
+        self.nodes = nodes
+        self.filters = filters
+
+    def save(self, path: str) -> None:
+        body = bytearray()
+        for nid in self.nids:
+            body += nid
+        node_count = 0
+        for node in self.nodes:
+            try:
+                ip = socket.inet_aton(node.address)
+            except OSError:
+                continue
+            body += COMPACT_NODE.pack(node.nid, int.from_bytes(ip, "big"), node.port)
+            node_count += 1
+        for bloom_filter in self.filters:
+            body += FILTER_HEADER.pack(
+                bloom_filter.capacity,
+                bloom_filter.error_rate,
+                bloom_filter.count,
+                len(bloom_filter.bits),
+            )
+            body += bloom_filter.bits
+
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            zlib.crc32(body),
+            self.saved_at,
+            self.seeded_at,
+            self.max_neighbors,
+            len(self.nids),
+            node_count,
+            len(self.filters),
+        )
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[CrawlerSnapshot]:
+        """Returns the snapshot at path, None if it is missing or invalid"""
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            return cls._parse(buffer)
+        except (struct.error, ValueError) as e:
+            logger.warning(f"Ignoring invalid snapshot {path}: {e}")
+            return None
+
+    @classmethod
+    def _parse(cls, buffer: mmap.mmap) -> CrawlerSnapshot:
+        (
+            magic,
+            version,
+            checksum,
+            saved_at,
+            seeded_at,
+            max_neighbors,
+            nid_count,
+            node_count,
+            filter_count,
+        ) = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unknown format")
+
+        view = memoryview(buffer)
+        if zlib.crc32(view[HEADER.size :]) != checksum:
+            raise ValueError("checksum mismatch")
+
+        offset = HEADER.size
+        nids = [
+            bytes(view[offset + 20 * i : offset + 20 * (i + 1)])
+            for i in range(nid_count)
+        ]
+        offset += 20 * nid_count
+
+        nodes = []
+        for nid, ip, port in COMPACT_NODE.iter_unpack(
+            view[offset : offset + COMPACT_NODE.size * node_count]
+        ):
+            nodes.append(Node(nid, socket.inet_ntoa(ip.to_bytes(4, "big")), port))
+        offset += COMPACT_NODE.size * node_count
+
+        filters = []
+        for _ in range(filter_count):
+            capacity, error_rate, count, size = FILTER_HEADER.unpack_from(
+                buffer, offset
+            )
+            offset += FILTER_HEADER.size
+            if offset + size > len(buffer):
+                raise ValueError("truncated filter")
+            # Copy on write, the pages are only copied once the filter changes them
+            filters.append(
+                BloomFilter(capacity, error_rate, view[offset : offset + size], count)
+            )
+            offset += size
+
+        return cls(seeded_at, max_neighbors, nids, nodes, filters, saved_at)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from typing import Dict
+
+from stilio.config import (
+    CRAWLER_CLAIMS_DONE_TTL,
+    CRAWLER_CLAIMS_SLOTS,
+    CRAWLER_DEBUG_LEVEL,
+    CRAWLER_EVENT_LOOP,
+    CRAWLER_METADATA_CANDIDATE_TTL,
+    CRAWLER_METADATA_FETCH_TIMEOUT,
+    CRAWLER_METRICS_PORT,
+    CRAWLER_PORT,
+    CRAWLER_STOP_TIMEOUT,
+    CRAWLER_VIRTUAL_NODES,
+)
+from stilio.crawler import loops
+from stilio.crawler.dedup import SharedInfoHashClaims
+from stilio.crawler.dht.capture import capture_path
+from stilio.crawler.dht.crawling import CrawlingService
+from stilio.crawler.snapshot import snapshot_path
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def run_worker(
+    index: int,
+    reuse_port: bool,
+    claims: SharedInfoHashClaims,
+    loop: str,
+    workers: int = 1,
+) -> None:
+    """Entry point of every crawler process, each one with its own random node id.
+
+    The handlers of the supervisor are reset, CrawlingService.run installs its
+    own so the worker stores what it fetched before exiting.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    asyncio.set_event_loop(loops.new_event_loop(loop))
+
+    if reuse_port:
+        port = CRAWLER_PORT
+    else:
+        port = CRAWLER_PORT + index * CRAWLER_VIRTUAL_NODES
+    metrics_port = (
+        CRAWLER_METRICS_PORT + index if CRAWLER_METRICS_PORT is not None else None
+    )
+    crawler = CrawlingService(
+        port=port,
+        reuse_port=reuse_port,
+        claims=claims,
+        metrics_port=metrics_port,
+        snapshot_path=snapshot_path(index),
+        capture_path=capture_path(index),
+        # The kernel spreads the peers over the workers sharing the port
+        peers_scale=workers if reuse_port else 1,
+    )
+    logger.info(f"Worker {index} crawling from port {port} as {crawler.nodes}")
+    crawler.run()
+
+
+class Supervisor:
+    """Forks a crawler process per worker and restarts the ones that die.
+
+    Workers either share the same port through SO_REUSEPORT, letting the kernel
+    balance datagrams between them, or use consecutive port ranges. The info hashes
+    being fetched and the ones stored are shared through a claims table so workers
+    do not fetch the same info hash twice.
+    """
+
+    def __init__(self, workers: int, reuse_port: bool, loop: str = CRAWLER_EVENT_LOOP):
+        self._workers = workers
+        self._reuse_port = reuse_port
+        self._loop = loop
+        self._context = multiprocessing.get_context("fork")
+        self._processes: Dict[int, BaseProcess] = {}
+        self._running = False
+
+        # A claimed info hash can wait as a candidate before its fetch starts
+        self.claims = SharedInfoHashClaims(
+            slots=CRAWLER_CLAIMS_SLOTS,
+            ttl=CRAWLER_METADATA_CANDIDATE_TTL + CRAWLER_METADATA_FETCH_TIMEOUT,
+            done_ttl=CRAWLER_CLAIMS_DONE_TTL,
+        )
+
+    def _start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self._reuse_port, self.claims, self._loop, self._workers),
+            name=f"stilio-crawler-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _on_signal(self, signum, frame) -> None:
+        self._running = False
+
+    def run(self) -> None:
+        self._running = True
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        for index in range(self._workers):
+            self._start_worker(index)
+
+        while self._running:
+            time.sleep(1)
+            for index, process in list(self._processes.items()):
+                if self._running and not process.is_alive():
+                    logger.warning(
+                        f"Worker {index} exited with code {process.exitcode}, "
+                        "restarting it"
+                    )
+                    self._start_worker(index)
+
+        self.stop()
+
+    def stop(self) -> None:
+        """Asks the workers to stop, killing the ones that take too long"""
+        for process in self._processes.values():
+            process.terminate()
+        deadline = time.monotonic() + CRAWLER_STOP_TIMEOUT
+        for index, process in self._processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time, killing it")
+                process.kill()
+                process.join()
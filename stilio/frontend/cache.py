@@ -0,0 +1,283 @@
+"""
+Cache of the search result pages, so repeated searches skip the count and the
+page query of Torrent.search_by_name.
+
+Pages are cached under the normalized query and the page number for ttl
+seconds. Concurrent misses of the same page share a single query, the first
+one runs it in a thread and the others wait for its result. The query outlives
+the request that started it, so it does not run in the context of the request
+and has to open its own database connection.
+
+Backends store the pages encoded as JSON bytes:
+
+    memory: in-process LRU, bounded to max_entries pages
+    redis: server speaking the Redis protocol on the local host, shared by the
+        frontend workers, evictions are left to its maxmemory-policy
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from stilio import metrics
+from stilio.frontend import settings
+from stilio.persistence.torrents.models import Torrent
+
+logger = logging.getLogger(__name__)
+
+SearchPage = Tuple[List[Torrent], int]
+Loader = Callable[[str, int], SearchPage]
+
+LOOKUPS = metrics.Counter(
+    "stilio_frontend_search_cache_lookups",
+    "Search pages looked up in the cache by result",
+    ["result"],
+)
+HITS = LOOKUPS.labels("hit")
+MISSES = LOOKUPS.labels("miss")
+# Misses answered by the query of an identical miss already running
+SHARED = LOOKUPS.labels("shared")
+HIT_RATIO = metrics.Gauge(
+    "stilio_frontend_search_cache_hit_ratio", "Share of the lookups that were hits"
+)
+HIT_RATIO.set_function(
+    lambda: HITS.value / (HITS.value + MISSES.value + SHARED.value or 1)
+)
+LATENCY = metrics.Histogram(
+    "stilio_frontend_search_cache_seconds",
+    "Time spent answering a search page by lookup result",
+    ["result"],
+)
+HIT_LATENCY = LATENCY.labels("hit")
+MISS_LATENCY = LATENCY.labels("miss")
+SHARED_LATENCY = LATENCY.labels("shared")
+
+
+def normalize_query(query: str) -> str:
+    """Full text search ignores case and repeated spaces, so do the keys"""
+    return " ".join(query.lower().split())
+
+
+def dump_page(page: SearchPage) -> bytes:
+    torrents, count = page
+    fields = [field.name for field in Torrent.listing_fields()]
+    rows = [{name: getattr(torrent, name) for name in fields} for torrent in torrents]
+    for row in rows:
+        row["added_at"] = row["added_at"].isoformat()
+    return json.dumps({"torrents": rows, "count": count}).encode()
+
+
+def load_page(data: bytes) -> SearchPage:
+    page = json.loads(data)
+    torrents = []
+    for row in page["torrents"]:
+        row["added_at"] = dt.datetime.fromisoformat(row["added_at"])
+        torrents.append(Torrent(**row))
+    return torrents, page["count"]
+
+
+class CacheBackend:
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Least recently used entries are evicted past max_entries, expired ones
+    when they are looked up or evicted
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.SEARCH_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._entries: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+        self._max_entries = max_entries
+        self._clock = clock
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """Minimal client of the GET and SET commands over a single connection.
+
+    The cache is only an optimization, so a server that is down or slow counts
+    as a miss and the connection is opened again on the next lookup.
+    """
+
+    def __init__(
+        self,
+        host: str = settings.SEARCH_CACHE_REDIS_HOST,
+        port: int = settings.SEARCH_CACHE_REDIS_PORT,
+        timeout: float = settings.SEARCH_CACHE_REDIS_TIMEOUT,
+        prefix: str = "stilio:search:",
+    ):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        # Replies come in the order of the commands, one command at a time
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._command(b"GET", (self._prefix + key).encode())
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._command(
+            b"SET", (self._prefix + key).encode(), value, b"PX", b"%d" % (ttl * 1000)
+        )
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _command(self, *args: bytes) -> Optional[bytes]:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self._send(args), self._timeout)
+            except (
+                OSError,
+                EOFError,
+                ValueError,
+                asyncio.TimeoutError,
+                RedisError,
+            ) as e:
+                logger.warning(f"Search cache at {self._host}:{self._port}: {e!r}")
+                await self.close()
+                return None
+
+    async def _send(self, args: Tuple[bytes, ...]) -> Optional[bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self._host, self._port
+            )
+        assert self._reader is not None
+        command = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._writer.write(b"".join(command))
+
+        line = await self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise RedisError("Connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return None
+        if kind == b"-":
+            raise RedisError(rest.decode(errors="replace"))
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+
+class SearchCache:
+    def __init__(
+        self,
+        backend: CacheBackend,
+        load: Loader,
+        ttl: float = settings.SEARCH_CACHE_TTL,
+    ):
+        """Args:
+
+            backend: where the pages are stored
+            load: returns the torrents of a page of a normalized query and their
+                total count, called from a thread outside of the request context
+            ttl: seconds a page is cached for
+        """
+        self.backend = backend
+        self._load = load
+        self._ttl = ttl
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def search(self, query: str, page: int) -> SearchPage:
+        start = time.perf_counter()
+        query = normalize_query(query)
+        key = f"{page}:{query}"
+
+        data = await self.backend.get(key)
+        if data is not None:
+            result = load_page(data)
+            HITS.inc()
+            HIT_LATENCY.observe(time.perf_counter() - start)
+            return result
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load_and_store(key, query, page))
+            self._in_flight[key] = future
+            future.add_done_callback(functools.partial(self._done, key))
+            counter, latency = MISSES, MISS_LATENCY
+        else:
+            counter, latency = SHARED, SHARED_LATENCY
+
+        # A request going away does not cancel the query the others wait for
+        result = await asyncio.shield(future)
+        counter.inc()
+        latency.observe(time.perf_counter() - start)
+        return result
+
+    async def _load_and_store(self, key: str, query: str, page: int) -> SearchPage:
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, self._load, query, page
+        )
+        await self.backend.set(key, dump_page(result), self._ttl)
+        return result
+
+    def _done(self, key: str, future: asyncio.Future) -> None:
+        del self._in_flight[key]
+        # Retrieved here in case every request waiting for it went away
+        if not future.cancelled():
+            future.exception()
+
+
+def create_backend(name: str = settings.SEARCH_CACHE_BACKEND) -> Optional[CacheBackend]:
+    """Returns the backend called name, None if the cache is disabled"""
+    if name == "none":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown search cache backend {name}")
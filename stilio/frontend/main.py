@@ -1,14 +1,21 @@
-from fastapi import Depends, FastAPI, Query
+from fastapi import Depends, FastAPI, HTTPException, Path, Query
 from starlette.requests import Request
-from starlette.responses import RedirectResponse
+from starlette.responses import PlainTextResponse, RedirectResponse
 from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 
+from stilio import metrics
 from stilio.frontend import settings as project_settings
+from stilio.frontend.cache import SearchCache, SearchPage, create_backend
 from stilio.frontend.pagination import get_pages
+from stilio.persistence import database
 from stilio.persistence.database import db, db_state_default
 from stilio.persistence.torrents.models import Torrent
 
+SEARCH_LATENCY = metrics.Histogram(
+    "stilio_frontend_search_seconds", "Time spent searching torrents by name"
+)
+
 
 async def reset_db_state():
     db._state._state.set(db_state_default.copy())
@@ -30,15 +37,43 @@ app.mount("/static", StaticFiles(directory="stilio/frontend/static"), name="stat
 templates = Jinja2Templates(directory="stilio/frontend/templates")
 
 
+def search_page(query: str, page: int) -> SearchPage:
+    torrents, count = Torrent.search_by_name(
+        query,
+        limit=project_settings.PAGE_SIZE,
+        offset=project_settings.PAGE_SIZE * (page - 1),
+    )
+    return list(torrents), count
+
+
+def load_search_page(query: str, page: int) -> SearchPage:
+    """Runs search_page from a thread of the search cache, with a connection of
+    its own since the request that asked for the page may be gone
+    """
+    database.reset_state()
+    with db.connection_context():
+        return search_page(query, page)
+
+
+search_backend = create_backend()
+search_cache = (
+    SearchCache(search_backend, load_search_page)
+    if search_backend is not None
+    else None
+)
+
+
 @app.on_event("startup")
 def startup():
     db.connect(reuse_if_open=True)
 
 
 @app.on_event("shutdown")
-def shutdown():
+async def shutdown():
     if not db.is_closed():
         db.close()
+    if search_cache is not None:
+        await search_cache.backend.close()
 
 
 @app.get("/", dependencies=[Depends(get_db)])
@@ -58,11 +93,11 @@ async def search(
     if not query or not query.strip():
         return RedirectResponse("/")
 
-    torrents, count = Torrent.search_by_name(
-        query,
-        limit=project_settings.PAGE_SIZE,
-        offset=project_settings.PAGE_SIZE * (page - 1),
-    )
+    with SEARCH_LATENCY.time():
+        if search_cache is not None:
+            torrents, count = await search_cache.search(query, page)
+        else:
+            torrents, count = search_page(query, page)
     return templates.TemplateResponse(
         "search.html",
         {
@@ -74,3 +109,21 @@ async def search(
             "current_page": page,
         },
     )
+
+
+@app.get("/torrents/{info_hash}", dependencies=[Depends(get_db)])
+async def details(
+    request: Request,
+    info_hash: str = Path(..., min_length=40, max_length=40),
+):
+    torrent = Torrent.get_by_info_hash(info_hash.lower())
+    if torrent is None:
+        raise HTTPException(status_code=404, detail="Torrent not found")
+    return templates.TemplateResponse(
+        "details.html", {"request": request, "torrent": torrent}
+    )
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
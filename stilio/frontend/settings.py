@@ -1 +1,17 @@
+import os
+
 PAGE_SIZE = 10
+
+# Search cache
+# --------------------------------------------------------
+# "memory" caches in every worker, "redis" in a server shared by the workers and
+# "none" disables the cache
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+# Seconds a result page is cached for, new torrents show up after at most that
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+# Pages kept by the memory backend, a page takes a few KiB
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "10000"))
+SEARCH_CACHE_REDIS_HOST = os.getenv("SEARCH_CACHE_REDIS_HOST", "localhost")
+SEARCH_CACHE_REDIS_PORT = int(os.getenv("SEARCH_CACHE_REDIS_PORT", "6379"))
+# Seconds after which the server counts as down and the page is queried
+SEARCH_CACHE_REDIS_TIMEOUT = 0.1
@@ -35,7 +35,14 @@ db = PostgresqlDatabase(
     password=DATABASE_PASSWORD,
     autorollback=True,
 )
-db._state = PeeweeConnectionState()
+connection_state = PeeweeConnectionState()
+db._state = connection_state
+
+
+def reset_state() -> None:
+    """Gives the current context (e.g. a worker thread) its own connection state"""
+    db_state.set(db_state_default.copy())
+    connection_state.reset()
 
 
 class BaseModel(Model):
@@ -46,8 +53,10 @@ class BaseModel(Model):
 @db.connection_context()
 def init() -> None:
     from stilio.persistence.constants import MODELS
+    from stilio.persistence.migrations import migrate
 
     db.connect(reuse_if_open=True)
     db.create_tables(MODELS)
+    migrate(db)
     if not db.is_closed():
         db.close()
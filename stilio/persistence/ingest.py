@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Optional, Tuple
+
+from stilio import metrics
+from stilio.config import (
+    CRAWLER_DEBUG_LEVEL,
+    CRAWLER_INGEST_INLINE_SIZE,
+    CRAWLER_INGEST_MAX_IN_FLIGHT,
+    CRAWLER_INGEST_MAX_QUEUE_SIZE,
+    CRAWLER_INGEST_WORKERS,
+)
+from stilio.crawler.bittorrent.bencoding import BencoderError, decode
+from stilio.persistence import utils as db_utils
+from stilio.persistence.exceptions import PersistenceError
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = metrics.Gauge(
+    "stilio_ingest_in_flight", "Metadata being decoded in the process pool"
+)
+QUEUE_DEPTH = metrics.Gauge(
+    "stilio_ingest_queue_depth", "Metadata waiting for the process pool"
+)
+DROPPED = metrics.Counter(
+    "stilio_ingest_dropped", "Metadata dropped because the queue was full"
+)
+ROWS = metrics.Counter("stilio_ingest_rows", "Metadata decoded", ["result"])
+ROWS_BUILT = ROWS.labels("built")
+ROWS_INVALID = ROWS.labels("invalid")
+ROWS_ERROR = ROWS.labels("error")
+LATENCY = metrics.Histogram(
+    "stilio_ingest_seconds", "Time from queueing metadata to its row being built"
+)
+POOL_RESTARTS = metrics.Counter(
+    "stilio_ingest_pool_restarts", "Process pools replaced after a worker died"
+)
+
+
+def build_torrent_row(info_hash: bytes, metadata: bytes) -> Optional[dict]:
+    """Decodes verified metadata into a torrent row, None if it cannot be stored.
+
+    Runs in the pool processes, so it only takes and returns picklable values.
+    """
+    try:
+        return db_utils.get_torrent_row(info_hash, decode(metadata))
+    except (BencoderError, PersistenceError):
+        return None
+
+
+class IngestStage:
+    """Turns the metadata fetched into torrent rows in a process pool, so decoding
+    and building the file tree of large torrents never stalls the event loop.
+
+    At most max_in_flight metadata are in the pool at once, the rest wait in a
+    bounded queue and are dropped once it is full. Metadata smaller than
+    inline_size is cheaper to decode than to send to another process and is
+    decoded right away.
+
+    on_backpressure is called with True when the queue is half full and with
+    False once it is empty again, so the producer can stop fetching meanwhile.
+    on_failed is called with the info hashes that did not make it to a row,
+    either dropped, invalid or failing to decode.
+
+    A pool process dying, e.g. killed for running out of memory, breaks the whole
+    pool. It is then replaced, the metadata that was in the broken pool is
+    dropped and the queued one goes to the new pool.
+    """
+
+    def __init__(
+        self,
+        on_row: Optional[Callable[[dict], Any]] = None,
+        workers: int = CRAWLER_INGEST_WORKERS,
+        max_in_flight: int = CRAWLER_INGEST_MAX_IN_FLIGHT,
+        max_queue_size: int = CRAWLER_INGEST_MAX_QUEUE_SIZE,
+        inline_size: int = CRAWLER_INGEST_INLINE_SIZE,
+    ):
+        """Args:
+
+            on_row: called in the event loop with every row built
+            workers: number of processes in the pool, 0 decodes in the event loop
+            max_in_flight: maximum number of metadata in the pool at once
+            max_queue_size: maximum number of metadata waiting for the pool
+            inline_size: metadata up to this size in bytes skips the pool
+        """
+        self._max_in_flight = max_in_flight
+        self._max_queue_size = max_queue_size
+        self._inline_size = inline_size
+        self._workers = workers
+
+        self._executor = self._create_executor()
+        self._queue: Deque[Tuple[bytes, bytes, float]] = deque()
+        self._in_flight = 0
+        self._saturated = False
+
+        self.loop = asyncio.get_event_loop()
+
+        # Stats
+        self.dropped = 0
+
+        # Callbacks
+        self.on_row = on_row
+        self.on_backpressure: Optional[Callable[[bool], None]] = None
+        self.on_failed: Optional[Callable[[bytes], None]] = None
+
+        IN_FLIGHT.set_function(lambda: self.in_flight)
+        QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    def _create_executor(self) -> Optional[ProcessPoolExecutor]:
+        if not self._workers:
+            return None
+        # Spawned so the pool does not inherit the sockets and threads of the crawler
+        return ProcessPoolExecutor(
+            max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        """Replaces the pool unless it has already been replaced"""
+        if broken is not self._executor:
+            return
+        logger.error("A process of the ingest pool died, starting a new pool")
+        POOL_RESTARTS.inc()
+        broken.shutdown(wait=False)
+        self._executor = self._create_executor()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def saturated(self) -> bool:
+        return self._saturated
+
+    def put(self, info_hash: bytes, metadata: bytes) -> bool:
+        """Queues metadata to be decoded, returns False if the queue is full"""
+        if self._executor is None or len(metadata) <= self._inline_size:
+            try:
+                row = build_torrent_row(info_hash, metadata)
+            except Exception as e:
+                self._on_error(info_hash, e)
+            else:
+                self._on_row(info_hash, row)
+            return True
+
+        if len(self._queue) >= self._max_queue_size:
+            self.dropped += 1
+            DROPPED.inc()
+            logger.warning(f"Ingest queue is full, dropping {info_hash.hex()}")
+            if self.on_failed:
+                self.on_failed(info_hash)
+            return False
+
+        self._queue.append((info_hash, metadata, time.perf_counter()))
+        self._submit_queued()
+        return True
+
+    def _submit_queued(self) -> None:
+        while self._queue and self._in_flight < self._max_in_flight:
+            info_hash, metadata, queued_at = self._queue[0]
+            executor = self._executor
+            assert executor is not None
+            try:
+                future = self.loop.run_in_executor(
+                    executor, build_torrent_row, info_hash, metadata
+                )
+            except BrokenProcessPool:
+                self._replace_executor(executor)
+                continue
+            self._queue.popleft()
+            future.add_done_callback(
+                functools.partial(self._on_done, executor, info_hash, queued_at)
+            )
+            self._in_flight += 1
+        self._update_backpressure()
+
+    def _update_backpressure(self) -> None:
+        if self._saturated:
+            saturated = bool(self._queue)
+        else:
+            saturated = len(self._queue) >= self._max_queue_size // 2
+        if saturated != self._saturated:
+            self._saturated = saturated
+            logger.info(f"Ingest backpressure {'on' if saturated else 'off'}")
+            if self.on_backpressure:
+                self.on_backpressure(saturated)
+
+    def _on_done(
+        self,
+        executor: ProcessPoolExecutor,
+        info_hash: bytes,
+        queued_at: float,
+        future: asyncio.Future,
+    ) -> None:
+        self._in_flight -= 1
+        try:
+            row = future.result()
+        except asyncio.CancelledError:
+            if self.on_failed:
+                self.on_failed(info_hash)
+        except BrokenProcessPool:
+            # It may be the one that killed the process, so it is not retried
+            logger.warning(f"Dropping {info_hash.hex()}, its process pool broke")
+            ROWS_ERROR.inc()
+            self._replace_executor(executor)
+            if self.on_failed:
+                self.on_failed(info_hash)
+        except Exception as e:
+            self._on_error(info_hash, e)
+        else:
+            LATENCY.observe(time.perf_counter() - queued_at)
+            self._on_row(info_hash, row)
+        self._submit_queued()
+
+    def _on_error(self, info_hash: bytes, exception: Exception) -> None:
+        ROWS_ERROR.inc()
+        logger.debug("Error building torrent row")
+        logger.exception(exception)
+        if self.on_failed:
+            self.on_failed(info_hash)
+
+    def _on_row(self, info_hash: bytes, row: Optional[dict]) -> None:
+        if row is None:
+            ROWS_INVALID.inc()
+            if self.on_failed:
+                self.on_failed(info_hash)
+            return
+        ROWS_BUILT.inc()
+        if self.on_row:
+            self.on_row(row)
+
+    async def stop(self) -> None:
+        """Waits for the queued metadata to be decoded and shuts the pool down"""
+        while self._queue or self._in_flight:
+            await asyncio.sleep(0.05)
+        if self._executor:
+            self._executor.shutdown()
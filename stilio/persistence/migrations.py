@@ -0,0 +1,61 @@
+"""
+Idempotent schema changes for databases created by older versions, init runs them
+after creating the missing tables.
+"""
+from typing import Optional
+
+from peewee import Database
+
+from stilio.persistence.torrents.models import Torrent
+
+
+def _column_type(db: Database, table: str, column: str) -> Optional[str]:
+    cursor = db.execute_sql(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = %s AND column_name = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def migrate_torrent_files(db: Database) -> None:
+    """Moves the file listings from JSON text to jsonb and counts their files"""
+    table = Torrent._meta.table_name
+    with db.atomic():
+        db.execute_sql(
+            f'ALTER TABLE "{table}" '
+            "ADD COLUMN IF NOT EXISTS file_count integer NOT NULL DEFAULT 0"
+        )
+        if _column_type(db, table, "files") != "text":
+            return
+
+        # Escaped NUL characters are valid JSON but cannot be stored in jsonb
+        db.execute_sql(
+            f'ALTER TABLE "{table}" ALTER COLUMN files DROP NOT NULL, '
+            "ALTER COLUMN files TYPE jsonb "
+            r"USING NULLIF(replace(files, '\u0000', '\ufffd'), '')::jsonb"
+        )
+        # File names are the strings of the listing, directories are keys. The
+        # tree is walked with a recursive query, jsonb_path_query needs Postgres 12
+        db.execute_sql(
+            f'UPDATE "{table}" SET file_count = ('
+            "WITH RECURSIVE node(value) AS ("
+            "SELECT files UNION ALL "
+            "SELECT child.value FROM node, LATERAL ("
+            "SELECT value FROM jsonb_each(CASE WHEN jsonb_typeof(node.value) = "
+            "'object' THEN node.value END) UNION ALL "
+            "SELECT value FROM jsonb_array_elements(CASE WHEN "
+            "jsonb_typeof(node.value) = 'array' THEN node.value END)"
+            ") AS child"
+            ") SELECT count(*) FROM node WHERE jsonb_typeof(value) = 'string'"
+            ") WHERE files IS NOT NULL"
+        )
+
+
+MIGRATIONS = [migrate_torrent_files]
+
+
+def migrate(db: Database) -> None:
+    for migration in MIGRATIONS:
+        migration(db)
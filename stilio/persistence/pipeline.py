@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, List, Optional, Tuple
+
+from peewee import DataError, IntegrityError
+
+from stilio import metrics
+from stilio.config import (
+    CRAWLER_DEBUG_LEVEL,
+    CRAWLER_PERSISTENCE_BATCH_SIZE,
+    CRAWLER_PERSISTENCE_FLUSH_INTERVAL,
+    CRAWLER_PERSISTENCE_MAX_QUEUE_SIZE,
+    CRAWLER_PERSISTENCE_MAX_RETRIES,
+    CRAWLER_PERSISTENCE_RETRY_DELAY,
+)
+from stilio.persistence import database
+from stilio.persistence import utils as db_utils
+
+logging.basicConfig(level=CRAWLER_DEBUG_LEVEL)
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = metrics.Gauge(
+    "stilio_persistence_queue_depth", "Torrents waiting to be stored"
+)
+DROPPED = metrics.Counter(
+    "stilio_persistence_dropped", "Torrents dropped because the queue was full"
+)
+FAILED = metrics.Counter(
+    "stilio_persistence_failed", "Torrents rejected by the database"
+)
+BATCH_SIZE = metrics.Histogram(
+    "stilio_persistence_batch_size",
+    "Torrents stored per batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 5000),
+)
+FLUSH_LATENCY = metrics.Histogram(
+    "stilio_persistence_flush_seconds", "Time spent storing a batch"
+)
+
+
+class TorrentPipeline:
+    """Queues torrent rows and stores them in batches from a background thread, so
+    the event loop never waits for the database.
+
+    A batch is flushed when batch_size rows are queued or when flush_interval
+    seconds have passed, whatever happens first. A batch with rows the database
+    rejects is split in halves and stored again, so only those rows are lost.
+    Any other error, e.g. the database being unreachable, retries the whole batch
+    with an exponential backoff up to max_retries times. The rows lost,
+    including the ones dropped by a full queue, are passed to on_failed.
+    """
+
+    def __init__(
+        self,
+        on_stored: Optional[Callable[[List[dict]], None]] = None,
+        on_failed: Optional[Callable[[List[dict]], None]] = None,
+        batch_size: int = CRAWLER_PERSISTENCE_BATCH_SIZE,
+        flush_interval: float = CRAWLER_PERSISTENCE_FLUSH_INTERVAL,
+        max_queue_size: int = CRAWLER_PERSISTENCE_MAX_QUEUE_SIZE,
+        max_retries: int = CRAWLER_PERSISTENCE_MAX_RETRIES,
+        retry_delay: float = CRAWLER_PERSISTENCE_RETRY_DELAY,
+    ):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+
+        self._rows: Deque[dict] = deque()
+        self._batch_ready = asyncio.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, initializer=database.reset_state
+        )
+        self._task: Optional[asyncio.Future] = None
+        self._running = False
+
+        # Stats
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.last_flush_latency = 0.0
+
+        # Callbacks
+        self.on_stored = on_stored
+        self.on_failed = on_failed
+
+        QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._rows)
+
+    def put(self, row: dict) -> bool:
+        """Queues a row to be stored, returns False if the queue is full"""
+        if len(self._rows) >= self._max_queue_size:
+            self.dropped += 1
+            DROPPED.inc()
+            logger.warning(f"Persistence queue is full, dropping {row['info_hash']}")
+            if self.on_failed:
+                self.on_failed([row])
+            return False
+
+        self._rows.append(row)
+        if len(self._rows) >= self._batch_size:
+            self._batch_ready.set()
+        return True
+
+    @classmethod
+    def _store(cls, rows: List[dict]) -> Tuple[List[str], List[dict]]:
+        """Stores the rows from the executor thread, returns the info hashes
+        inserted and the rows that could not be stored
+        """
+        try:
+            return db_utils.store_torrent_rows(rows), []
+        except (DataError, IntegrityError) as e:
+            if len(rows) == 1:
+                logger.warning(f"Error storing {rows[0]['info_hash']}: {e}")
+                return [], rows
+
+        middle = len(rows) // 2
+        inserted, failed = cls._store(rows[:middle])
+        other_inserted, other_failed = cls._store(rows[middle:])
+        return inserted + other_inserted, failed + other_failed
+
+    @staticmethod
+    def _close_connection() -> None:
+        """Closes the connection of the executor thread, which may be broken, so
+        the next statement opens a new one
+        """
+        try:
+            if not database.db.is_closed():
+                database.db.close()
+        except Exception as e:
+            logger.debug(f"Error closing the database connection: {e!r}")
+
+    async def _flush(self, rows: List[dict]) -> None:
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        inserted: List[str] = []
+        failed: List[dict] = rows
+        delay = self._retry_delay
+        for retries in range(self._max_retries + 1):
+            try:
+                inserted, failed = await loop.run_in_executor(
+                    self._executor, self._store, rows
+                )
+                break
+            except Exception as e:
+                if retries == self._max_retries:
+                    logger.error(f"Error storing a batch of {len(rows)} torrents")
+                    logger.exception(e)
+                    break
+                logger.warning(
+                    f"Error storing a batch of {len(rows)} torrents, retrying in "
+                    f"{delay:.1f} s: {e!r}"
+                )
+                await loop.run_in_executor(self._executor, self._close_connection)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        if failed:
+            FAILED.inc(len(failed))
+            failed_rows = {id(row) for row in failed}
+            rows = [row for row in rows if id(row) not in failed_rows]
+            if self.on_failed:
+                self.on_failed(failed)
+
+        self.last_batch_size = len(rows)
+        self.last_flush_latency = time.perf_counter() - start
+        BATCH_SIZE.observe(len(rows))
+        FLUSH_LATENCY.observe(self.last_flush_latency)
+        logger.info(
+            f"Added {len(inserted)} of {len(rows)} torrents in "
+            f"{self.last_flush_latency * 1000:.1f} ms, "
+            f"{self.queue_depth} torrents queued"
+        )
+
+        if self.on_stored:
+            self.on_stored(rows)
+
+    async def _flush_queued(self) -> None:
+        while self._rows:
+            size = min(len(self._rows), self._batch_size)
+            await self._flush([self._rows.popleft() for _ in range(size)])
+
+    async def _run(self) -> None:
+        while self._running:
+            try:
+                await asyncio.wait_for(
+                    self._batch_ready.wait(), timeout=self._flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self._flush_queued()
+
+    def start(self) -> None:
+        self._running = True
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        self._running = False
+        self._batch_ready.set()
+        if self._task:
+            await self._task
+        await self._flush_queued()
+        self._executor.shutdown()
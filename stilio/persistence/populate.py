@@ -18,7 +18,8 @@ def create_fake_data() -> None:
             name=name,
             search_name=fn.to_tsvector(name),
             size="",
-            files="",
+            files={"/": [name]},
+            file_count=1,
         ).execute()
         print(f"Added torrent with ID {torrent_id} to the database")
 
@@ -1,20 +1,22 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import List, Tuple
+import json
+from typing import Any, Iterator, List, Optional, Tuple
 
-from peewee import (
-    BigIntegerField,
-    CharField,
-    DateTimeField,
-    IntegerField,
-    TextField,
-)
-from playhouse.postgres_ext import Match, TSVectorField
+from peewee import BigIntegerField, CharField, DateTimeField, Field, IntegerField
+from playhouse.postgres_ext import BinaryJSONField, Match, TSVectorField
 
 from stilio.persistence.database import BaseModel
 
 
+def dumps_files(files: Any) -> str:
+    """Rows carry the file listing already serialized by the ingest processes"""
+    if isinstance(files, str):
+        return files
+    return json.dumps(files, ensure_ascii=False)
+
+
 class Torrent(BaseModel):
     info_hash = CharField(max_length=40, unique=True)
 
@@ -24,7 +26,9 @@ class Torrent(BaseModel):
     seeders = IntegerField(default=0)
     leechers = IntegerField(default=0)
 
-    files = TextField()
+    # Only loaded by the detail view, see search_by_name
+    files = BinaryJSONField(dumps=dumps_files, null=True)
+    file_count = IntegerField(default=0)
 
     size = BigIntegerField()
 
@@ -37,11 +41,35 @@ class Torrent(BaseModel):
     def exists(cls, info_hash: bytes):
         return cls.select().where(cls.info_hash == info_hash.hex()).exists()
 
+    @classmethod
+    def info_hashes(cls, added_after: Optional[dt.datetime] = None) -> Iterator[bytes]:
+        query = cls.select(cls.info_hash)
+        if added_after is not None:
+            query = query.where(cls.added_at >= added_after)
+        rows = query.tuples().iterator()
+        return (bytes.fromhex(info_hash) for info_hash, in rows)
+
+    @classmethod
+    def get_by_info_hash(cls, info_hash: str) -> Optional[Torrent]:
+        """Returns the whole torrent, including its file listing"""
+        return cls.get_or_none(cls.info_hash == info_hash)
+
     @classmethod
     def total_torrent_count(cls) -> int:
         count = cls.select().count()
         return count
 
+    @classmethod
+    def listing_fields(cls) -> List[Field]:
+        """Fields shown in result pages, skipping the file listing and the search
+        vector that may take most of the row
+        """
+        return [
+            field
+            for field in cls._meta.sorted_fields
+            if field.name not in (cls.files.name, cls.search_name.name)
+        ]
+
     @classmethod
     def search_by_name(
         cls, name: str, limit=None, offset=None
@@ -54,7 +82,7 @@ class Torrent(BaseModel):
 
         torrent_count = queryset.select().count()
         torrents = (
-            queryset.select()
+            queryset.select(*cls.listing_fields())
             .order_by(Torrent.added_at.desc())
             .limit(limit)
             .offset(offset)
@@ -1,89 +1,137 @@
+from __future__ import annotations
+
 import json
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
-from peewee import IntegrityError
+from peewee import ValuesList
 from playhouse.postgres_ext import fn
 
+from stilio import metrics
 from stilio.persistence.exceptions import StoringError
 from stilio.persistence.torrents.models import Torrent
 
+# Range of a Postgres bigint
+MAX_SIZE = (1 << 63) - 1
 
-class FileSystem:
-    def __init__(self, file_path=None, root=False):
-        self.children = []
+INSERT_LATENCY = metrics.Histogram(
+    "stilio_persistence_insert_seconds", "Time spent in torrent insert statements"
+)
+UPDATE_LATENCY = metrics.Histogram(
+    "stilio_persistence_update_seconds", "Time spent in torrent update statements"
+)
 
-        if file_path != None and not root:
-            try:
-                self.name, child = file_path.split("/", 1)
-                self.children.append(FileSystem(child))
-            except ValueError:
-                self.name = file_path
-        else:
-            self.name = "/"
-
-    def add_child(self, file_path):
-        try:
-            first_level, next_level = file_path.split("/", 1)
-        except ValueError:
-            # only one result, final file in path, add it
-            self.children.append(FileSystem(file_path))
-        else:
-            # search for child and add the rest
-            for child in self.children:
-                if first_level == child.name:
-                    child.add_child(next_level)
-                    return
-            else:
-                # rest of the path not present in filesystem, add it
-                self.children.append(FileSystem(file_path))
-
-    def is_children(self, name: str) -> bool:
-        return any(name == children.name for children in self.children)
-
-    def make_dict(self):
-        if len(self.children) > 0:
-            dictionary = {self.name: []}
-            for child in self.children:
-                dictionary[self.name].append(child.make_dict())
-            return dictionary
-        else:
-            return self.name
 
+class FileTreeNode:
+    __slots__ = ("name", "children", "index")
 
-def store_metadata(info_hash: bytes, metadata: dict, logger=None) -> None:
-    name = metadata[b"name"].decode("utf-8")
-    search_name = name.replace(".", " ")
+    def __init__(self, name: str):
+        self.name = name
+        # Only created once the node gets children, most nodes are files
+        self.children: Optional[List[FileTreeNode]] = None
+        # First child with every name
+        self.index: Optional[Dict[str, FileTreeNode]] = None
+
+    def add_child(self, name: str) -> FileTreeNode:
+        child = FileTreeNode(name)
+        if self.children is None or self.index is None:
+            self.children = [child]
+            self.index = {name: child}
+        else:
+            self.children.append(child)
+            self.index.setdefault(name, child)
+        return child
+
+    def make_dict(self) -> Union[dict, str]:
+        if self.children:
+            return {self.name: [child.make_dict() for child in self.children]}
+        return self.name
+
+
+def build_file_tree(paths: Iterable[Sequence[str]]) -> Union[dict, str]:
+    """Builds the nested file listing of a torrent from the components of its file
+    paths in a single pass, e.g. {"/": [{"dir": ["a", "b"]}, "c"]}.
+
+    Directories are looked up by name so every path costs a dict lookup per
+    component, no matter how many files share the directory.
+    """
+    root = FileTreeNode("/")
+    for path in paths:
+        node = root
+        for name in path[:-1]:
+            child = node.index.get(name) if node.index else None
+            node = child if child is not None else node.add_child(name)
+        # Files are always added, even if a file with the same name exists
+        node.add_child(path[-1])
+    return root.make_dict()
+
+
+def _clean(text: str) -> str:
+    # Postgres rejects NUL characters in text and jsonb values
+    return text.replace("\x00", "\ufffd")
+
+
+def get_torrent_row(info_hash: bytes, metadata: dict) -> dict:
+    """Builds the values of a torrent row from its decoded metadata, search_name
+    is kept as plain text so the row can be moved around before being inserted.
+
+    Names are truncated to fit in their column, raises StoringError for values
+    that cannot be stored at all.
+    """
+    name = _clean(metadata[b"name"].decode("utf-8"))[: Torrent.name.max_length]
     files = get_file_structure(metadata, name)
     size = get_size(metadata)
-
-    try:
-        Torrent.insert(
-            info_hash=info_hash.hex(),
-            name=name,
-            search_name=fn.to_tsvector(search_name),
-            files=json.dumps(files, ensure_ascii=False),
-            size=size,
-        ).execute()
-    except IntegrityError as e:
-        logger.exception(e)
-        return
-
-    if logger:
-        logger.info(f"Added: {name}")
-
-
-def get_file_structure(metadata: dict, name: str) -> dict:
-    files = FileSystem(root=True)
-
-    if b"files" in metadata:
-        for file in metadata[b"files"]:
-            if any(b"/" in item for item in file[b"path"]):
-                raise StoringError(message="Path contains trailing slashes")
-            path = "/".join(i.decode("utf-8") for i in file[b"path"])
-            files.add_child(path)
-    else:
-        files.add_child(name)
-
-    return files.make_dict()
+    if not 0 <= size <= MAX_SIZE:
+        raise StoringError(message=f"Size {size} is out of range")
+
+    return {
+        "info_hash": info_hash.hex(),
+        "name": name,
+        "search_name": name.replace(".", " "),
+        "files": json.dumps(files, ensure_ascii=False),
+        "file_count": len(metadata[b"files"]) if b"files" in metadata else 1,
+        "size": size,
+    }
+
+
+def store_torrent_rows(rows: List[dict]) -> List[str]:
+    """Inserts the rows in a single statement ignoring the ones already stored,
+    returns the info hashes that were actually inserted.
+    """
+    query = (
+        Torrent.insert_many(
+            [{**row, "search_name": fn.to_tsvector(row["search_name"])} for row in rows]
+        )
+        .on_conflict(conflict_target=[Torrent.info_hash], action="IGNORE")
+        .returning(Torrent.info_hash)
+    )
+    with INSERT_LATENCY.time():
+        return [info_hash for info_hash, in query.tuples().execute()]
+
+
+def update_peer_counts(rows: List[Tuple[str, int, int]]) -> int:
+    """Sets the seeders and leechers of the (info hash, seeders, leechers) rows in
+    a single statement, returns the number of torrents updated.
+    """
+    values = ValuesList(rows, columns=("info_hash", "seeders", "leechers"), alias="v")
+    query = (
+        Torrent.update(seeders=values.c.seeders, leechers=values.c.leechers)
+        .from_(values)
+        .where(Torrent.info_hash == values.c.info_hash)
+    )
+    with UPDATE_LATENCY.time():
+        return query.execute()
+
+
+def get_file_structure(metadata: dict, name: str) -> Union[dict, str]:
+    if b"files" not in metadata:
+        return build_file_tree([[name]])
+
+    paths = []
+    for file in metadata[b"files"]:
+        if any(b"/" in item for item in file[b"path"]):
+            raise StoringError(message="Path contains trailing slashes")
+        paths.append([_clean(item.decode("utf-8")) for item in file[b"path"]] or [""])
+    return build_file_tree(paths)
 
 
 def get_size(metadata: dict) -> int:
@@ -0,0 +1,38 @@
+from stilio.crawler.dht.capture import DatagramRecorder, read_capture
+from stilio.crawler.dht.udp import UDPNode
+
+
+class TestDatagramRecorder:
+    def test_record_and_read(self, tmp_path) -> None:
+        path = str(tmp_path / "crawler-0.capture")
+        recorder = DatagramRecorder(path)
+        recorder.record(b"d1:y1:qe", ("1.2.3.4", 6881))
+        recorder.record(b"", ("5.6.7.8", 1))
+        recorder.close()
+
+        records = [(bytes(data), address) for _, data, address in read_capture(path)]
+
+        assert records == [(b"d1:y1:qe", ("1.2.3.4", 6881)), (b"", ("5.6.7.8", 1))]
+
+    def test_recording_stops_at_max_bytes(self, tmp_path) -> None:
+        path = str(tmp_path / "crawler-0.capture")
+        recorder = DatagramRecorder(path, max_bytes=100)
+        for _ in range(10):
+            recorder.record(b"x" * 40, ("1.2.3.4", 6881))
+
+        assert not recorder.recording
+        assert recorder.recorded == 2
+        assert len(list(read_capture(path))) == 2
+
+    def test_udp_node_records_received_datagrams(self, tmp_path) -> None:
+        path = str(tmp_path / "crawler-0.capture")
+        received = []
+        node = UDPNode("0.0.0.0", 6881)
+        node.on_data_received = lambda data, address: received.append(data)
+        node.recorder = DatagramRecorder(path)
+
+        node.datagram_received(b"data", ("1.2.3.4", 6881))
+        node.recorder.close()
+
+        assert received == [b"data"]
+        assert [bytes(data) for _, data, _ in read_capture(path)] == [b"data"]
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+from stilio.config import CRAWLER_METADATA_BACKOFF_MIN_PEERS
+from stilio.crawler.dedup import SharedInfoHashClaims
+from stilio.crawler.dht.crawling import CrawlingService
+from stilio.persistence import utils as db_utils
+
+
+class TestCrawlingService:
+    def test_info_hash_is_seen_once_stored(self) -> None:
+        info_hash = os.urandom(20)
+        queued = []
+        fetches = []
+
+        async def run():
+            crawler = CrawlingService(metrics_port=None)
+            crawler.ingest.put = lambda *args: queued.append(args)
+            crawler.metadata_fetcher.fetch = lambda *args: fetches.append(args)
+            crawler.on_metadata_result(info_hash, b"metadata")
+            # Announced again before the pipeline stored it
+            crawler._fetch_metadata(info_hash, ("1.2.3.4", 6881))
+            assert info_hash not in crawler.seen_info_hashes.bloom_filter
+            crawler.on_torrents_stored([{"info_hash": info_hash.hex()}])
+            return crawler
+
+        crawler = asyncio.run(run())
+
+        assert queued == [(info_hash, b"metadata")]
+        assert info_hash in crawler.seen_info_hashes.bloom_filter
+        assert fetches == []
+
+    def test_info_hash_is_fetched_again_if_not_stored(self) -> None:
+        info_hash = os.urandom(20)
+        fetches = []
+
+        async def run():
+            crawler = CrawlingService(metrics_port=None)
+            crawler.seen_info_hashes._lookup = lambda info_hash: False
+            crawler.metadata_fetcher.fetch = lambda *args: fetches.append(args)
+            # Not bencoded, so no row can be built
+            crawler.on_metadata_result(info_hash, b"metadata")
+            crawler._fetch_metadata(info_hash, ("1.2.3.4", 6881))
+            return crawler
+
+        crawler = asyncio.run(run())
+
+        assert info_hash not in crawler.seen_info_hashes.bloom_filter
+        assert len(fetches) == 1
+
+    def test_stop_stores_the_queued_torrents(self, monkeypatch) -> None:
+        stored = []
+
+        def store_torrent_rows(rows):
+            stored.extend(rows)
+            return [row["info_hash"] for row in rows]
+
+        monkeypatch.setattr(db_utils, "store_torrent_rows", store_torrent_rows)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            crawler = CrawlingService(metrics_port=None)
+            crawler.pipeline.start()
+            crawler.pipeline.put({"info_hash": "00"})
+            loop.call_soon(crawler.stop)
+            # Only stopped once the pipeline has been flushed
+            loop.run_forever()
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+        assert stored == [{"info_hash": "00"}]
+
+    def test_failed_fetches_release_their_claim(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+
+        async def run():
+            crawler = CrawlingService(metrics_port=None, claims=claims)
+            crawler.seen_info_hashes._lookup = lambda info_hash: False
+            for _ in range(CRAWLER_METADATA_BACKOFF_MIN_PEERS):
+                crawler.metadata_fetcher._failed_info_hashes.failure(info_hash)
+            # Backed off, so the info hash is not fetched and the claim is freed
+            crawler._fetch_metadata(info_hash, ("1.2.3.4", 6881))
+
+        asyncio.run(run())
+
+        offset, _ = claims._locate(info_hash)
+        assert claims._slot.unpack_from(claims._buffer, offset) == (0, 0, 0)
+
+    def test_info_hashes_stored_by_another_service_are_seen(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+        fetches = []
+
+        async def run():
+            crawler = CrawlingService(metrics_port=None, claims=claims)
+            crawler.seen_info_hashes._lookup = lambda info_hash: False
+            crawler.metadata_fetcher.fetch = lambda *args: fetches.append(args)
+            other = CrawlingService(metrics_port=None, port=6891, claims=claims)
+            other.on_torrents_stored([{"info_hash": info_hash.hex()}])
+            crawler._fetch_metadata(info_hash, ("1.2.3.4", 6881))
+            return crawler
+
+        crawler = asyncio.run(run())
+
+        assert fetches == []
+        assert info_hash in crawler.seen_info_hashes.bloom_filter
@@ -0,0 +1,89 @@
+import pytest
+
+from stilio.crawler.bittorrent import decoder
+from stilio.crawler.bittorrent.bencoding import BencoderError, decode2, encode
+
+VALUE = {
+    b"name": b"x" * 40,
+    b"files": [{b"length": 1 << 40, b"path": [b"a", b"b"]}],
+    b"offset": -12,
+    b"pieces": b"\x01" * 60,
+}
+
+
+class TestDecoder:
+    def test_decode(self) -> None:
+        data = encode(VALUE)
+
+        assert decoder.decode(data) == VALUE
+        assert decoder.decode(bytearray(data)) == VALUE
+
+    def test_decode_prefix_returns_the_end_offset(self) -> None:
+        data = encode(VALUE)
+        buffer = memoryview(b"xx" + data + b"payload")
+
+        assert decoder.decode_prefix(buffer, 2) == (VALUE, 2 + len(data))
+        assert decode2(buffer, 2) == (VALUE, 2 + len(data))
+
+    def test_skip_keys(self) -> None:
+        data = encode(VALUE)
+
+        decoded = decoder.decode(data, skip_keys={b"pieces"})
+
+        assert bytes(decoded.pop(b"pieces")) == encode(VALUE[b"pieces"])
+        assert decoded == {key: VALUE[key] for key in VALUE if key != b"pieces"}
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"",
+            b"i12",
+            b"ie",
+            b"i-e",
+            b"i 1e",
+            b"i" + b"9" * 30 + b"e",
+            b"5:ab",
+            b"+1:a",
+            b"1_0:aaaaaaaaaa",
+            b"d1:ae",
+            b"di1ei2ee",
+            b"dlei1ee",
+            b"l1:a",
+            b"e",
+            b"i1ei2e",
+        ],
+    )
+    def test_invalid(self, data: bytes) -> None:
+        with pytest.raises(decoder.DecodeError):
+            decoder.decode(data)
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"i12345",
+            b"i-",
+            b"5:ab",
+            b"12",
+            b"li1ei2",
+            b"d3:abci1",
+            b"d3:abcl1:x",
+            b"d6:piecesli1",
+        ],
+    )
+    def test_truncated(self, data: bytes) -> None:
+        with pytest.raises(decoder.DecodeError, match="truncated|out of bounds"):
+            decoder.decode_prefix(data, skip_keys={b"pieces"})
+
+    def test_limits(self) -> None:
+        with pytest.raises(decoder.DecodeError):
+            decoder.decode(b"l" * 10 + b"e" * 10, max_depth=5)
+        with pytest.raises(decoder.DecodeError):
+            decoder.decode(encode(list(range(100))), max_elements=50)
+        with pytest.raises(decoder.DecodeError):
+            decoder.decode(
+                encode({b"p": list(range(100))}), max_elements=50, skip_keys={b"p"}
+            )
+        with pytest.raises(decoder.DecodeError):
+            decoder.decode(encode(b"x" * 100), max_length=50)
+        with pytest.raises(BencoderError):
+            decode2(b"l1:ae", end=3)
@@ -0,0 +1,168 @@
+import os
+from typing import List
+
+from stilio.crawler.dedup import (
+    InfoHashFilter,
+    LRUCache,
+    NegativeCache,
+    ScalableBloomFilter,
+    SharedInfoHashClaims,
+)
+
+
+class TestScalableBloomFilter:
+    def test_add_and_contains(self) -> None:
+        bloom_filter = ScalableBloomFilter(initial_capacity=100, error_rate=0.001)
+        keys = [os.urandom(20) for _ in range(1_000)]
+        for key in keys:
+            bloom_filter.add(key)
+
+        assert all(key in bloom_filter for key in keys)
+        assert len(bloom_filter.filters) > 1
+
+    def test_false_positive_rate(self) -> None:
+        bloom_filter = ScalableBloomFilter(initial_capacity=1_000, error_rate=0.01)
+        for _ in range(1_000):
+            bloom_filter.add(os.urandom(20))
+
+        false_positives = sum(os.urandom(20) in bloom_filter for _ in range(10_000))
+        assert false_positives < 200
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self) -> None:
+        cache: LRUCache[str, int] = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+
+class TestNegativeCache:
+    def test_exponential_backoff(self) -> None:
+        now = [0.0]
+        cache: NegativeCache[str] = NegativeCache(
+            10, base_delay=1, max_delay=4, clock=lambda: now[0]
+        )
+
+        assert not cache.is_blocked("peer")
+        assert [cache.failure("peer") for _ in range(4)] == [1, 2, 4, 4]
+        assert cache.is_blocked("peer")
+
+        now[0] = 4
+        assert not cache.is_blocked("peer")
+        assert cache.failure("peer") == 4
+
+        # Forgotten once it has not failed for a while
+        now[0] = 20
+        assert cache.failure("peer") == 1
+
+        cache.success("peer")
+        assert not cache.is_blocked("peer")
+
+    def test_threshold(self) -> None:
+        now = [0.0]
+        cache: NegativeCache[str] = NegativeCache(
+            10, base_delay=1, max_delay=4, threshold=3, clock=lambda: now[0]
+        )
+
+        assert [cache.failure("info hash") for _ in range(2)] == [0, 0]
+        assert not cache.is_blocked("info hash")
+        assert [cache.failure("info hash") for _ in range(2)] == [1, 2]
+        assert cache.is_blocked("info hash")
+
+    def test_evicts_least_recently_failed(self) -> None:
+        cache: NegativeCache[str] = NegativeCache(2, base_delay=60, max_delay=60)
+        for key in ("a", "b", "c"):
+            cache.failure(key)
+
+        assert len(cache) == 2
+        assert not cache.is_blocked("a")
+        assert cache.is_blocked("c")
+
+
+class TestInfoHashFilter:
+    def setup_method(self) -> None:
+        self.stored = {os.urandom(20) for _ in range(10)}
+        self.lookups: List[bytes] = []
+
+        def lookup(info_hash: bytes) -> bool:
+            self.lookups.append(info_hash)
+            return info_hash in self.stored
+
+        self.filter = InfoHashFilter(
+            lookup=lookup, capacity=100, error_rate=0.001, cache_size=10
+        )
+        self.filter.seed(self.stored)
+
+    def test_unknown_info_hash_skips_lookup(self) -> None:
+        assert not self.filter.exists(os.urandom(20))
+        assert not self.lookups
+
+    def test_possible_positive_is_cached(self) -> None:
+        info_hash = next(iter(self.stored))
+        assert self.filter.exists(info_hash)
+        assert self.filter.exists(info_hash)
+        assert self.lookups == [info_hash]
+
+    def test_add(self) -> None:
+        info_hash = os.urandom(20)
+        self.filter.add(info_hash)
+        assert self.filter.exists(info_hash)
+        assert not self.lookups
+
+
+class TestSharedInfoHashClaims:
+    def test_claim(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+
+        assert claims.claim(info_hash)
+        # Claims of the same process can be renewed
+        assert claims.claim(info_hash)
+
+    def test_claimed_by_another_process(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if claims.claim(info_hash) else 1)
+        _, status = os.waitpid(pid, 0)
+
+        assert os.WEXITSTATUS(status) == 0
+        assert not claims.claim(info_hash)
+
+    def test_released_claim_can_be_taken_by_another_process(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+
+        pid = os.fork()
+        if pid == 0:
+            claims.claim(info_hash)
+            claims.release(info_hash)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert claims.claim(info_hash)
+
+    def test_done_is_never_claimed(self) -> None:
+        claims = SharedInfoHashClaims(slots=16, ttl=60, done_ttl=600)
+        info_hash = os.urandom(20)
+
+        pid = os.fork()
+        if pid == 0:
+            claims.claim(info_hash)
+            claims.done(info_hash)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert claims.is_done(info_hash)
+        assert not claims.claim(info_hash)
+        # Releasing only gives up claims of this process
+        claims.release(info_hash)
+        assert claims.is_done(info_hash)
@@ -0,0 +1,75 @@
+import asyncio
+
+from stilio.crawler.dht.discovery import DiscoveryEngine
+from stilio.crawler.dht.node import Node
+from stilio.crawler.dht.scheduling import QueryScheduler
+
+
+class FakeRPC:
+    def __init__(self):
+        self.node = Node(b"l" * 20, "0.0.0.0", 6881)
+        self.samples = []
+        self.get_peers_queries = []
+
+    def sample_infohashes(self, tid, nid, address) -> None:
+        self.samples.append(address)
+
+    def get_peers(self, tid, nid, info_hash, address) -> None:
+        self.get_peers_queries.append((tid, info_hash, address))
+
+
+class TestDiscoveryEngine:
+    def test_sample_respects_interval(self) -> None:
+        async def run():
+            rpc = FakeRPC()
+            engine = DiscoveryEngine(
+                [rpc], QueryScheduler(), is_wanted=lambda _: True, on_peer=print
+            )
+            nodes = [Node(b"n" * 20, "1.1.1.1", 6881), Node(b"m" * 20, "2.2.2.2", 1)]
+
+            engine.sample(nodes, interval=0.01)
+            await asyncio.sleep(0.05)
+            engine.on_samples(rpc, b"", 60, ("1.1.1.1", 6881))
+            engine.sample(nodes, interval=0.01)
+            await asyncio.sleep(0.05)
+            return rpc.samples
+
+        assert asyncio.run(run()) == [("1.1.1.1", 6881), ("2.2.2.2", 1)]
+
+    def test_lookup(self) -> None:
+        async def run():
+            rpc = FakeRPC()
+            found = []
+            engine = DiscoveryEngine(
+                [rpc],
+                QueryScheduler(),
+                is_wanted=lambda info_hash: info_hash != b"b" * 20,
+                on_peer=lambda info_hash, peer: found.append((info_hash, peer)),
+            )
+            sampler = ("1.1.1.1", 6881)
+            engine.on_samples(rpc, b"a" * 20 + b"b" * 20, 60, sampler)
+            assert [query[1:] for query in rpc.get_peers_queries] == [
+                (b"a" * 20, sampler)
+            ]
+
+            # The sampler only knows closer nodes, the closest one is queried first
+            tid = rpc.get_peers_queries[0][0]
+            nodes = [Node(b"z" * 20, "3.3.3.3", 1), Node(b"a" * 20, "2.2.2.2", 1)]
+            engine.on_get_peers_response(rpc, tid, [], nodes, sampler)
+            assert [query[2] for query in rpc.get_peers_queries[1:]] == [
+                ("2.2.2.2", 1),
+                ("3.3.3.3", 1),
+            ]
+
+            # A response to the same transaction id from another node is stale
+            tid = rpc.get_peers_queries[1][0]
+            engine.on_get_peers_response(rpc, tid, [("5.5.5.5", 1)], [], sampler)
+            assert found == []
+            engine.on_get_peers_response(
+                rpc, tid, [("4.4.4.4", 6881)], [], ("2.2.2.2", 1)
+            )
+            return found, engine.lookups
+
+        found, lookups = asyncio.run(run())
+        assert found == [(b"a" * 20, ("4.4.4.4", 6881))]
+        assert lookups == 0
@@ -0,0 +1,33 @@
+import pytest
+
+from stilio.persistence.exceptions import StoringError
+from stilio.persistence.utils import build_file_tree, get_file_structure
+
+
+class TestBuildFileTree:
+    def test_nested_directories(self) -> None:
+        paths = [["dir", "a"], ["dir", "sub", "b"], ["c"], ["dir", "sub", "d"]]
+
+        assert build_file_tree(paths) == {
+            "/": [{"dir": ["a", {"sub": ["b", "d"]}]}, "c"]
+        }
+
+    def test_files_with_the_same_name_are_kept(self) -> None:
+        assert build_file_tree([["a"], ["a"], ["a", "b"]]) == {"/": [{"a": ["b"]}, "a"]}
+
+    def test_single_file_torrent(self) -> None:
+        assert get_file_structure({b"name": b"file"}, "file") == {"/": ["file"]}
+
+    def test_many_files_in_one_directory(self) -> None:
+        paths = [["dir", str(i)] for i in range(100_000)]
+
+        tree = build_file_tree(paths)
+        assert isinstance(tree, dict)
+
+        assert len(tree["/"][0]["dir"]) == 100_000
+
+    def test_slashes_in_path_are_rejected(self) -> None:
+        metadata = {b"name": b"t", b"files": [{b"path": [b"a/b"], b"length": 1}]}
+
+        with pytest.raises(StoringError):
+            get_file_structure(metadata, "t")
@@ -0,0 +1,26 @@
+import datetime as dt
+
+from jinja2 import Environment, FileSystemLoader
+
+from stilio.persistence.torrents.models import Torrent
+
+templates = Environment(loader=FileSystemLoader("stilio/frontend/templates"))
+
+
+class TestDetails:
+    def test_file_listing(self) -> None:
+        torrent = Torrent(
+            info_hash="ab" * 20,
+            name="Some name",
+            files={"/": [{"dir": ["a.txt", "b.txt"]}, "c.txt"]},
+            file_count=3,
+            size=1024,
+            added_at=dt.datetime(2020, 1, 2, 3, 4, 5),
+        )
+
+        html = templates.get_template("details.html").render(torrent=torrent)
+
+        assert "Some name" in html
+        assert "3 files" in html
+        assert all(name in html for name in ("dir", "a.txt", "b.txt", "c.txt"))
+        assert html.index("dir") < html.index("a.txt") < html.index("c.txt")
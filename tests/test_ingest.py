@@ -0,0 +1,147 @@
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from stilio.crawler.bittorrent.bencoding import encode
+from stilio.persistence.ingest import IngestStage, build_torrent_row
+
+INFO_HASH = b"\x01" * 20
+
+
+def make_metadata(files: int) -> bytes:
+    return encode(
+        {
+            b"name": b"torrent",
+            b"files": [
+                {b"path": [b"dir", f"file{i}".encode()], b"length": 1}
+                for i in range(files)
+            ],
+        }
+    )
+
+
+class BrokenPool(ProcessPoolExecutor):
+    """A pool whose process died while building a row"""
+
+    def submit(self, *args, **kwargs):
+        future: Future = Future()
+        future.set_exception(BrokenProcessPool("A process was terminated"))
+        return future
+
+
+class BrokenOnSubmitPool(ProcessPoolExecutor):
+    """A pool already known to be broken when submitting"""
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A process was terminated")
+
+
+class TestBuildTorrentRow:
+    def test_builds_row(self) -> None:
+        row = build_torrent_row(INFO_HASH, make_metadata(3))
+        assert row is not None
+
+        assert row["info_hash"] == INFO_HASH.hex()
+        assert row["name"] == "torrent"
+        assert row["size"] == 3
+        assert row["file_count"] == 3
+
+    def test_nul_characters_are_replaced(self) -> None:
+        row = build_torrent_row(INFO_HASH, encode({b"name": b"a\x00b"}))
+        assert row is not None
+
+        assert row["name"] == "a\ufffdb"
+        assert "\\u0000" not in row["files"]
+
+    def test_long_names_are_truncated(self) -> None:
+        row = build_torrent_row(INFO_HASH, encode({b"name": b"a" * 1000}))
+        assert row is not None
+
+        assert row["name"] == "a" * 512
+
+    def test_size_out_of_range_returns_none(self) -> None:
+        metadata = encode(
+            {b"name": b"torrent", b"files": [{b"path": [b"a"], b"length": 1 << 63}]}
+        )
+        assert build_torrent_row(INFO_HASH, metadata) is None
+
+    def test_invalid_metadata_returns_none(self) -> None:
+        assert build_torrent_row(INFO_HASH, b"not bencoded") is None
+
+
+class TestIngestStage:
+    def test_rows_are_built_in_the_pool(self) -> None:
+        async def run():
+            rows = []
+            ingest = IngestStage(on_row=rows.append, workers=1, inline_size=0)
+            assert ingest.put(INFO_HASH, make_metadata(1000))
+            assert ingest.put(INFO_HASH, b"not bencoded")
+            await ingest.stop()
+            return rows
+
+        rows = asyncio.run(run())
+
+        assert len(rows) == 1
+        assert rows[0]["size"] == 1000
+
+    def test_small_metadata_is_built_inline(self) -> None:
+        async def run():
+            rows = []
+            ingest = IngestStage(on_row=rows.append, workers=1)
+            ingest.put(INFO_HASH, make_metadata(1))
+            assert ingest.in_flight == 0
+            result = list(rows)
+            await ingest.stop()
+            return result
+
+        assert len(asyncio.run(run())) == 1
+
+    def test_backpressure_and_drops(self) -> None:
+        async def run():
+            pressure = []
+            ingest = IngestStage(
+                workers=1, max_in_flight=1, max_queue_size=2, inline_size=0
+            )
+            ingest.on_backpressure = pressure.append
+            accepted = [ingest.put(INFO_HASH, make_metadata(10)) for _ in range(4)]
+            await ingest.stop()
+            return accepted, pressure, ingest.dropped
+
+        accepted, pressure, dropped = asyncio.run(run())
+
+        assert accepted == [True, True, True, False]
+        assert dropped == 1
+        assert pressure == [True, False]
+
+    def test_items_in_a_broken_pool_are_dropped(self) -> None:
+        other_hash = b"\x02" * 20
+
+        async def run():
+            rows, failed = [], []
+            ingest = IngestStage(
+                on_row=rows.append, workers=1, max_in_flight=1, inline_size=0
+            )
+            ingest.on_failed = failed.append
+            ingest._executor = BrokenPool()
+            ingest.put(INFO_HASH, make_metadata(1))
+            ingest.put(other_hash, make_metadata(2))
+            await ingest.stop()
+            return rows, failed
+
+        rows, failed = asyncio.run(run())
+
+        assert failed == [INFO_HASH]
+        assert [row["info_hash"] for row in rows] == [other_hash.hex()]
+
+    def test_queued_items_go_to_a_new_pool(self) -> None:
+        async def run():
+            rows = []
+            ingest = IngestStage(on_row=rows.append, workers=1, inline_size=0)
+            ingest._executor = BrokenOnSubmitPool()
+            ingest.put(INFO_HASH, make_metadata(1))
+            await ingest.stop()
+            return rows
+
+        rows = asyncio.run(run())
+
+        assert [row["info_hash"] for row in rows] == [INFO_HASH.hex()]
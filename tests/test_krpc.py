@@ -0,0 +1,100 @@
+from stilio.crawler.bittorrent.bencoding import encode
+from stilio.crawler.dht.krpc import KRPCError, parse, parse_fast
+
+
+class TestKRPC:
+    def test_parse_announce_peer(self) -> None:
+        data = encode(
+            {
+                b"y": b"q",
+                b"q": b"announce_peer",
+                b"t": b"ab",
+                b"v": b"UT\x01\x02",
+                b"a": {
+                    b"id": b"i" * 20,
+                    b"info_hash": b"h" * 20,
+                    b"port": 6881,
+                    b"implied_port": 1,
+                    b"token": b"tk",
+                    b"extra": [1, {b"x": b"y"}],
+                },
+            }
+        )
+        message = parse_fast(data)
+
+        assert message.y == b"q"
+        assert message.q == b"announce_peer"
+        assert message.t == b"ab"
+        assert message.id == b"i" * 20
+        assert message.info_hash == b"h" * 20
+        assert message.port == 6881
+        assert message.implied_port == 1
+        assert message.token == b"tk"
+
+    def test_parse_find_node_response(self) -> None:
+        nodes = b"n" * 26 * 8
+        data = encode(
+            {b"y": b"r", b"t": b"aa", b"r": {b"id": b"i" * 20, b"nodes": nodes}}
+        )
+        message = parse(memoryview(data))
+
+        assert message is not None
+        assert message.nodes == nodes
+        assert message.q is None
+
+    def test_parse_discovery_responses(self) -> None:
+        samples = b"s" * 20 * 3
+        data = encode(
+            {
+                b"y": b"r",
+                b"t": b"si\x00\x01",
+                b"r": {
+                    b"id": b"i" * 20,
+                    b"interval": 21600,
+                    b"num": 50,
+                    b"nodes": b"n" * 26,
+                    b"samples": samples,
+                },
+            }
+        )
+        message = parse_fast(data)
+
+        assert message.samples == samples
+        assert message.interval == 21600
+        assert message.num == 50
+
+        values = [b"p" * 6, b"q" * 6]
+        data = encode(
+            {
+                b"y": b"r",
+                b"t": b"gp\x00\x01",
+                b"r": {b"id": b"i" * 20, b"token": b"tk", b"values": values},
+            }
+        )
+        assert parse_fast(data).values == values
+
+        # Values that are not strings go through the generic decoder
+        data = encode(
+            {b"y": b"r", b"t": b"aa", b"r": {b"values": [b"p" * 6, 1, b"q" * 6]}}
+        )
+        fallback = parse(data)
+        assert fallback is not None
+        assert fallback.values == values
+
+    def test_unusual_messages_fall_back(self) -> None:
+        data = encode({b"y": b"q", b"t": b"aa", b"a": [b"not", b"a", b"dict"]})
+        try:
+            parse_fast(data)
+        except KRPCError:
+            pass
+        else:
+            raise AssertionError("Fast path accepted an unusual message")
+
+        message = parse(data)
+        assert message is not None
+        assert message.y == b"q"
+
+    def test_invalid_messages(self) -> None:
+        assert parse(b"d1:y1:q") is None
+        assert parse(b"i42e") is None
+        assert parse(b"d1:y99:qe") is None
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+from stilio.crawler import loops
+
+
+class TestLoops:
+    def test_resolve(self) -> None:
+        assert loops.resolve(loops.LOOP_ASYNCIO) == loops.LOOP_ASYNCIO
+        assert loops.resolve(loops.LOOP_AUTO) in loops.available()
+        with pytest.raises(ValueError):
+            loops.resolve("trio")
+
+    def test_new_event_loop(self) -> None:
+        loop = loops.new_event_loop(loops.LOOP_ASYNCIO)
+        try:
+            assert isinstance(loop, asyncio.AbstractEventLoop)
+            assert loop.run_until_complete(asyncio.sleep(0, result=1)) == 1
+        finally:
+            loop.close()
+
+    def test_missing_uvloop_falls_back_to_asyncio(self, monkeypatch, caplog) -> None:
+        monkeypatch.setattr(loops, "available", lambda: [loops.LOOP_ASYNCIO])
+        assert loops.resolve(loops.LOOP_UVLOOP) == loops.LOOP_ASYNCIO
+        assert "not installed" in caplog.text
@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import math
+from typing import List, Tuple
+from unittest import mock
+
+import pytest
+
+from stilio.crawler.bittorrent import metadata
+from stilio.crawler.bittorrent.bencoding import decode, encode
+from stilio.crawler.bittorrent.exceptions import MetadataConflict
+from stilio.crawler.bittorrent.metadata import (
+    MetadataAssembler,
+    MetadataFetcher,
+    MetadataWorker,
+)
+
+
+class TestMetadataFetcher:
+    def test_global_budget_and_priority(self, monkeypatch) -> None:
+        started = []
+
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            started.append((info_hash, peer_address))
+            await asyncio.sleep(0.01)
+            return None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            fetcher = MetadataFetcher(max_connections=1, max_workers_per_info_hash=1)
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            # Only one connection is allowed, the rest wait by popularity
+            fetcher.fetch(b"b" * 20, ("2.2.2.2", 1))
+            fetcher.fetch(b"c" * 20, ("3.3.3.3", 1))
+            fetcher.fetch(b"c" * 20, ("3.3.3.4", 1))
+            fetcher.fetch(b"c" * 20, ("3.3.3.4", 1))
+            assert fetcher.active == 1
+            await asyncio.sleep(0.1)
+            return fetcher
+
+        fetcher = asyncio.run(run())
+        assert [info_hash[:1] for info_hash, _ in started] == [b"a", b"c", b"c", b"b"]
+        assert fetcher.active == 0
+        assert fetcher.candidates == 0
+
+    def test_failed_worker_is_replaced(self, monkeypatch) -> None:
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            await asyncio.sleep(0.01)
+            return b"metadata" if peer_address[0] == "2.2.2.2" else None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            results = []
+            fetcher = MetadataFetcher(
+                on_metadata_result=lambda *result: results.append(result),
+                max_workers_per_info_hash=1,
+            )
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            fetcher.fetch(b"a" * 20, ("2.2.2.2", 1))
+            fetcher.fetch(b"a" * 20, ("3.3.3.3", 1))
+            await asyncio.sleep(0.1)
+            return results, fetcher
+
+        results, fetcher = asyncio.run(run())
+        assert results == [(b"a" * 20, b"metadata")]
+        assert fetcher.candidates == 0
+
+    def test_announcers_are_capped(self) -> None:
+        async def run():
+            fetcher = MetadataFetcher(
+                max_peers_per_info_hash=2, max_announcers_per_info_hash=4
+            )
+            fetcher.pause()
+            for i in range(100):
+                fetcher.fetch(b"a" * 20, (f"1.1.1.{i}", 1))
+            return fetcher
+
+        fetcher = asyncio.run(run())
+        candidate = fetcher._candidates[b"a" * 20]
+        assert len(candidate.announced_by) == 4
+        assert len(candidate.peers) == 2
+        assert candidate.priority == 100
+        # Queued again only when its priority doubled
+        assert [-priority for priority, _, _ in sorted(fetcher._queue)] == [
+            64,
+            32,
+            16,
+            8,
+            4,
+            2,
+            1,
+        ]
+
+    def test_candidates_expire_on_a_timer(self, monkeypatch) -> None:
+        failed: List[bytes] = []
+
+        async def run():
+            fetcher = MetadataFetcher(candidate_ttl=0.05)
+            fetcher.on_fetch_failed = failed.append
+            fetcher.pause()
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            await asyncio.sleep(0.1)
+            return fetcher
+
+        fetcher = asyncio.run(run())
+        assert fetcher.candidates == 0
+        assert failed == [b"a" * 20]
+
+    def test_paused_fetcher_queues_announces(self, monkeypatch) -> None:
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            await asyncio.sleep(0.01)
+            return None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            fetcher = MetadataFetcher()
+            fetcher.pause()
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            assert (fetcher.active, fetcher.candidates) == (0, 1)
+            fetcher.pause(False)
+            assert fetcher.active == 1
+
+        asyncio.run(run())
+
+    def test_failing_peers_and_info_hashes_back_off(self, monkeypatch) -> None:
+        started = []
+
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            started.append(peer_address)
+            return None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            fetcher = MetadataFetcher(backoff_min_peers=1)
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            await asyncio.sleep(0.01)
+            # Both the peer and the info hash failed
+            fetcher.fetch(b"b" * 20, ("1.1.1.1", 1))
+            fetcher.fetch(b"a" * 20, ("2.2.2.2", 1))
+            fetcher.fetch(b"b" * 20, ("2.2.2.2", 1))
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert started == [("1.1.1.1", 1), ("2.2.2.2", 1)]
+
+    def test_info_hashes_back_off_after_several_peers(self, monkeypatch) -> None:
+        started = []
+
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            started.append(peer_address[0])
+            return None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            fetcher = MetadataFetcher(backoff_min_peers=2)
+            for address in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+                fetcher.fetch(b"a" * 20, (address, 1))
+                await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        # A single failed peer does not block the announces of the others
+        assert started == ["1.1.1.1", "2.2.2.2"]
+
+    def test_conflicts_do_not_back_off_peers(self, monkeypatch) -> None:
+        started = []
+
+        async def fetch_metadata(info_hash, peer_address, max_metadata_size, assembler):
+            started.append((info_hash[:1], peer_address))
+            if info_hash == b"a" * 20:
+                raise MetadataConflict("Metadata size 2 != 1")
+            return None
+
+        monkeypatch.setattr(metadata, "fetch_metadata", fetch_metadata)
+
+        async def run():
+            fetcher = MetadataFetcher()
+            fetcher.fetch(b"a" * 20, ("1.1.1.1", 1))
+            await asyncio.sleep(0.01)
+            fetcher.fetch(b"b" * 20, ("1.1.1.1", 1))
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert started == [(b"a", ("1.1.1.1", 1)), (b"b", ("1.1.1.1", 1))]
+
+
+class FakePeer:
+    """Serves the metadata over the peer wire, splitting every piece in chunks so
+    it arrives in several reads
+    """
+
+    def __init__(self, info: bytes):
+        self.info = info
+        self.requested: List[int] = []
+
+    async def handle(self, reader, writer) -> None:
+        def write_message(message: bytes) -> None:
+            writer.write(len(message).to_bytes(4, "big") + message)
+
+        try:
+            handshake = await reader.readexactly(68)
+            writer.write(handshake[:25] + b"\x10" + handshake[26:48] + b"p" * 20)
+            write_message(b"\x00\x00\x00\x00\x01")  # Not interested
+            write_message(
+                bytes([20, 0])
+                + encode({b"m": {b"ut_metadata": 3}, b"metadata_size": len(self.info)})
+            )
+
+            while True:
+                length = int.from_bytes(await reader.readexactly(4), "big")
+                message = await reader.readexactly(length)
+                if message[:2] != bytes([20, 3]):
+                    continue
+
+                piece = decode(message[2:])[b"piece"]
+                self.requested.append(piece)
+                data = encode({b"msg_type": 1, b"piece": piece})
+                data += self.info[piece * 16384 : (piece + 1) * 16384]
+                message = (len(data) + 2).to_bytes(4, "big") + bytes([20, 1]) + data
+                for i in range(0, len(message), 5000):
+                    writer.write(message[i : i + 5000])
+                    await writer.drain()
+                    await asyncio.sleep(0.001)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def start(self) -> Tuple[str, int]:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()
+
+
+class TestMetadataWorker:
+    def test_fetch_metadata_from_peer(self) -> None:
+        info = encode({b"name": b"x" * 40_000, b"piece length": 16384})
+        info_hash = hashlib.sha1(info).digest()
+
+        async def run():
+            peer = FakePeer(info)
+            address = await peer.start()
+            worker = MetadataWorker(info_hash, address, buffer_size=64)
+            return await asyncio.wait_for(worker.work(), timeout=5)
+
+        assert asyncio.run(run()) == info
+
+    def test_peers_share_the_pieces(self) -> None:
+        info = encode({b"name": b"x" * 200_000, b"piece length": 16384})
+        info_hash = hashlib.sha1(info).digest()
+
+        async def run():
+            peers = [FakePeer(info), FakePeer(info)]
+            assembler = MetadataAssembler(info_hash)
+            workers = [
+                MetadataWorker(info_hash, await peer.start(), assembler=assembler)
+                for peer in peers
+            ]
+            done, pending = await asyncio.wait(
+                [asyncio.ensure_future(worker.work()) for worker in workers],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in pending:
+                task.cancel()
+            return [task.result() for task in done], peers, assembler
+
+        results, peers, assembler = asyncio.run(run())
+        assert results == [info]
+        assert all(peer.requested for peer in peers)
+        # Every piece is requested once until the last ones are requested twice
+        pieces = math.ceil(len(info) / 16384)
+        requested = peers[0].requested + peers[1].requested
+        assert set(requested) == set(range(pieces))
+        assert len(requested) < pieces + 2 * 4
+        # Freed once both workers stopped
+        assert assembler.size == 0 and len(assembler.buffer) == 0
+
+
+class TestMetadataAssembler:
+    def test_claims(self) -> None:
+        info = b"x" * (16384 * 2 + 1)
+        assembler = MetadataAssembler(hashlib.sha1(info).digest())
+        assembler.allocate(len(info))
+
+        assert [assembler.claim("a"), assembler.claim("b")] == [0, 1]
+        assert assembler.claim("a") == 2
+        # Every piece is claimed, "b" also requests the ones it does not have
+        assert assembler.claim("b") in (0, 2)
+        assembler.release("a")
+        assert assembler.claim("c") is not None
+
+    def test_size_conflict_drops_the_allocation(self) -> None:
+        info = b"x" * (16384 * 2 + 1)
+        assembler = MetadataAssembler(hashlib.sha1(info).digest())
+        worker = mock.Mock()
+        assembler.allocate(len(info), worker)
+        assembler.claim(worker)
+
+        with pytest.raises(MetadataConflict):
+            assembler.allocate(len(info) + 1, mock.Mock())
+        assert isinstance(worker.abort.call_args[0][0], MetadataConflict)
+        assert assembler.size == 0 and len(assembler.buffer) == 0
+
+        # The next peer starts over with its own size
+        assembler.allocate(len(info) + 1)
+        assert assembler.size == len(info) + 1
+        assert assembler.claim("a") == 0
+
+    def test_buffer_is_freed_without_workers(self) -> None:
+        info = b"x" * (16384 + 1)
+        assembler = MetadataAssembler(hashlib.sha1(info).digest())
+        first, second = mock.sentinel.first, mock.sentinel.second
+        assembler.allocate(len(info), first)
+        assembler.allocate(len(info), second)
+        assembler.release(first)
+        assert len(assembler.buffer) == len(info)
+        assembler.release(second)
+        assert assembler.size == 0 and len(assembler.buffer) == 0
+
+    def test_verification(self) -> None:
+        info = b"x" * (16384 + 1)
+        assembler = MetadataAssembler(hashlib.sha1(info).digest())
+        assembler.allocate(len(info))
+        assembler.view[:] = b"y" * len(info)
+
+        assert assembler.add(0) is None
+        with pytest.raises(MetadataConflict):
+            assembler.add(1)
+        assert assembler.size == 0
+
+        # Starts over after a mismatch
+        assembler.allocate(len(info))
+        assembler.view[:] = info
+        assert assembler.claim("a") == 0
+        assert assembler.add(0) is None
+        assert assembler.add(1) == info
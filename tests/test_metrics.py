@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from stilio import metrics
+
+
+class TestMetrics:
+    def test_counter(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter("requests", "Requests", registry=registry)
+        counter.inc()
+        counter.inc(2)
+        assert registry.render() == (
+            "# HELP requests Requests\n# TYPE requests counter\nrequests_total 3\n"
+        )
+
+    def test_labelled_counter(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter(
+            "datagrams", "Datagrams", ["direction"], registry=registry
+        )
+        received = counter.labels("in")
+        received.inc()
+        received.inc()
+        counter.labels("out").inc()
+
+        assert counter.labels("in") is received
+        assert 'datagrams_total{direction="in"} 2' in registry.render()
+        assert 'datagrams_total{direction="out"} 1' in registry.render()
+        with pytest.raises(ValueError):
+            counter.labels("in", "extra")
+
+    def test_gauge(self):
+        registry = metrics.Registry()
+        gauge = metrics.Gauge("depth", "Depth", registry=registry)
+        gauge.inc(5)
+        gauge.dec()
+        assert "depth 4" in registry.render()
+
+        gauge.set_function(lambda: 0.5)
+        assert "depth 0.5" in registry.render()
+
+    def test_histogram(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram(
+            "latency", "Latency", buckets=(0.1, 1), registry=registry
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        rendered = registry.render()
+        assert 'latency_bucket{le="0.1"} 1' in rendered
+        assert 'latency_bucket{le="1"} 2' in rendered
+        assert 'latency_bucket{le="+Inf"} 3' in rendered
+        assert "latency_sum 5.55" in rendered
+        assert "latency_count 3" in rendered
+
+    def test_duplicated_name(self):
+        registry = metrics.Registry()
+        metrics.Counter("requests", "Requests", registry=registry)
+        with pytest.raises(ValueError):
+            metrics.Counter("requests", "Requests", registry=registry)
+
+    def test_http_server(self):
+        registry = metrics.Registry()
+        metrics.Counter("requests", "Requests", registry=registry).inc()
+
+        async def scrape(path: bytes) -> bytes:
+            server = await metrics.start_http_server("127.0.0.1", 0, registry)
+            assert isinstance(server, asyncio.Server)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.new_event_loop().run_until_complete(scrape(b"/metrics"))
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert response.endswith(b"requests_total 1\n")
+
+        response = asyncio.new_event_loop().run_until_complete(scrape(b"/"))
+        assert response.startswith(b"HTTP/1.1 404")
@@ -0,0 +1,14 @@
+from stilio.persistence.torrents.models import Torrent, dumps_files
+
+
+class TestTorrent:
+    def test_listing_fields_skip_the_file_listing(self) -> None:
+        names = [field.name for field in Torrent.listing_fields()]
+
+        assert "files" not in names
+        assert "search_name" not in names
+        assert "file_count" in names
+
+    def test_serialized_files_are_stored_as_is(self) -> None:
+        assert dumps_files('{"/": ["a"]}') == '{"/": ["a"]}'
+        assert dumps_files({"/": ["á"]}) == '{"/": ["á"]}'
@@ -0,0 +1,72 @@
+import asyncio
+
+from stilio.crawler.dht.pacing import DROP_NEWEST, OutboundPacer, TokenBucket
+from stilio.crawler.dht.scheduling import QueryScheduler
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def is_closing(self) -> bool:
+        return False
+
+    def sendto(self, data, address) -> None:
+        self.sent.append(data)
+
+
+class TestTokenBucket:
+    def test_consume_and_delay(self) -> None:
+        bucket = TokenBucket(rate=10, capacity=2)
+        assert bucket.has(2)
+        bucket.consume(2)
+        assert not bucket.has(1)
+        assert 0 < bucket.delay(1) <= 0.1
+
+
+class TestOutboundPacer:
+    def test_paces_packets(self) -> None:
+        async def run():
+            transport = FakeTransport()
+            pacer = OutboundPacer(packets_per_second=100, burst=0.01)
+            for i in range(5):
+                pacer.send(transport, bytes([i]), ("1.1.1.1", 1))
+            sent_at_once = len(transport.sent)
+            await asyncio.sleep(0.1)
+            return sent_at_once, transport.sent, pacer
+
+        sent_at_once, sent, pacer = asyncio.run(run())
+        assert sent_at_once == 1
+        assert sent == [bytes([i]) for i in range(5)]
+        assert pacer.sent == 5 and pacer.queue_size == 0
+
+    def test_drop_policy(self) -> None:
+        async def run(drop_policy):
+            transport = FakeTransport()
+            pacer = OutboundPacer(
+                packets_per_second=1, max_queue_size=2, drop_policy=drop_policy
+            )
+            for i in range(4):
+                pacer.send(transport, bytes([i]), ("1.1.1.1", 1))
+            return [data for _, data, _ in pacer._queue], pacer.dropped
+
+        assert asyncio.run(run("oldest")) == ([b"\x02", b"\x03"], 1)
+        assert asyncio.run(run(DROP_NEWEST)) == ([b"\x01", b"\x02"], 1)
+
+
+class TestQueryScheduler:
+    def test_spread(self) -> None:
+        async def run():
+            loop = asyncio.get_event_loop()
+            scheduler = QueryScheduler(slot=0.001)
+            calls = []
+            scheduler.spread(
+                lambda i: calls.append((i, loop.time())), [(0,), (1,), (2,), (3,)], 0.2
+            )
+            await asyncio.sleep(0.3)
+            return calls, len(scheduler)
+
+        calls, pending = asyncio.run(run())
+        assert [i for i, _ in calls] == [0, 1, 2, 3]
+        assert calls[-1][1] - calls[0][1] >= 0.14
+        assert pending == 0
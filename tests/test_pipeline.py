@@ -0,0 +1,104 @@
+import asyncio
+
+from peewee import DataError, OperationalError
+
+from stilio.persistence import utils as db_utils
+from stilio.persistence.pipeline import TorrentPipeline
+
+
+class TestTorrentPipeline:
+    def test_rows_are_stored_in_batches(self, monkeypatch) -> None:
+        batches = []
+
+        def store_torrent_rows(rows):
+            batches.append(rows)
+            return [row["info_hash"] for row in rows]
+
+        monkeypatch.setattr(db_utils, "store_torrent_rows", store_torrent_rows)
+
+        async def run():
+            stored = []
+            pipeline = TorrentPipeline(
+                on_stored=stored.extend, batch_size=2, flush_interval=10
+            )
+            pipeline.start()
+            for i in range(5):
+                pipeline.put({"info_hash": str(i)})
+            await asyncio.sleep(0.1)
+            await pipeline.stop()
+            return stored
+
+        stored = asyncio.run(run())
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert [row["info_hash"] for row in stored] == ["0", "1", "2", "3", "4"]
+
+    def test_put_drops_when_queue_is_full(self) -> None:
+        async def run():
+            pipeline = TorrentPipeline(max_queue_size=1)
+            return pipeline.put({"info_hash": "0"}), pipeline.put({"info_hash": "1"})
+
+        assert asyncio.run(run()) == (True, False)
+
+    def test_rows_rejected_by_the_database_are_skipped(self, monkeypatch) -> None:
+        statements = []
+
+        def store_torrent_rows(rows):
+            statements.append(len(rows))
+            if any(row["info_hash"] == "bad" for row in rows):
+                raise DataError("value too long")
+            return [row["info_hash"] for row in rows]
+
+        monkeypatch.setattr(db_utils, "store_torrent_rows", store_torrent_rows)
+
+        async def run():
+            stored, failed = [], []
+            pipeline = TorrentPipeline(
+                on_stored=stored.extend,
+                on_failed=failed.extend,
+                batch_size=8,
+                flush_interval=10,
+            )
+            pipeline.start()
+            for info_hash in ["0", "1", "2", "bad", "4", "5", "6", "7"]:
+                pipeline.put({"info_hash": info_hash})
+            await pipeline.stop()
+            return stored, failed
+
+        stored, failed = asyncio.run(run())
+
+        assert "".join(row["info_hash"] for row in stored) == "0124567"
+        assert failed == [{"info_hash": "bad"}]
+        # The batch is split in halves until the bad row is alone
+        assert statements == [8, 4, 2, 2, 1, 1, 4]
+
+    def test_batches_are_retried_while_the_database_is_down(self, monkeypatch) -> None:
+        attempts = []
+
+        def store_torrent_rows(rows):
+            attempts.append(len(rows))
+            if len(attempts) < 3:
+                raise OperationalError("server closed the connection unexpectedly")
+            return [row["info_hash"] for row in rows]
+
+        monkeypatch.setattr(db_utils, "store_torrent_rows", store_torrent_rows)
+
+        async def run(max_retries):
+            stored, failed = [], []
+            pipeline = TorrentPipeline(
+                on_stored=stored.extend,
+                on_failed=failed.extend,
+                max_retries=max_retries,
+                retry_delay=0.01,
+            )
+            pipeline.start()
+            pipeline.put({"info_hash": "0"})
+            await pipeline.stop()
+            return stored, failed
+
+        assert asyncio.run(run(max_retries=2)) == ([{"info_hash": "0"}], [])
+        assert attempts == [1, 1, 1]
+
+        attempts.clear()
+        assert asyncio.run(run(max_retries=1)) == ([], [{"info_hash": "0"}])
+        assert attempts == [1, 1]
@@ -0,0 +1,66 @@
+import asyncio
+
+from stilio.crawler.popularity import PopularityAggregator
+from stilio.persistence import utils as db_utils
+
+INFO_HASH = b"\x01" * 20
+
+
+def ip(i: int) -> str:
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+
+class TestPopularityAggregator:
+    def test_counts_distinct_peers(self) -> None:
+        async def run():
+            aggregator = PopularityAggregator()
+            for i in range(3):
+                for _ in range(5):
+                    aggregator.on_announce(INFO_HASH, ip(i))
+            for i in range(5_000):
+                aggregator.on_get_peers(INFO_HASH, ip(i))
+            return aggregator.counts(INFO_HASH)
+
+        seeders, leechers = asyncio.run(run())
+
+        assert seeders == 3
+        assert 3_500 < leechers < 6_500
+
+    def test_old_generations_are_dropped(self) -> None:
+        async def run():
+            aggregator = PopularityAggregator(generations=2, scale=2)
+            aggregator.on_announce(INFO_HASH, ip(1))
+            aggregator.rotate()
+            aggregator.on_announce(INFO_HASH, ip(2))
+            counts = [aggregator.counts(INFO_HASH)]
+            aggregator.rotate()
+            counts.append(aggregator.counts(INFO_HASH))
+            return counts
+
+        assert asyncio.run(run()) == [(4, 0), (2, 0)]
+
+    def test_flush_updates_the_info_hashes_with_new_peers(self, monkeypatch) -> None:
+        updates = []
+
+        def update_peer_counts(rows):
+            updates.append(sorted(rows))
+            return len(rows)
+
+        monkeypatch.setattr(db_utils, "update_peer_counts", update_peer_counts)
+
+        async def run():
+            aggregator = PopularityAggregator(max_info_hashes=2)
+            aggregator.on_announce(b"\x01" * 20, ip(1))
+            aggregator.on_get_peers(b"\x02" * 20, ip(1))
+            aggregator.on_announce(b"\x03" * 20, ip(1))
+            await aggregator.flush()
+            await aggregator.flush()
+            aggregator.on_announce(b"\x02" * 20, ip(2))
+            await aggregator.stop()
+
+        asyncio.run(run())
+
+        assert updates == [
+            [("01" * 20, 1, 0), ("02" * 20, 0, 1)],
+            [("02" * 20, 1, 1)],
+        ]
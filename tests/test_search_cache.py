@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import datetime as dt
+import threading
+
+from stilio.frontend import cache
+from stilio.frontend.cache import (
+    MemoryBackend,
+    RedisBackend,
+    SearchCache,
+    dump_page,
+    load_page,
+    normalize_query,
+)
+from stilio.persistence.torrents.models import Torrent
+
+request_id: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_id", default=0
+)
+
+
+def torrent(name: str) -> Torrent:
+    return Torrent(
+        id=1,
+        info_hash="ab" * 20,
+        name=name,
+        file_count=2,
+        size=1024,
+        added_at=dt.datetime(2020, 1, 2, 3, 4, 5),
+    )
+
+
+async def redis_stand_in(store: dict) -> asyncio.AbstractServer:
+    """Answers the GET and SET commands of the client, ignoring expirations"""
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            args = []
+            for _ in range(int(line[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            if args[0] == b"SET":
+                store[args[1]] = args[2]
+                writer.write(b"+OK\r\n")
+            elif args[1] in store:
+                value = store[args[1]]
+                writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            else:
+                writer.write(b"$-1\r\n")
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+class TestMemoryBackend:
+    def test_entries_expire(self) -> None:
+        now = [0.0]
+        backend = MemoryBackend(clock=lambda: now[0])
+
+        async def run():
+            await backend.set("key", b"value", 10)
+            now[0] = 9
+            before = await backend.get("key")
+            now[0] = 10
+            return before, await backend.get("key")
+
+        assert asyncio.run(run()) == (b"value", None)
+        assert len(backend) == 0
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        backend = MemoryBackend(max_entries=2)
+
+        async def run():
+            await backend.set("a", b"a", 10)
+            await backend.set("b", b"b", 10)
+            await backend.get("a")
+            await backend.set("c", b"c", 10)
+            return [await backend.get(key) for key in "abc"]
+
+        assert asyncio.run(run()) == [b"a", None, b"c"]
+
+
+class TestRedisBackend:
+    def test_get_and_set(self) -> None:
+        store: dict = {}
+
+        async def run():
+            server = await redis_stand_in(store)
+            backend = RedisBackend(port=server.sockets[0].getsockname()[1])
+            missing = await backend.get("key")
+            await backend.set("key", b"value\r\n", 10)
+            value = await backend.get("key")
+            await backend.close()
+            server.close()
+            return missing, value
+
+        assert asyncio.run(run()) == (None, b"value\r\n")
+        assert list(store) == [b"stilio:search:key"]
+
+    def test_server_down_is_a_miss(self) -> None:
+        async def run():
+            server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            server.close()
+            await server.wait_closed()
+            backend = RedisBackend(port=port)
+            await backend.set("key", b"value", 10)
+            return await backend.get("key")
+
+        assert asyncio.run(run()) is None
+
+
+class TestSearchCache:
+    def test_normalize_query(self) -> None:
+        assert normalize_query("  Big   Buck\tBunny ") == "big buck bunny"
+
+    def test_page_round_trip(self) -> None:
+        torrents, count = load_page(dump_page(([torrent("Some name")], 42)))
+        assert count == 42
+        assert torrents[0].name == "Some name"
+        assert torrents[0].added_at == dt.datetime(2020, 1, 2, 3, 4, 5)
+        assert torrents[0].info_hash == "ab" * 20
+
+    def test_pages_are_cached_by_normalized_query(self) -> None:
+        loads = []
+
+        def load(query, page):
+            loads.append((query, page))
+            return [torrent(query)], 1
+
+        search_cache = SearchCache(MemoryBackend(), load, ttl=10)
+
+        async def run():
+            first = await search_cache.search("Big Buck", 1)
+            second = await search_cache.search("big  buck ", 1)
+            await search_cache.search("big buck", 2)
+            return first, second
+
+        hits = cache.HITS.value
+        first, second = asyncio.run(run())
+        assert loads == [("big buck", 1), ("big buck", 2)]
+        assert first[0][0].name == second[0][0].name == "big buck"
+        assert cache.HITS.value == hits + 1
+
+    def test_concurrent_misses_share_the_query(self) -> None:
+        release = threading.Event()
+        loads = []
+
+        def load(query, page):
+            loads.append(query)
+            release.wait(5)
+            return [torrent(query)], 1
+
+        search_cache = SearchCache(MemoryBackend(), load, ttl=10)
+
+        async def run():
+            searches = [
+                asyncio.ensure_future(search_cache.search("query", 1)) for _ in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*searches)
+
+        shared = cache.SHARED.value
+        results = asyncio.run(run())
+        assert loads == ["query"]
+        assert [count for _, count in results] == [1, 1, 1]
+        assert cache.SHARED.value == shared + 2
+        assert not search_cache._in_flight
+
+    def test_query_does_not_run_in_the_request_context(self) -> None:
+        contexts = []
+
+        def load(query, page):
+            contexts.append(request_id.get())
+            return [torrent(query)], 1
+
+        search_cache = SearchCache(MemoryBackend(), load, ttl=10)
+
+        async def run():
+            request_id.set(1)
+            await search_cache.search("query", 1)
+
+        asyncio.run(run())
+        assert contexts == [0]
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+from stilio.crawler.dedup import ScalableBloomFilter
+from stilio.crawler.dht.crawling import CrawlingService
+from stilio.crawler.dht.node import Node
+from stilio.crawler.snapshot import CrawlerSnapshot
+
+
+class TestCrawlerSnapshot:
+    def test_save_and_load(self, tmp_path) -> None:
+        bloom_filter = ScalableBloomFilter(initial_capacity=100, error_rate=0.001)
+        keys = [os.urandom(20) for _ in range(300)]
+        for key in keys:
+            bloom_filter.add(key)
+        nodes = [Node.create_random("1.2.3.4", 6881), Node.create_random("::1", 1)]
+        nids = [os.urandom(20)]
+        path = str(tmp_path / "crawler-0.snapshot")
+
+        CrawlerSnapshot(123.0, 4321, nids, nodes, bloom_filter.filters).save(path)
+        snapshot = CrawlerSnapshot.load(path)
+        assert snapshot is not None
+
+        assert snapshot.seeded_at == 123.0
+        assert snapshot.max_neighbors == 4321
+        assert snapshot.nids == nids
+        # Only IPv4 nodes fit in the compact format
+        assert snapshot.nodes == nodes[:1]
+
+        restored = ScalableBloomFilter(initial_capacity=100, error_rate=0.001)
+        restored.restore(snapshot.filters)
+        assert all(key in restored for key in keys)
+        assert len(restored) == len(bloom_filter)
+
+        # The mapping is copy on write, adding keys does not touch the file
+        with open(path, "rb") as f:
+            content = f.read()
+        for _ in range(100):
+            restored.add(os.urandom(20))
+        with open(path, "rb") as f:
+            assert f.read() == content
+
+    def test_missing_or_corrupted_snapshot(self, tmp_path) -> None:
+        path = str(tmp_path / "crawler-0.snapshot")
+        assert CrawlerSnapshot.load(path) is None
+
+        CrawlerSnapshot(0.0, 1, [], [], []).save(path)
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\xff")
+        assert CrawlerSnapshot.load(path) is None
+
+
+class TestWarmRestart:
+    def test_crawler_state_is_restored(self, tmp_path) -> None:
+        path = str(tmp_path / "crawler-0.snapshot")
+        info_hash = os.urandom(20)
+
+        async def run():
+            crawler = CrawlingService(metrics_port=None, snapshot_path=path)
+            crawler.routing_table.max_size = 1234
+            crawler.on_find_node([Node.create_random("1.2.3.4", 6881)])
+            crawler.seen_info_hashes.add(info_hash)
+            crawler._seeded_at = 100.0
+            crawler._save_snapshot()
+
+            restarted = CrawlingService(metrics_port=None, snapshot_path=path)
+            return crawler, restarted
+
+        crawler, restarted = asyncio.run(run())
+
+        assert [node.nid for node in restarted.nodes] == [
+            node.nid for node in crawler.nodes
+        ]
+        assert restarted.routing_table.max_size == 1234
+        assert restarted.routing_table.nodes == crawler.routing_table.nodes
+        assert info_hash in restarted.seen_info_hashes.bloom_filter
+        assert restarted._seeded_at == 100.0
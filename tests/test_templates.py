@@ -0,0 +1,37 @@
+import os
+
+from stilio.crawler.bittorrent.bencoding import encode
+from stilio.crawler.dht.templates import MessageTemplates, RandomIdPool
+
+
+def get_peers_response(tid: bytes, nid: bytes, token: bytes) -> dict:
+    return {
+        b"y": b"r",
+        b"t": tid,
+        b"r": {b"id": nid, b"nodes": b"", b"token": token},
+    }
+
+
+class TestMessageTemplates:
+    def test_render_matches_encode(self) -> None:
+        templates = MessageTemplates(get_peers_response)
+        for tid in [b"a", b"aa", b"e1", os.urandom(4), os.urandom(12), b"r" * 10]:
+            nid, token = os.urandom(20), os.urandom(2)
+            assert templates.render(tid=tid, nid=nid, token=token) == encode(
+                get_peers_response(tid, nid, token)
+            )
+
+    def test_empty_fields_are_encoded(self) -> None:
+        templates = MessageTemplates(get_peers_response)
+        nid = os.urandom(20)
+        assert templates.render(tid=b"", nid=nid, token=b"tk") == encode(
+            get_peers_response(b"", nid, b"tk")
+        )
+
+
+class TestRandomIdPool:
+    def test_next(self) -> None:
+        pool = RandomIdPool(size=2)
+        ids = [pool.next() for _ in range(5)]
+        assert all(len(nid) == 20 for nid in ids)
+        assert len(set(ids)) == 5
@@ -1,20 +1,58 @@
 from stilio.crawler.dht.node import Node
-from stilio.crawler.dht.utils import decode_nodes, generate_neighbor_nid
+from stilio.crawler.dht.utils import (
+    decode_valid_nodes,
+    decode_valid_peers,
+    generate_neighbor_nid,
+    is_reserved_ip,
+)
 
 
 class TestUtilsBittorrent:
-    def test_decode_nodes_success(self) -> None:
-        encoded_nodes = (
-            b"}\xe9P\x1d\x9ek\n\xfa\xfe\xc3 jc\xfa3\x1frtG\xb3:\xe06\x9c\x1fs"
+    def test_decode_valid_nodes(self) -> None:
+        nid = b"}\xe9P\x1d\x9ek\n\xfa\xfe\xc3 jc\xfa3\x1frtG\xb3"
+        encoded_nodes = b"".join(
+            nid + bytes(ip) + port.to_bytes(2, "big")
+            for ip, port in [
+                ((58, 224, 54, 156), 8051),
+                ((192, 168, 1, 1), 8051),
+                ((8, 8, 8, 8), 0),
+                ((8, 8, 8, 8), 6881),
+            ]
         )
-        nodes = decode_nodes(encoded_nodes)
-        node = Node(
-            nid=b"}\xe9P\x1d\x9ek\n\xfa\xfe\xc3 jc\xfa3\x1frtG\xb3",
-            address="58.224.54.156",
-            port=8051,
+        nodes = decode_valid_nodes(encoded_nodes)
+
+        assert nodes == [Node(nid, "58.224.54.156", 8051), Node(nid, "8.8.8.8", 6881)]
+        assert decode_valid_nodes(encoded_nodes, allow_reserved=True)[1] == Node(
+            nid, "192.168.1.1", 8051
         )
-        assert node.nid == nodes[0].nid
-        assert node.address == nodes[0].address
+
+    def test_decode_valid_peers(self) -> None:
+        values = [
+            bytes((58, 224, 54, 156)) + (8051).to_bytes(2, "big"),
+            bytes((10, 0, 0, 1)) + (8051).to_bytes(2, "big"),
+            bytes((8, 8, 8, 8)) + (0).to_bytes(2, "big"),
+            b"short",
+        ]
+
+        assert decode_valid_peers(values) == [("58.224.54.156", 8051)]
+        assert decode_valid_peers(values, allow_reserved=True) == [
+            ("58.224.54.156", 8051),
+            ("10.0.0.1", 8051),
+        ]
+
+    def test_is_reserved_ip(self) -> None:
+        def ip(address: str) -> int:
+            return int.from_bytes(bytes(map(int, address.split("."))), "big")
+
+        assert is_reserved_ip(ip("0.0.0.0"))
+        assert is_reserved_ip(ip("10.1.2.3"))
+        assert is_reserved_ip(ip("127.0.0.1"))
+        assert is_reserved_ip(ip("172.31.255.255"))
+        assert is_reserved_ip(ip("239.1.1.1"))
+        assert is_reserved_ip(ip("255.255.255.255"))
+        assert not is_reserved_ip(ip("172.32.0.0"))
+        assert not is_reserved_ip(ip("58.224.54.156"))
+        assert not is_reserved_ip(ip("8.8.8.8"))
 
     def test_generate_neighbor_nid(self) -> None:
         neighbor_nid = generate_neighbor_nid(